@@ -0,0 +1,287 @@
+"""
+Admission control for bulk write endpoints in Tag Manager V2
+
+SQLite has a single writer, so one large bulk assignment used to hold the
+write lock until it finished and every other edit waited behind it. Bulk
+operations now pass through a per-process controller:
+
+- at most BULK_MAX_CONCURRENT run at once; up to BULK_MAX_QUEUE more wait
+  (for at most BULK_QUEUE_TIMEOUT seconds) for a slot. Requests beyond that
+  are rejected with 429 and a Retry-After estimate, or queued as a
+  background job when the client sends `Prefer: respond-async` (see jobs.py).
+- admitted operations commit in chunks of BULK_CHUNK_SIZE products and are
+  paced to BULK_ROWS_PER_SECOND rows written, shared by all bulk work.
+- between chunks, interactive writes waiting in this process get the write
+  lock first, for at least BULK_INTERACTIVE_SHARE of the time.
+
+Limits are per worker process; counters are reported by /api/stats.
+"""
+
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+
+MAX_CONCURRENT = int(os.environ.get('BULK_MAX_CONCURRENT', '1'))
+MAX_QUEUE = int(os.environ.get('BULK_MAX_QUEUE', '4'))
+QUEUE_TIMEOUT = float(os.environ.get('BULK_QUEUE_TIMEOUT', '30'))
+ROWS_PER_SECOND = float(os.environ.get('BULK_ROWS_PER_SECOND', '50000'))
+CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '2000'))
+INTERACTIVE_SHARE = float(os.environ.get('BULK_INTERACTIVE_SHARE', '0.5'))
+
+
+class AdmissionRejected(Exception):
+    """Bulk work refused because the limits are reached; reported as 429"""
+
+    def __init__(self, message: str, retry_after: int, details: Optional[dict] = None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.details = details or {}
+
+
+def prefers_async(prefer_header: Optional[str]) -> bool:
+    """Whether a Prefer header (RFC 7240) asks for a queued job instead of waiting"""
+    if not prefer_header:
+        return False
+    return any(token.strip().lower() == 'respond-async' for token in prefer_header.split(','))
+
+
+class RowBudget:
+    """Token bucket of rows written per second, shared by all bulk work"""
+
+    def __init__(self, rows_per_second: float):
+        self.rate = rows_per_second
+        self._lock = threading.Lock()
+        self._tokens = rows_per_second
+        self._updated = time.monotonic()
+
+    def consume(self, rows: int) -> float:
+        """Take rows from the bucket, sleeping off any debt; returns seconds slept"""
+        if self.rate <= 0 or rows <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= rows
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class Ticket:
+    """
+    An admitted bulk operation.
+
+    Entering the ticket waits for a running slot; services call step() after
+    committing each chunk. close() gives back the queue reservation and is
+    safe to call more than once.
+    """
+
+    def __init__(self, controller: 'BulkAdmission', rows: int, reserved: bool,
+                 timeout: Optional[float]):
+        self.controller = controller
+        self.rows = rows
+        self.reserved = reserved
+        self.timeout = timeout
+        self.chunk_size = controller.chunk_size
+        self._waiting = reserved
+        self._running = False
+        self._chunk_started = None
+
+    def __enter__(self) -> 'Ticket':
+        self.controller._start(self)
+        self._running = True
+        self._chunk_started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def step(self, rows: int):
+        """Pace the operation after a committed chunk of rows"""
+        held = time.monotonic() - self._chunk_started
+        self.controller._pace(rows, held)
+        self._chunk_started = time.monotonic()
+
+    def close(self):
+        self.controller._finish(self)
+
+
+class BulkAdmission:
+    """Per-process limits on bulk write operations"""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, max_queue: int = MAX_QUEUE,
+                 rows_per_second: float = ROWS_PER_SECOND, chunk_size: int = CHUNK_SIZE,
+                 interactive_share: float = INTERACTIVE_SHARE, queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.chunk_size = chunk_size
+        self.interactive_share = min(max(interactive_share, 0.0), 0.95)
+        self.queue_timeout = queue_timeout
+        self.budget = RowBudget(rows_per_second)
+        self._reset_state()
+
+    def _reset_state(self):
+        self._cond = threading.Condition()
+        self.reserved = 0
+        self.reserved_rows = 0
+        self.waiting = 0
+        self.active = 0
+        self.interactive_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        self.rows_written = 0
+        self.throttled_seconds = 0.0
+        self.yielded_seconds = 0.0
+
+    def retry_after(self) -> int:
+        """Seconds until the work already admitted should have drained"""
+        if self.budget.rate <= 0:
+            return 1
+        return max(1, math.ceil(self.reserved_rows / self.budget.rate))
+
+    def _reject(self, message: str) -> AdmissionRejected:
+        return AdmissionRejected(message, self.retry_after(), {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'active': self.active,
+            'waiting': self.waiting,
+        })
+
+    def admit(self, rows: int = 0) -> Ticket:
+        """Reserve a place for a request, or raise AdmissionRejected"""
+        with self._cond:
+            if self.reserved >= self.max_concurrent + self.max_queue:
+                self.rejected += 1
+                raise self._reject('Too many bulk operations in progress')
+            self.reserved += 1
+            self.reserved_rows += rows
+            self.waiting += 1
+            self.admitted += 1
+        return Ticket(self, rows, reserved=True, timeout=self.queue_timeout)
+
+    def slot(self, rows: int = 0) -> Ticket:
+        """A ticket for queued jobs: waits for a running slot without a deadline"""
+        return Ticket(self, rows, reserved=False, timeout=None)
+
+    def _start(self, ticket: Ticket):
+        deadline = None if ticket.timeout is None else time.monotonic() + ticket.timeout
+        with self._cond:
+            while self.active >= self.max_concurrent:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.timed_out += 1
+                    error = self._reject('Timed out waiting for a bulk operation slot')
+                    self._release(ticket)
+                    raise error
+                self._cond.wait(remaining)
+            self._stop_waiting(ticket)
+            self.active += 1
+
+    def _stop_waiting(self, ticket: Ticket):
+        # Caller holds the condition
+        if ticket._waiting:
+            ticket._waiting = False
+            self.waiting -= 1
+
+    def _release(self, ticket: Ticket):
+        # Caller holds the condition
+        self._stop_waiting(ticket)
+        if ticket.reserved:
+            ticket.reserved = False
+            self.reserved -= 1
+            self.reserved_rows -= ticket.rows
+            self._cond.notify_all()
+
+    def _finish(self, ticket: Ticket):
+        with self._cond:
+            if ticket._running:
+                ticket._running = False
+                self.active -= 1
+                self.completed += 1
+                self._cond.notify_all()
+            self._release(ticket)
+
+    def _pace(self, rows: int, held: float):
+        throttled = self.budget.consume(rows)
+        share = self.interactive_share
+        # Let waiting interactive writes in: yield long enough that they get
+        # at least `share` of the time the bulk work holds the write lock
+        limit = time.monotonic() + held * share / (1 - share)
+        started = time.monotonic()
+        with self._cond:
+            self.rows_written += rows
+            self.throttled_seconds += throttled
+            while self.interactive_waiting:
+                remaining = limit - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self.yielded_seconds += time.monotonic() - started
+
+    @contextmanager
+    def interactive_write(self):
+        """Mark an interactive write as waiting for, then holding, the write lock"""
+        with self._cond:
+            self.interactive_waiting += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.interactive_waiting -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'rows_per_second': self.budget.rate,
+                'interactive_share': self.interactive_share,
+                'active': self.active,
+                'waiting': self.waiting,
+                'queued_rows': self.reserved_rows,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'completed': self.completed,
+                'rows_written': self.rows_written,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'yielded_seconds': round(self.yielded_seconds, 3),
+                'interactive_waiting': self.interactive_waiting,
+            }
+
+    def reset_after_fork(self):
+        self._reset_state()
+
+
+bulk = BulkAdmission()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=bulk.reset_after_fork)
+
+metrics.register_collector(lambda: metrics.families_from_stats(
+    'bulk', 'Bulk write admission', 'controller', {'bulk': bulk.stats()},
+    counters=('admitted', 'rejected', 'timed_out', 'completed', 'rows_written',
+              'throttled_seconds', 'yielded_seconds')
+))
+
+
+def interactive(fn):
+    """Mark a service function as an interactive write that bulk work yields to"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with bulk.interactive_write():
+            return fn(*args, **kwargs)
+    return wrapper
@@ -1,11 +1,44 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, g, jsonify, request, render_template
+from flask.json.provider import DefaultJSONProvider
 import json
-import sqlite3
-import pandas as pd
 import os
+import time
 from flask_talisman import Talisman  # Add security headers
+from serialization import NDJSON_MIMETYPE, iter_ndjson, prefers_ndjson
+from compression import PrecompressedCache, compress_flask_response
+from singleflight import flights
+from database import connect as get_db_connection, get_db_connection_context
+import admission
+import changefeed
+import invalidation
+import jobs
+import metrics
+import profiling
+import rollups
+import services
+import sqltrace
+import warmup
+from services import ServiceError
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, also counting serialization time for Server-Timing."""
+
+    def dumps(self, obj, **kwargs):
+        request_metrics = metrics.current_request.get()
+        if request_metrics is None:
+            return super().dumps(obj, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            request_metrics.serialize_seconds += time.perf_counter() - started
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
+
+# Only installed when PROFILING_TOKEN is set
+if profiling.ENABLED:
+    app.wsgi_app = profiling.ProfilingWSGIMiddleware(app.wsgi_app)
 
 # Security headers configuration
 Talisman(app, 
@@ -18,111 +51,234 @@ Talisman(app,
     force_https=False  # Set to True in production
 )
 
-# Database configuration
-DATABASE = 'data/products.db'
-
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def ensure_table_schema():
-    """Ensure the product_categories and product_category_mapping tables have the correct schema."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if product_categories table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='product_categories'")
-    if cursor.fetchone() is None:
-        cursor.execute('''
-            CREATE TABLE product_categories (
-                product_id TEXT PRIMARY KEY,
-                product_name TEXT NOT NULL,
-                last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    else:
-        # Add last_modified column if it doesn't exist
-        cursor.execute("PRAGMA table_info(product_categories)")
-        columns = [column[1] for column in cursor.fetchall()]
-        if 'last_modified' not in columns:
-            # Create a new table with the desired schema
-            cursor.execute('''
-                CREATE TABLE product_categories_new (
-                    product_id TEXT PRIMARY KEY,
-                    product_name TEXT NOT NULL,
-                    last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Copy data from old table to new table
-            cursor.execute('''
-                INSERT INTO product_categories_new (product_id, product_name, last_modified)
-                SELECT product_id, product_name, CURRENT_TIMESTAMP
-                FROM product_categories
-            ''')
-            
-            # Drop old table and rename new table
-            cursor.execute('DROP TABLE product_categories')
-            cursor.execute('ALTER TABLE product_categories_new RENAME TO product_categories')
-    
-    # Check if product_category_mapping table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='product_category_mapping'")
-    if cursor.fetchone() is None:
-        cursor.execute('''
-            CREATE TABLE product_category_mapping (
-                product_id TEXT,
-                category_id TEXT,
-                PRIMARY KEY (product_id, category_id),
-                FOREIGN KEY (product_id) REFERENCES product_categories(product_id)
-            )
-        ''')
-    
-    conn.commit()
-    conn.close()
+# Precompressed payloads for category trees, export snapshots and status lists
+response_cache = PrecompressedCache()
+for scope in invalidation.DATA_SCOPES:
+    invalidation.subscribe(scope, response_cache.invalidate)
+metrics.register_cache('responses', lambda: (response_cache.hits, response_cache.misses))
+
+def service_error_response(error):
+    """Convert a ServiceError into the JSON error format used by this app."""
+    body = {'error': error.message, 'request_id': metrics.current_request_id()}
+    if error.details:
+        body['details'] = error.details
+    retry_after = getattr(error, 'retry_after', None)
+    headers = {'Retry-After': str(retry_after)} if retry_after else {}
+    return jsonify(body), error.status_code, headers
+
+@app.before_request
+def label_write_endpoint():
+    """Tag database writes made by this request with its route for write metrics."""
+    if request.url_rule is not None:
+        services.write_endpoint.set(f'{request.method} {request.url_rule.rule}')
+
+@app.before_request
+def begin_request_metrics():
+    """Start per-request accounting of latency and database work."""
+    request_id = metrics.accept_request_id(request.headers.get(metrics.REQUEST_ID_HEADER))
+    g.request_metrics = metrics.begin_request(request_id)
+
+@app.after_request
+def end_request_metrics(response):
+    """Record the request once its body, possibly streamed, has been sent."""
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method, status = request.method, response.status_code
+        response.headers[metrics.REQUEST_ID_HEADER] = request_metrics.request_id
+        response.headers['Server-Timing'] = metrics.server_timing(request_metrics)
+        response.call_on_close(lambda: metrics.end_request(request_metrics, route, method, status))
+    return response
+
+def admission_rejected_response(error):
+    """Convert an AdmissionRejected into a 429 with Retry-After."""
+    body = {
+        'error': error.message,
+        'details': {**error.details, 'retry_after': error.retry_after},
+        'request_id': metrics.current_request_id(),
+    }
+    return jsonify(body), 429, {'Retry-After': str(error.retry_after)}
+
+def admitted_bulk(kind, payload, respond):
+    """
+    Run a bulk write under admission control, or queue it as a job.
+
+    Clients sending `Prefer: respond-async` get 202 and a job status URL;
+    otherwise the operation runs paced in this request and respond(stats)
+    builds the response. Over-limit requests raise AdmissionRejected.
+    """
+    if admission.prefers_async(request.headers.get('Prefer')):
+        with get_db_connection_context() as conn:
+            job = jobs.submit(conn, kind, payload)
+        body = {'message': 'Bulk operation queued', 'job': job}
+        return jsonify(body), 202, {'Location': f"/api/jobs/{job['job_id']}"}
+
+    with admission.bulk.admit(jobs.job_rows(payload)) as ticket:
+        with get_db_connection_context() as conn:
+            stats = jobs.HANDLERS[kind](conn, payload, ticket)
+    return respond(stats)
+
+def wants_ndjson():
+    """Whether the client asked for a newline-delimited JSON stream."""
+    return prefers_ndjson(request.headers.get('Accept'))
+
+def stream_ndjson(query, params, row_to_dict):
+    """Stream query results row batches as NDJSON straight from the cursor."""
+    def generate():
+        # Create new connection inside generator
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            yield from iter_ndjson(cursor, row_to_dict)
+        finally:
+            conn.close()
 
-# Initialize database with products from CSV
-def init_products():
-    if not os.path.exists('data/input_file.csv'):
-        return
-    
-    ensure_table_schema()  # Ensure table has correct schema
-    
-    df = pd.read_csv('data/input_file.csv')
-    products = df[['Handle', 'Title']].values.tolist()
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Insert products if they don't exist
-    for handle, title in products:
-        cursor.execute(
-            "INSERT OR IGNORE INTO product_categories (product_id, product_name) VALUES (?, ?)",
-            (handle, title)
+    return app.response_class(generate(), mimetype=NDJSON_MIMETYPE)
+
+def json_bytes(data):
+    """Encode data exactly as jsonify would, for storing in the response cache."""
+    return app.json.response(data).get_data()
+
+def cached_response(key, scopes, build, mimetype='application/json', headers=None):
+    """Serve a payload from the precompressed cache with ETag revalidation."""
+    version = invalidation.version(*scopes)
+    # Routes opted into single-flight share one build among concurrent requests
+    payload = flights.do(key, version, lambda: response_cache.get_or_build(
+        key, version, lambda: (build(), mimetype), headers, scopes
+    ))
+    status, body, payload_headers = payload.negotiate(
+        request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match')
+    )
+    return app.response_class(body, status=status, mimetype=payload.media_type, headers=payload_headers)
+
+@app.after_request
+def compress_response(response):
+    """Compress large compressible responses for clients that accept it."""
+    return compress_flask_response(response, request.headers.get('Accept-Encoding', ''))
+
+def product_list_row(product):
+    """Convert a product row to the /api/products shape."""
+    product_dict = dict(product)
+    product_dict['has_allocations'] = product_dict['category_count'] > 0
+    del product_dict['category_count']
+    return product_dict
+
+def category_counts(counts, name):
+    """Direct and subtree product counts of a category for listing entries."""
+    direct, subtree = counts.get(name, (0, 0))
+    return {'product_count': direct, 'subtree_product_count': subtree}
+
+def warm_caches():
+    """Build the taxonomy index and cached category payloads before serving traffic."""
+    # Category reads never rebuild the counts, so bring them up to date first
+    with get_db_connection_context() as conn:
+        rollups.ensure_current(conn)
+    with app.test_client() as client:
+        for url in warmup.category_urls():
+            for encoding in warmup.warm_encodings():
+                client.get(url, headers={'Accept-Encoding': encoding}).close()
+    warmup.mark_preloaded()
+
+def warm_worker():
+    """Per-process warm-up; run in each worker after fork, or once before serving."""
+    # serve.py warms the shared caches once in the master before forking;
+    # the import is started here, after fork, so no thread is forked mid-flight
+    warmup.import_products()
+    if not warmup.is_preloaded():
+        warm_caches()
+    with get_db_connection_context() as conn:
+        warmup.prepare_statements(conn)
+    jobs.start()
+    warmup.mark_ready()
+
+@app.route('/api/stats')
+def get_stats():
+    """Runtime counters: request coalescing, bulk admission and SQL statements."""
+    with get_db_connection_context() as conn:
+        bulk_jobs = jobs.queue_stats(conn)
+    return jsonify({
+        'single_flight': flights.stats(),
+        'bulk_admission': admission.bulk.stats(),
+        'bulk_jobs': bulk_jobs,
+        'write_transactions': services.write_metrics.stats(),
+        'statements': sqltrace.statement_stats.stats(),
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics for this worker process."""
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def profiling_admin_error():
+    """Error response refusing profile admin requests without the token, or None."""
+    token = request.headers.get(profiling.HEADER) or request.args.get(profiling.QUERY_PARAM)
+    error = profiling.admin_error(token)
+    if error is not None:
+        return jsonify({'error': error[1]}), error[0]
+    return None
+
+@app.route('/api/admin/profiles')
+def list_profiles():
+    """Profiled requests kept in this worker's ring buffer, newest first."""
+    return profiling_admin_error() or jsonify(profiling.profiles.list())
+
+@app.route('/api/admin/profiles/<profile_id>')
+def get_profile(profile_id):
+    """A kept profile as a cumulative-time summary or a pstats file download."""
+    error = profiling_admin_error()
+    if error is not None:
+        return error
+    record = profiling.profiles.get(profile_id)
+    if record is None:
+        return jsonify({'error': f'Profile {profile_id} not found'}), 404
+    if request.args.get('format') == 'pstats':
+        return app.response_class(
+            record.pstats,
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename={profile_id}.prof'}
         )
-    
-    conn.commit()
-    conn.close()
+    return app.response_class(record.summary, mimetype='text/plain')
 
-# Initialize the database when starting the app
-with app.app_context():
-    ensure_table_schema()  # Ensure schema is correct even if no CSV file
-    init_products()
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Status and result of a queued bulk operation."""
+    try:
+        with get_db_connection_context() as conn:
+            return jsonify(jobs.get_job(conn, job_id))
+    except ServiceError as e:
+        return service_error_response(e)
+
+@app.route('/api/ready')
+def ready():
+    """Readiness probe: 200 once this process has warmed its caches."""
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/api/events')
+def change_events():
+    """Stream mapping and taxonomy changes to editors as Server-Sent Events."""
+    last_event_id = changefeed.parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    return app.response_class(
+        changefeed.iter_sse(last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/products')
 def get_products():
     # Get the hide_allocated query parameter
     hide_allocated = request.args.get('hide_allocated', 'false').lower() == 'true'
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Base query with category count
     base_query = '''
-        SELECT pc.*, 
-               (SELECT COUNT(*) 
-                FROM product_category_mapping pcm 
-                WHERE pcm.product_id = pc.product_id) AS category_count
+        SELECT pc.product_id, pc.product_name, pc.last_modified,
+               (SELECT COUNT(*)
+                FROM product_category_links l
+                WHERE l.product_int = pc.product_int) AS category_count
         FROM product_categories pc
     '''
     
@@ -132,20 +288,62 @@ def get_products():
     
     base_query += ' ORDER BY LOWER(pc.product_name) ASC'
     
+    if wants_ndjson():
+        return stream_ndjson(base_query, (), product_list_row)
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute(base_query)
     products = cursor.fetchall()
     conn.close()
     
     # Convert to list of dicts and add has_allocations flag
-    result = []
-    for product in products:
-        product_dict = dict(product)
-        product_dict['has_allocations'] = product_dict['category_count'] > 0
-        del product_dict['category_count']
-        result.append(product_dict)
+    result = [product_list_row(product) for product in products]
         
     return jsonify(result)
 
+@app.route('/api/products/page')
+def get_product_page():
+    """A page of products with their resolved categories and counts, in one query."""
+    try:
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_product_page(
+                conn,
+                limit=request.args.get('limit', services.PAGE_LIMIT, type=int),
+                offset=request.args.get('offset', 0, type=int),
+                hide_allocated=request.args.get('hide_allocated', 'false').lower() == 'true'
+            ))
+    except ServiceError as e:
+        return service_error_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/products/query', methods=['POST'])
+def query_products():
+    """Products matching a boolean expression over categories."""
+    # Validated with the FastAPI request model; pydantic is only loaded here
+    from pydantic import ValidationError
+    from models import ProductQueryRequest
+
+    try:
+        query = ProductQueryRequest.model_validate(request.get_json(silent=True))
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Validation Error',
+            'details': {'validation_errors': e.errors(include_url=False, include_context=False)},
+            'request_id': metrics.current_request_id()
+        }), 400
+
+    try:
+        with get_db_connection_context() as conn:
+            return jsonify(services.query_products(
+                conn, query.expression, query.limit, query.offset, query.count_only
+            ))
+    except ServiceError as e:
+        return service_error_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/products/bulk-categories', methods=['POST'])
 def get_bulk_product_categories():
     """Get categories for multiple products in a single request."""
@@ -154,85 +352,19 @@ def get_bulk_product_categories():
         if not product_ids:
             return jsonify({})
 
-        # Get all categories for the products
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create a placeholder string for the IN clause
-        placeholders = ','.join(['?'] * len(product_ids))
-        query = f'''
-            SELECT product_id, category_id 
-            FROM product_category_mapping 
-            WHERE product_id IN ({placeholders})
-        '''
-        
-        cursor.execute(query, product_ids)
-        rows = cursor.fetchall()
-        
-        # Get category details from JSON file
-        with open('data/category.json') as f:
-            all_categories = json.load(f)
-        
-        # Group categories by product_id
-        categories_map = {}
-        for row in rows:
-            product_id, category_id = row
-            if product_id not in categories_map:
-                categories_map[product_id] = []
-            
-            # Find category details
-            category = next((cat for cat in all_categories if cat['category_name'] == category_id), None)
-            if category:
-                categories_map[product_id].append({
-                    'id': category['category_name'],
-                    'name': category['category_name'],
-                    'level': category['category_level'],
-                    'parent': category.get('connected_to')
-                })
-        
-        return jsonify(categories_map)
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_bulk_product_categories(conn, product_ids))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/<product_id>/categories', methods=['GET'])
 def get_product_categories(product_id):
     """Get all categories for a specific product."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get all categories for the product
-        cursor.execute('''
-            SELECT category_id 
-            FROM product_category_mapping 
-            WHERE product_id = ?
-        ''', (product_id,))
-        
-        category_ids = [row[0] for row in cursor.fetchall()]
-        
-        # Get category details from JSON file
-        with open('data/category.json') as f:
-            all_categories = json.load(f)
-        
-        # Format categories with their full details
-        categories = []
-        for category_id in category_ids:
-            category = next((cat for cat in all_categories if cat['category_name'] == category_id), None)
-            if category:
-                categories.append({
-                    'id': category['category_name'],
-                    'name': category['category_name'],
-                    'level': category['category_level'],
-                    'parent': category.get('connected_to')
-                })
-        
-        return jsonify(categories)
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_product_categories(conn, product_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/products/<product_id>/categories', methods=['POST'])
@@ -241,85 +373,28 @@ def assign_categories(product_id):
         data = request.get_json()
         category_ids = data.get('category_ids', [])
         
-        if not category_ids:
-            return jsonify({'error': 'No categories provided'}), 400
-            
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get current categories
-        cursor.execute('''
-            SELECT category_id 
-            FROM product_category_mapping 
-            WHERE product_id = ?
-        ''', (product_id,))
-        current_categories = {row[0] for row in cursor.fetchall()}
-        
-        # Get parent categories for all selected categories
-        parent_categories = set()
-        for category_id in category_ids:
-            # Read categories from JSON file
-            with open('data/category.json') as f:
-                categories = json.load(f)
-            
-            # Find the category and its parents
-            current_category = next((cat for cat in categories if cat['category_name'] == category_id), None)
-            while current_category and current_category.get('connected_to'):
-                parent_name = current_category['connected_to']
-                parent_categories.add(parent_name)
-                current_category = next((cat for cat in categories if cat['category_name'] == parent_name), None)
-        
-        # Combine all categories to add (including parents)
-        categories_to_add = set(category_ids) | parent_categories
-        
-        # Update last_modified timestamp
-        cursor.execute('''
-            UPDATE product_categories 
-            SET last_modified = CURRENT_TIMESTAMP 
-            WHERE product_id = ?
-        ''', (product_id,))
-        
-        # Add all missing categories
-        added_categories = []
-        for category_id in categories_to_add:
-            if category_id not in current_categories:
-                try:
-                    cursor.execute(
-                        'INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)',
-                        (product_id, category_id)
-                    )
-                    added_categories.append(category_id)
-                except sqlite3.IntegrityError:
-                    continue
-        
-        conn.commit()
-        
-        # Return the updated list of categories
-        cursor.execute('''
-            SELECT category_id 
-            FROM product_category_mapping 
-            WHERE product_id = ?
-        ''', (product_id,))
-        updated_categories = [row[0] for row in cursor.fetchall()]
+        with get_db_connection_context() as conn:
+            result = services.assign_categories(conn, product_id, category_ids)
         
         return jsonify({
             'message': 'Categories assigned successfully',
-            'added_categories': added_categories,
-            'parent_categories_added': len(parent_categories - set(category_ids)),
-            'categories': updated_categories
+            'added_categories': result['added_categories'],
+            'parent_categories_added': result['parent_categories_added'],
+            'categories': result['categories']
         })
         
+    except ServiceError as e:
+        return service_error_response(e)
     except Exception as e:
-        conn.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/categories')
 def get_categories():
-    try:
+    def build():
         with open('data/category.json') as f:
             categories = json.load(f)
+        with get_db_connection_context() as conn:
+            counts = rollups.get_counts(conn)
         
         # Format categories for dropdown - show hierarchy
         formatted_categories = []
@@ -328,24 +403,31 @@ def get_categories():
                 formatted_categories.append({
                     'id': cat['category_name'],
                     'name': cat['category_name'],
-                    'level': 1
+                    'level': 1,
+                    **category_counts(counts, cat['category_name'])
                 })
             elif cat['connected_to']:
                 formatted_categories.append({
                     'id': cat['category_name'],
                     'name': f"{cat['connected_to']} > {cat['category_name']}",
-                    'level': 2 if cat['category_level'] == 'Level 2 Category' else 3
+                    'level': 2 if cat['category_level'] == 'Level 2 Category' else 3,
+                    **category_counts(counts, cat['category_name'])
                 })
         
-        return jsonify(formatted_categories)
+        return json_bytes(formatted_categories)
+
+    try:
+        return cached_response('categories:all', ('products', 'taxonomy'), build)
     except FileNotFoundError:
         return jsonify({'error': 'Categories file not found'}), 404
 
 @app.route('/api/categories/level1')
 def get_level1_categories():
-    try:
+    def build():
         with open('data/category.json') as f:
             categories = json.load(f)
+        with get_db_connection_context() as conn:
+            counts = rollups.get_counts(conn)
         
         # Get all level 1 categories
         level1_categories = [
@@ -353,6 +435,7 @@ def get_level1_categories():
                 'id': cat['category_name'],
                 'name': cat['category_name'],
                 'level': 1,
+                **category_counts(counts, cat['category_name']),
                 'hasChildren': any(
                     subcat['category_level'] == 'Level 2 Category' and 
                     subcat['connected_to'] == cat['category_name']
@@ -363,21 +446,27 @@ def get_level1_categories():
             if cat['category_level'] == 'Level 1 Category'
         ]
         
-        return jsonify(level1_categories)
+        return json_bytes(level1_categories)
+
+    try:
+        return cached_response('categories:level1', ('products', 'taxonomy'), build)
     except FileNotFoundError:
         return jsonify({'error': 'Categories file not found'}), 404
 
 @app.route('/api/categories/level2/<parent>')
 def get_level2_categories(parent):
-    try:
+    def build():
         with open('data/category.json') as f:
             categories = json.load(f)
+        with get_db_connection_context() as conn:
+            counts = rollups.get_counts(conn)
         
         level2_categories = [
             {
                 'id': cat['category_name'],
                 'name': cat['category_name'],
                 'level': 2,
+                **category_counts(counts, cat['category_name']),
                 'hasChildren': any(
                     subcat['category_level'] == 'Level 3 Category' and 
                     subcat['connected_to'] == cat['category_name']
@@ -388,77 +477,77 @@ def get_level2_categories(parent):
             if cat['category_level'] == 'Level 2 Category' and cat['connected_to'] == parent
         ]
         
-        return jsonify(level2_categories)
+        return json_bytes(level2_categories)
+
+    try:
+        return cached_response(('categories:level2', parent), ('products', 'taxonomy'), build)
     except FileNotFoundError:
         return jsonify({'error': 'Categories file not found'}), 404
 
 @app.route('/api/categories/level3/<parent>')
 def get_level3_categories(parent):
-    try:
+    def build():
         with open('data/category.json') as f:
             categories = json.load(f)
+        with get_db_connection_context() as conn:
+            counts = rollups.get_counts(conn)
         
         level3_categories = [
             {
                 'id': cat['category_name'],
                 'name': cat['category_name'],
                 'level': 3,
+                **category_counts(counts, cat['category_name']),
                 'hasChildren': False  # Level 3 categories don't have children
             }
             for cat in categories
             if cat['category_level'] == 'Level 3 Category' and cat['connected_to'] == parent
         ]
         
-        return jsonify(level3_categories)
+        return json_bytes(level3_categories)
+
+    try:
+        return cached_response(('categories:level3', parent), ('products', 'taxonomy'), build)
     except FileNotFoundError:
         return jsonify({'error': 'Categories file not found'}), 404
 
+@app.route('/api/categories/tree')
+def get_category_tree():
+    """The category hierarchy as nested nodes with child and product counts."""
+    root = request.args.get('root') or None
+    depth = request.args.get('depth', type=int)
+
+    def build():
+        with get_db_connection_context() as conn:
+            return json_bytes(services.get_category_tree(conn, root, depth))
+
+    try:
+        return cached_response(('categories:tree', root, depth), ('products', 'taxonomy'), build)
+    except ServiceError as e:
+        return service_error_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/products/<product_id>/category/<category_id>', methods=['DELETE'])
 def remove_category(product_id, category_id):
     """Remove a category from a product."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Update last_modified timestamp
-        cursor.execute('''
-            UPDATE product_categories 
-            SET last_modified = CURRENT_TIMESTAMP 
-            WHERE product_id = ?
-        ''', (product_id,))
-        
-        # Remove category mapping
-        cursor.execute('''
-            DELETE FROM product_category_mapping 
-            WHERE product_id = ? AND category_id = ?
-        ''', (product_id, category_id))
-        
-        conn.commit()
+        with get_db_connection_context() as conn:
+            services.remove_category(conn, product_id, category_id)
         return jsonify({'message': 'Category removed successfully'})
-    except sqlite3.Error as e:
-        conn.rollback()
+    except ServiceError as e:
+        return service_error_response(e)
+    except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/<product_id>/last-modified', methods=['GET'])
 def get_product_last_modified(product_id):
     """Get the last modified timestamp for a product."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT last_modified 
-        FROM product_categories 
-        WHERE product_id = ?
-    ''', (product_id,))
-    
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return jsonify({'last_modified': result['last_modified']})
-    return jsonify({'error': 'Product not found'}), 404
+    try:
+        with get_db_connection_context() as conn:
+            return jsonify({'last_modified': services.get_product_last_modified(conn, product_id)})
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code
 
 @app.route('/')
 def index():
@@ -469,87 +558,22 @@ def create_category():
     """Create a new category and add it to the category.json file."""
     try:
         data = request.get_json()
-        print(f"Received data: {data}")  # Debug log
         
         if not data or 'name' not in data or 'level' not in data:
-            print("Missing required fields")  # Debug log
             return jsonify({'error': 'Missing required fields'}), 400
         
-        # Validate level
-        if data['level'] not in [1, 2, 3]:
-            print(f"Invalid level: {data['level']}")  # Debug log
-            return jsonify({'error': 'Invalid category level'}), 400
-        
-        # Validate parent for level 2 and 3
-        if data['level'] > 1 and 'parent_id' not in data:
-            print("Missing parent_id for level 2 or 3 category")  # Debug log
-            return jsonify({'error': 'Parent category required for level 2 and 3 categories'}), 400
+        with get_db_connection_context() as conn:
+            new_category = services.create_category(conn, data['name'], data['level'], data.get('parent_id'))
         
-        try:
-            # Read existing categories
-            with open('data/category.json', 'r') as f:
-                categories = json.load(f)
-            
-            # Check for duplicate category name
-            existing_category = next((cat for cat in categories if cat['category_name'] == data['name']), None)
-            if existing_category:
-                print(f"Duplicate category name: {data['name']}")  # Debug log
-                error_message = {
-                    'error': 'Category name already exists',
-                    'details': {
-                        'existing_category': {
-                            'name': existing_category['category_name'],
-                            'level': existing_category['category_level'],
-                            'parent': existing_category['connected_to']
-                        },
-                        'attempted_category': {
-                            'name': data['name'],
-                            'level': f'Level {data["level"]} Category',
-                            'parent': data.get('parent_id')
-                        }
-                    }
-                }
-                return jsonify(error_message), 400
-            
-            # Create new category
-            new_category = {
-                'category_name': data['name'],
-                'category_level': f'Level {data["level"]} Category',
-                'connected_to': data.get('parent_id') if data['level'] > 1 else None
-            }
-            
-            # Add to categories list
-            categories.append(new_category)
-            
-            # Write back to file
-            with open('data/category.json', 'w') as f:
-                json.dump(categories, f, indent=2)
-            
-            # Sync to database immediately
-            try:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO categories (id, category_level, connected_to)
-                    VALUES (?, ?, ?)
-                ''', (new_category['category_name'], new_category['category_level'], new_category['connected_to']))
-                conn.commit()
-                conn.close()
-            except Exception as sync_error:
-                print(f"Warning: Failed to sync category to database: {sync_error}")
-            
-            print(f"Successfully created category: {new_category}")  # Debug log
-            return jsonify({
-                'message': 'Category created successfully',
-                'category': new_category
-            })
-            
-        except Exception as e:
-            print(f"Error handling category file: {str(e)}")  # Debug log
-            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'message': 'Category created successfully',
+            'category': new_category
+        })
             
+    except ServiceError as e:
+        return service_error_response(e)
     except Exception as e:
-        print(f"Error in create_category endpoint: {str(e)}")  # Debug log
+        app.logger.error(f"Error in create_category endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories/delete', methods=['DELETE'])
@@ -557,218 +581,70 @@ def delete_category():
     """Delete a category and remove it from all products."""
     try:
         data = request.get_json()
-        print(f"Received delete data: {data}")  # Debug log
         
         if not data or 'category_name' not in data:
-            print("Missing category_name field")  # Debug log
             return jsonify({'error': 'Missing category_name field'}), 400
         
-        category_name = data['category_name']
+        with get_db_connection_context() as conn:
+            details = services.delete_category(conn, data['category_name'])
         
-        try:
-            # Read existing categories
-            with open('data/category.json', 'r') as f:
-                categories = json.load(f)
-            
-            # Find the category to delete
-            category_to_delete = next((cat for cat in categories if cat['category_name'] == category_name), None)
-            if not category_to_delete:
-                print(f"Category not found: {category_name}")  # Debug log
-                return jsonify({'error': 'Category not found'}), 404
-            
-            # Check for child categories
-            child_categories = [cat for cat in categories if cat.get('connected_to') == category_name]
-            if child_categories:
-                child_names = [cat['category_name'] for cat in child_categories]
-                print(f"Category has child categories: {child_names}")  # Debug log
-                return jsonify({
-                    'error': 'Cannot delete category with child categories',
-                    'details': {
-                        'category': category_name,
-                        'child_categories': child_names,
-                        'message': 'Please delete all child categories first'
-                    }
-                }), 400
-            
-            # Get database connection
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Start transaction
-            cursor.execute('BEGIN TRANSACTION')
-            
-            try:
-                # Get count of products that have this category assigned
-                cursor.execute('''
-                    SELECT COUNT(*) 
-                    FROM product_category_mapping 
-                    WHERE category_id = ?
-                ''', (category_name,))
-                product_count = cursor.fetchone()[0]
-                print(f"Found {product_count} products with category {category_name}")  # Debug log
-                
-                # Remove category from all products
-                cursor.execute('''
-                    DELETE FROM product_category_mapping 
-                    WHERE category_id = ?
-                ''', (category_name,))
-                removed_from_products = cursor.rowcount
-                print(f"Removed from {removed_from_products} product assignments")  # Debug log
-                
-                # Remove category from categories table
-                cursor.execute('''
-                    DELETE FROM categories 
-                    WHERE id = ?
-                ''', (category_name,))
-                removed_from_categories = cursor.rowcount
-                print(f"Removed from categories table: {removed_from_categories} rows")  # Debug log
-                
-                # Update last_modified for affected products
-                cursor.execute('''
-                    UPDATE product_categories 
-                    SET last_modified = CURRENT_TIMESTAMP 
-                    WHERE product_id IN (
-                        SELECT DISTINCT product_id 
-                        FROM product_category_mapping 
-                        WHERE category_id = ?
-                    )
-                ''', (category_name,))
-                
-                # Commit database transaction
-                conn.commit()
-                
-                # Remove from JSON file
-                updated_categories = [cat for cat in categories if cat['category_name'] != category_name]
-                
-                # Write back to file
-                with open('data/category.json', 'w') as f:
-                    json.dump(updated_categories, f, indent=2)
-                
-                print(f"Successfully deleted category: {category_name}")  # Debug log
-                return jsonify({
-                    'message': 'Category deleted successfully',
-                    'details': {
-                        'category': category_to_delete,
-                        'removed_from_products': removed_from_products,
-                        'removed_from_categories_table': removed_from_categories
-                    }
-                })
-                
-            except Exception as db_error:
-                # Rollback database transaction on error
-                conn.rollback()
-                print(f"Database error during deletion: {str(db_error)}")  # Debug log
-                raise db_error
-            finally:
-                conn.close()
-            
-        except Exception as e:
-            print(f"Error handling category deletion: {str(e)}")  # Debug log
-            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'message': 'Category deleted successfully',
+            'details': details
+        })
             
+    except ServiceError as e:
+        return service_error_response(e)
     except Exception as e:
-        print(f"Error in delete_category endpoint: {str(e)}")  # Debug log
+        app.logger.error(f"Error in delete_category endpoint: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/categories/<category_name>', methods=['PUT'])
+def update_category(category_name):
+    """Rename a category and/or move it, with everything below it, under another parent."""
+    try:
+        data = request.get_json() or {}
+        changes = {key: data[key] for key in ('name', 'parent_id', 'level') if key in data}
+
+        with get_db_connection_context() as conn:
+            details = services.update_category(conn, category_name, changes)
+
+        return jsonify({
+            'message': 'Category updated successfully',
+            'details': details
+        })
+
+    except ServiceError as e:
+        return service_error_response(e)
+    except Exception as e:
+        app.logger.error(f"Error in update_category endpoint: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories/<category_name>/info', methods=['GET'])
 def get_category_info(category_name):
     """Get detailed information about a category including product and child counts."""
     try:
-        # Read categories from JSON
-        with open('data/category.json', 'r') as f:
-            categories = json.load(f)
-        
-        # Find the category
-        category = next((cat for cat in categories if cat['category_name'] == category_name), None)
-        if not category:
-            return jsonify({'error': 'Category not found'}), 404
-        
-        # Get database connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Get count of products assigned to this category
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM product_category_mapping 
-                WHERE category_id = ?
-            ''', (category_name,))
-            product_count = cursor.fetchone()[0]
-            
-            # Get count of child categories
-            child_categories = [cat for cat in categories if cat.get('connected_to') == category_name]
-            child_count = len(child_categories)
-            
-            return jsonify({
-                'name': category['category_name'],
-                'level': category['category_level'],
-                'parent': category.get('connected_to', 'None'),
-                'product_count': product_count,
-                'child_count': child_count,
-                'child_categories': [cat['category_name'] for cat in child_categories]
-            })
-            
-        finally:
-            conn.close()
-            
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_category_info(conn, category_name))
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code
     except Exception as e:
-        print(f"Error getting category info: {str(e)}")  # Debug log
+        app.logger.error(f"Error getting category info: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/export/csv')
 def export_csv():
-    """Export product categories as CSV with streaming response."""
-    def generate():
-        # Yield CSV header
-        yield 'product_id,product_name,categories\n'
-        
-        # Create new connection inside generator
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Existing query remains the same
-            query = '''
-                SELECT pc.product_id, pc.product_name,
-                       COALESCE(GROUP_CONCAT(pcm.category_id, ','), '') AS category_ids
-                FROM product_categories pc
-                LEFT JOIN product_category_mapping pcm ON pc.product_id = pcm.product_id
-                GROUP BY pc.product_id, pc.product_name
-                ORDER BY LOWER(pc.product_name)
-            '''
-            
-            cursor.execute(query)
-            
-            # Load categories and create lookup set
-            with open('data/category.json') as f:
-                categories = json.load(f)
-            valid_categories = {cat['category_name'] for cat in categories}
-            
-            for row in cursor:
-                category_ids = row['category_ids'].split(',') if row['category_ids'] else []
-                
-                # Get only leaf category names (no hierarchy)
-                formatted_categories = [
-                    cat_id for cat_id in category_ids
-                    if cat_id in valid_categories  # Ensure category exists
-                ]
-                
-                # Proper CSV escaping
-                product_id = row["product_id"].replace('"', '""')
-                product_name = row["product_name"].replace('"', '""')
-                # Modified category formatting
-                cats = ", ".join(c.replace('"', '""') for c in formatted_categories) if formatted_categories else "No Categories"
-                
-                # Single cell for all categories
-                yield f'"{product_id}","{product_name}","{cats}"\n'
-                
-        finally:
-            conn.close()
+    """Export product categories as CSV from a cached, precompressed snapshot."""
+    def build():
+        with get_db_connection_context() as conn:
+            return services.export_csv_bytes(conn)
 
     try:
-        return app.response_class(
-            generate(),
+        # The snapshot is rebuilt only after a commit or a taxonomy change
+        return cached_response(
+            'export:csv',
+            ('products', 'taxonomy'),
+            build,
             mimetype='text/csv',
             headers={'Content-Disposition': 'attachment; filename=product_categories.csv'}
         )
@@ -781,92 +657,23 @@ def bulk_assign_category(category_id):
     try:
         data = request.get_json()
         product_ids = data.get('product_ids', [])
-        
-        if not product_ids:
-            return jsonify({'error': 'No products provided'}), 400
-            
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Start transaction
-        cursor.execute('BEGIN TRANSACTION')
-        
-        try:
-            # Get parent categories for the selected category
-            parent_categories = set()
-            with open('data/category.json') as f:
-                categories = json.load(f)
-            
-            # Find the category and its parents
-            current_category = next((cat for cat in categories if cat['category_name'] == category_id), None)
-            if not current_category:
-                raise ValueError(f"Category {category_id} not found")
-                
-            while current_category and current_category.get('connected_to'):
-                parent_name = current_category['connected_to']
-                parent_categories.add(parent_name)
-                current_category = next((cat for cat in categories if cat['category_name'] == parent_name), None)
-            
-            # Combine all categories to add (including parents)
-            categories_to_add = {category_id} | parent_categories
-            
-            # Track statistics
-            stats = {
-                'total_products': len(product_ids),
-                'categories_added': 0,
-                'parent_categories_added': 0,
-                'products_updated': 0
-            }
-            
-            # Process each product
-            for product_id in product_ids:
-                # Get current categories for this product
-                cursor.execute('''
-                    SELECT category_id 
-                    FROM product_category_mapping 
-                    WHERE product_id = ?
-                ''', (product_id,))
-                current_categories = {row[0] for row in cursor.fetchall()}
-                
-                # Add missing categories
-                for cat_id in categories_to_add:
-                    if cat_id not in current_categories:
-                        try:
-                            cursor.execute(
-                                'INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)',
-                                (product_id, cat_id)
-                            )
-                            stats['categories_added'] += 1
-                            if cat_id in parent_categories:
-                                stats['parent_categories_added'] += 1
-                        except sqlite3.IntegrityError:
-                            continue
-                
-                # Update last_modified timestamp
-                cursor.execute('''
-                    UPDATE product_categories 
-                    SET last_modified = CURRENT_TIMESTAMP 
-                    WHERE product_id = ?
-                ''', (product_id,))
-                stats['products_updated'] += 1
-            
-            # Commit transaction
-            conn.commit()
-            
+
+        def respond(stats):
+            del stats['total_categories']
             return jsonify({
                 'message': 'Categories assigned successfully',
                 'stats': stats
             })
+
+        payload = {'product_ids': product_ids, 'category_ids': [category_id], 'require_known': True}
+        return admitted_bulk('bulk-assign', payload, respond)
             
-        except Exception as e:
-            # Rollback transaction on error
-            conn.rollback()
-            raise e
-            
+    except ServiceError as e:
+        return service_error_response(e)
+    except admission.AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/bulk-assign')
 def bulk_assign():
@@ -877,32 +684,11 @@ def bulk_assign():
 def get_products_by_category(category_id):
     """Get all products assigned to a specific category."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get products assigned to this category
-        cursor.execute('''
-            SELECT DISTINCT pc.product_id, pc.product_name
-            FROM product_categories pc
-            JOIN product_category_mapping pcm ON pc.product_id = pcm.product_id
-            WHERE pcm.category_id = ?
-            ORDER BY pc.product_name
-        ''', (category_id,))
-        
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'product_id': row[0],
-                'product_name': row[1]
-            })
-        
-        return jsonify(products)
-        
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_products_by_category(conn, category_id))
     except Exception as e:
         app.logger.error(f"Error fetching products for category {category_id}: {str(e)}")
         return jsonify({'error': f'Failed to fetch products: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/bulk-categories-summary', methods=['POST'])
 def get_bulk_categories_summary():
@@ -912,36 +698,10 @@ def get_bulk_categories_summary():
         if not product_ids:
             return jsonify({})
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create placeholders for the IN clause
-        placeholders = ','.join(['?'] * len(product_ids))
-        query = f'''
-            SELECT pcm.product_id, COUNT(pcm.category_id) as category_count
-            FROM product_category_mapping pcm
-            WHERE pcm.product_id IN ({placeholders})
-            GROUP BY pcm.product_id
-        '''
-        
-        cursor.execute(query, product_ids)
-        rows = cursor.fetchall()
-        
-        # Create a map of product_id to category count
-        category_counts = {}
-        for row in rows:
-            category_counts[row[0]] = row[1]
-        
-        # For products not in the result, set count to 0
-        for product_id in product_ids:
-            if product_id not in category_counts:
-                category_counts[product_id] = 0
-        
-        return jsonify(category_counts)
+        with get_db_connection_context() as conn:
+            return jsonify(services.get_bulk_categories_summary(conn, product_ids))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/bulk-assign-categories', methods=['POST'])
 def bulk_assign_multiple_categories():
@@ -951,97 +711,22 @@ def bulk_assign_multiple_categories():
         product_ids = data.get('product_ids', [])
         category_ids = data.get('category_ids', [])
         
-        if not product_ids:
-            return jsonify({'error': 'No products provided'}), 400
-        
-        if not category_ids:
-            return jsonify({'error': 'No categories provided'}), 400
-            
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Start transaction
-        cursor.execute('BEGIN TRANSACTION')
-        
-        try:
-            # Get all parent categories for the selected categories
-            parent_categories = set()
-            with open('data/category.json') as f:
-                categories = json.load(f)
-            
-            # For each selected category, find its parents
-            for category_id in category_ids:
-                current_category = next((cat for cat in categories if cat['category_name'] == category_id), None)
-                if not current_category:
-                    continue
-                    
-                while current_category and current_category.get('connected_to'):
-                    parent_name = current_category['connected_to']
-                    parent_categories.add(parent_name)
-                    current_category = next((cat for cat in categories if cat['category_name'] == parent_name), None)
-            
-            # Combine all categories to add (including parents)
-            all_categories_to_add = set(category_ids) | parent_categories
-            
-            # Track statistics
-            stats = {
-                'total_products': len(product_ids),
-                'total_categories': len(category_ids),
-                'categories_added': 0,
-                'parent_categories_added': 0,
-                'products_updated': 0
-            }
-            
-            # Process each product
-            for product_id in product_ids:
-                # Get current categories for this product
-                cursor.execute('''
-                    SELECT category_id 
-                    FROM product_category_mapping 
-                    WHERE product_id = ?
-                ''', (product_id,))
-                current_categories = {row[0] for row in cursor.fetchall()}
-                
-                # Add missing categories
-                for cat_id in all_categories_to_add:
-                    if cat_id not in current_categories:
-                        try:
-                            cursor.execute(
-                                'INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)',
-                                (product_id, cat_id)
-                            )
-                            stats['categories_added'] += 1
-                            if cat_id in parent_categories:
-                                stats['parent_categories_added'] += 1
-                        except sqlite3.IntegrityError:
-                            continue
-                
-                # Update last_modified timestamp
-                cursor.execute('''
-                    UPDATE product_categories 
-                    SET last_modified = CURRENT_TIMESTAMP 
-                    WHERE product_id = ?
-                ''', (product_id,))
-                stats['products_updated'] += 1
-            
-            # Commit transaction
-            conn.commit()
-            
+        def respond(stats):
             return jsonify({
                 'message': f'Successfully assigned {len(category_ids)} categories to {len(product_ids)} products',
                 'stats': stats,
                 'assigned_categories': category_ids
             })
+
+        payload = {'product_ids': product_ids, 'category_ids': category_ids}
+        return admitted_bulk('bulk-assign', payload, respond)
             
-        except Exception as e:
-            # Rollback transaction on error
-            conn.rollback()
-            raise e
-            
+    except ServiceError as e:
+        return service_error_response(e)
+    except admission.AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/bulk-remove-categories', methods=['POST'])
 def bulk_remove_multiple_categories():
@@ -1051,150 +736,54 @@ def bulk_remove_multiple_categories():
         product_ids = data.get('product_ids', [])
         category_ids = data.get('category_ids', [])
         
-        if not product_ids:
-            return jsonify({'error': 'No products provided'}), 400
-        
-        if not category_ids:
-            return jsonify({'error': 'No categories provided'}), 400
-            
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Start transaction
-        cursor.execute('BEGIN TRANSACTION')
-        
-        try:
-            # Track statistics
-            stats = {
-                'total_products': len(product_ids),
-                'total_categories': len(category_ids),
-                'categories_removed': 0,
-                'products_updated': 0
-            }
-            
-            # Process each product
-            for product_id in product_ids:
-                product_had_categories = False
-                
-                # Remove specified categories from this product
-                for category_id in category_ids:
-                    cursor.execute('''
-                        DELETE FROM product_category_mapping 
-                        WHERE product_id = ? AND category_id = ?
-                    ''', (product_id, category_id))
-                    
-                    if cursor.rowcount > 0:
-                        stats['categories_removed'] += 1
-                        product_had_categories = True
-                
-                # Update last_modified timestamp if any categories were removed
-                if product_had_categories:
-                    cursor.execute('''
-                        UPDATE product_categories 
-                        SET last_modified = CURRENT_TIMESTAMP 
-                        WHERE product_id = ?
-                    ''', (product_id,))
-                    stats['products_updated'] += 1
-            
-            # Commit transaction
-            conn.commit()
-            
+        def respond(stats):
             return jsonify({
                 'message': f'Successfully removed {len(category_ids)} categories from {stats["products_updated"]} products',
                 'stats': stats,
                 'removed_categories': category_ids
             })
+
+        payload = {'product_ids': product_ids, 'category_ids': category_ids}
+        return admitted_bulk('bulk-remove', payload, respond)
             
-        except Exception as e:
-            # Rollback transaction on error
-            conn.rollback()
-            raise e
-            
+    except ServiceError as e:
+        return service_error_response(e)
+    except admission.AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/statistics', methods=['GET'])
 def get_product_statistics():
     """Get product statistics including categorized/uncategorized counts."""
+    def build():
+        with get_db_connection_context() as conn:
+            return json_bytes(services.get_product_statistics(conn))
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get total products count
-        cursor.execute('SELECT COUNT(*) FROM product_categories')
-        total_products = cursor.fetchone()[0]
-        
-        # Get categorized products count (products with at least one category)
-        cursor.execute('''
-            SELECT COUNT(DISTINCT product_id) 
-            FROM product_category_mapping
-        ''')
-        categorized_products = cursor.fetchone()[0]
-        
-        # Calculate uncategorized products
-        uncategorized_products = total_products - categorized_products
-        
-        # Get total categories count
-        with open('data/category.json') as f:
-            categories = json.load(f)
-        total_categories = len(categories)
-        
-        return jsonify({
-            'total_products': total_products,
-            'categorized_products': categorized_products,
-            'uncategorized_products': uncategorized_products,
-            'total_categories': total_categories
-        })
-        
+        return cached_response('products:statistics', ('products', 'taxonomy'), build)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/products/categorization-status', methods=['GET'])
 def get_products_categorization_status():
     """Get all products with their categorization status for efficient filtering."""
+    if wants_ndjson():
+        return stream_ndjson(services.CATEGORIZATION_STATUS_QUERY, (), services.categorization_status_row)
+
+    def build():
+        with get_db_connection_context() as conn:
+            return json_bytes(services.get_categorization_status(conn))
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get all products with their category count
-        cursor.execute('''
-            SELECT 
-                pc.product_id,
-                pc.product_name,
-                COALESCE(cat_count.category_count, 0) as category_count,
-                CASE WHEN COALESCE(cat_count.category_count, 0) > 0 THEN 1 ELSE 0 END as has_categories
-            FROM product_categories pc
-            LEFT JOIN (
-                SELECT 
-                    product_id, 
-                    COUNT(DISTINCT category_id) as category_count
-                FROM product_category_mapping 
-                GROUP BY product_id
-            ) cat_count ON pc.product_id = cat_count.product_id
-            ORDER BY pc.product_name
-        ''')
-        
-        products = []
-        for row in cursor.fetchall():
-            products.append({
-                'product_id': row[0],
-                'product_name': row[1], 
-                'category_count': row[2],
-                'has_categories': bool(row[3])
-            })
-        
-        return jsonify(products)
-        
+        return cached_response('products:categorization-status', ('products',), build)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
 if __name__ == '__main__':
+    # The debug reloader's parent only watches files; the child it spawns serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_worker()
     # Enable network access
     app.run(
         host='0.0.0.0',  # Listen on all network interfaces
@@ -3,14 +3,13 @@ FastAPI application for Tag Manager V2 - Phase 1 Refactoring
 """
 
 from fastapi import FastAPI, HTTPException, Depends, Request, Query
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from pydantic import ValidationError
 import sqlite3
 import json
 import os
-import pandas as pd
 from datetime import datetime
 from typing import List, Optional
 from contextlib import contextmanager
@@ -19,9 +18,33 @@ from models import (
     ProductSummary, CategoryBase, CategoryCreateRequest, CategoryUpdateRequest,
     AssignCategoriesRequest, BulkAssignCategoriesRequest, BulkRemoveCategoriesRequest,
     ErrorResponse, SuccessResponse, ProductStatistics, ProductCategorizationStatus,
-    APIResponse, PaginationInfo
+    APIResponse, ProductIdsRequest, CategoryDeleteRequest, ProductQueryRequest
 )
-from database import get_db_connection, init_products
+import admission
+import changefeed
+import invalidation
+import jobs
+import metrics
+import profiling
+import rollups
+import services
+import sqltrace
+import warmup
+from services import ServiceError
+from database import connect
+from db_executor import executor, LaneBusyError
+from serialization import (
+    FastJSONResponse, NDJSON_MIMETYPE, api_response_bytes, format_timestamp, product_summary_rows, iter_ndjson,
+    dumps, prefers_ndjson
+)
+from compression import CompressionMiddleware, PrecompressedCache, CachedPayload
+from singleflight import flights
+
+async def label_write_endpoint(request: Request):
+    """Tag database writes made by this request with its route for write metrics"""
+    route = request.scope.get("route")
+    if route is not None:
+        services.write_endpoint.set(f"{request.method} {route.path}")
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -29,9 +52,26 @@ app = FastAPI(
     version="2.0.0",
     description="Modernized product category management system with FastAPI",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    dependencies=[Depends(label_write_endpoint)]
 )
 
+# gzip/brotli for responses above COMPRESSION_MIN_SIZE
+app.add_middleware(CompressionMiddleware)
+
+# Only installed when PROFILING_TOKEN is set
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Outermost, so request timing includes compression and streamed bodies
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Precompressed payloads for cacheable responses such as category trees
+response_cache = PrecompressedCache()
+for scope in invalidation.DATA_SCOPES:
+    invalidation.subscribe(scope, response_cache.invalidate)
+metrics.register_cache('responses', lambda: (response_cache.hits, response_cache.misses))
+
 # Custom exception classes
 class BusinessLogicError(Exception):
     """Custom exception for business logic errors"""
@@ -73,11 +113,69 @@ async def business_logic_exception_handler(request: Request, exc: BusinessLogicE
         ).dict()
     )
 
+@app.exception_handler(ServiceError)
+async def service_exception_handler(request: Request, exc: ServiceError):
+    """Handle errors raised by the shared service layer"""
+    retry_after = getattr(exc, "retry_after", None)
+    return JSONResponse(
+        status_code=exc.status_code,
+        headers={"Retry-After": str(retry_after)} if retry_after else None,
+        content=ErrorResponse(
+            error=exc.message,
+            details=exc.details
+        ).dict()
+    )
+
+@app.exception_handler(LaneBusyError)
+async def lane_busy_exception_handler(request: Request, exc: LaneBusyError):
+    """Handle database lanes whose queue is full"""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "1"},
+        content=ErrorResponse(
+            error=str(exc),
+            details={"lane": exc.lane, "queue_limit": exc.queue_limit}
+        ).dict()
+    )
+
+@app.exception_handler(admission.AdmissionRejected)
+async def admission_rejected_exception_handler(request: Request, exc: admission.AdmissionRejected):
+    """Handle bulk operations over the admission limits"""
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content=ErrorResponse(
+            error=exc.message,
+            details={**exc.details, "retry_after": exc.retry_after}
+        ).dict()
+    )
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on application startup"""
-    init_products()
+    """Initialize database and warm caches on application startup"""
+    # serve.py warms the shared caches once in the master before forking;
+    # the import is started here, after fork, so no thread is forked mid-flight
+    warmup.import_products()
+    if not warmup.is_preloaded():
+        await warm_caches()
+    await executor.warm(warmup.prepare_statements)
+    jobs.start()
+    warmup.mark_ready()
+
+async def warm_caches():
+    """Build the taxonomy index and cached category payloads before serving traffic"""
+    import httpx
+
+    # Category reads never rebuild the counts, so bring them up to date first
+    await executor.write(rollups.ensure_current)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://warmup") as client:
+        for url in warmup.category_urls():
+            for encoding in warmup.warm_encodings():
+                await client.get(url, headers={"accept-encoding": encoding})
+    warmup.mark_preloaded()
 
 # Helper functions
 def load_categories_from_json() -> List[dict]:
@@ -88,8 +186,9 @@ def load_categories_from_json() -> List[dict]:
     except FileNotFoundError:
         return []
 
-def format_category_from_json(cat: dict) -> CategoryBase:
-    """Format category from JSON format to CategoryBase model"""
+def format_category_from_json(cat: dict, counts: Optional[dict] = None) -> CategoryBase:
+    """Format category from JSON format to CategoryBase model, with product counts if given"""
+    direct, subtree = (counts or {}).get(cat['category_name'], (0, 0))
     return CategoryBase(
         id=cat['category_name'],
         name=cat['category_name'],
@@ -101,239 +200,388 @@ def format_category_from_json(cat: dict) -> CategoryBase:
             subcat['category_level'] in ['Level 2 Category', 'Level 3 Category'] and
             subcat['connected_to'] == cat['category_name']
             for subcat in load_categories_from_json()
-        )
+        ),
+        product_count=direct if counts is not None else None,
+        subtree_product_count=subtree if counts is not None else None
+    )
+
+def payload_response(request: Request, payload: CachedPayload) -> Response:
+    """Negotiate encoding and ETag revalidation for a cached payload"""
+    status, body, payload_headers = payload.negotiate(
+        request.headers.get("accept-encoding", ""),
+        request.headers.get("if-none-match")
+    )
+    return Response(body, status_code=status, media_type=payload.media_type, headers=payload_headers)
+
+def cached_payload_response(request: Request, key, scopes, build, media_type: str = "application/json",
+                            headers: Optional[dict] = None) -> Response:
+    """Serve bytes from the precompressed cache with ETag revalidation"""
+    payload = response_cache.get_or_build(
+        key, invalidation.version(*scopes), lambda: (build(), media_type), headers, scopes
     )
+    return payload_response(request, payload)
+
+async def coalesced_response(request: Request, route: str, scopes, lane, build,
+                             media_type: str = "application/json", headers: Optional[dict] = None) -> Response:
+    """
+    Serve an expensive cached payload, building it at most once at a time
+
+    Concurrent requests for the same route and data version share a single
+    lane job (see singleflight.py); build(db) returns the body bytes.
+    """
+    version = invalidation.version(*scopes)
+
+    def load(db: sqlite3.Connection) -> CachedPayload:
+        return response_cache.get_or_build(route, version, lambda: (build(db), media_type), headers, scopes)
+
+    payload = await flights.do_async(route, version, lambda: lane(load))
+    return payload_response(request, payload)
+
+def cached_response(request: Request, key, scopes, build) -> Response:
+    """Serve an APIResponse from the precompressed cache with ETag revalidation"""
+    return cached_payload_response(request, key, scopes, lambda: dumps(build().model_dump(mode="json")))
+
+async def admitted_bulk(request: Request, kind: str, payload: dict, respond):
+    """
+    Run a bulk write under admission control, or queue it as a job
+
+    Clients sending `Prefer: respond-async` get 202 and a job status URL;
+    otherwise the operation runs on the bulk lane, paced, and respond(stats)
+    builds the response. Over-limit requests raise AdmissionRejected (429).
+    """
+    if admission.prefers_async(request.headers.get("prefer")):
+        job = await executor.write(lambda db: jobs.submit(db, kind, payload))
+        return JSONResponse(
+            status_code=202,
+            headers={"Location": f"/api/jobs/{job['job_id']}"},
+            content=SuccessResponse(message="Bulk operation queued", details=job).model_dump(mode="json")
+        )
+
+    ticket = admission.bulk.admit(jobs.job_rows(payload))
+
+    def run(db: sqlite3.Connection):
+        with ticket:
+            return respond(jobs.HANDLERS[kind](db, payload, ticket))
+
+    try:
+        return await executor.bulk(run)
+    finally:
+        # Gives the reservation back if the job never reached the lane
+        ticket.close()
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether the client asked for a newline-delimited JSON stream"""
+    return prefers_ndjson(request.headers.get("accept"))
+
+def stream_ndjson(query: str, params: tuple, row_to_dict) -> StreamingResponse:
+    """Stream query results as NDJSON straight from the cursor"""
+    def generate():
+        # Starlette iterates sync generators on threadpool threads, one batch at a time
+        conn = connect(check_same_thread=False)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            yield from iter_ndjson(cursor, row_to_dict)
+        finally:
+            conn.close()
+
+    return StreamingResponse(generate(), media_type=NDJSON_MIMETYPE)
 
 # API Endpoints
 @app.get("/api/products", response_model=APIResponse)
-def get_products(
+async def get_products(
     hide_allocated: bool = Query(False, description="Hide products with category assignments"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of products to return"),
-    offset: int = Query(0, ge=0, description="Number of products to skip"),
-    db: sqlite3.Connection = Depends(get_db_connection)
+    offset: int = Query(0, ge=0, description="Number of products to skip")
 ):
     """
     Get all products with optional filtering and pagination
     """
-    try:
-        cursor = db.cursor()
-
-        # Base query with category count
-        base_query = '''
-            SELECT pc.*,
-                   (SELECT COUNT(*)
-                    FROM product_category_mapping pcm
-                    WHERE pcm.product_id = pc.product_id) AS category_count
-            FROM product_categories pc
-        '''
-
-        # Add WHERE clause if hiding allocated products
-        if hide_allocated:
-            base_query += ' WHERE category_count = 0'
-
-        # Get total count for pagination
-        count_query = f"SELECT COUNT(*) as total FROM ({base_query})"
-        cursor.execute(count_query)
-        total_count = cursor.fetchone()['total']
-
-        # Add pagination and ordering
-        base_query += ' ORDER BY LOWER(pc.product_name) ASC LIMIT ? OFFSET ?'
-
-        cursor.execute(base_query, (limit, offset))
-        products = cursor.fetchall()
-
-        # Convert to response model
-        product_list = []
-        for product in products:
-            product_list.append(ProductSummary(
-                product_id=product['product_id'],
-                product_name=product['product_name'],
-                has_allocations=product['category_count'] > 0,
-                category_count=product['category_count'],
-                last_modified=product['last_modified'] if product['last_modified'] else None
+    def query(db: sqlite3.Connection):
+        try:
+            cursor = db.cursor()
+
+            # Base query with category count
+            base_query = '''
+                SELECT pc.product_id, pc.product_name, pc.last_modified,
+                       (SELECT COUNT(*)
+                        FROM product_category_links l
+                        WHERE l.product_int = pc.product_int) AS category_count
+                FROM product_categories pc
+            '''
+
+            # Add WHERE clause if hiding allocated products
+            if hide_allocated:
+                base_query += ' WHERE category_count = 0'
+
+            # Get total count for pagination
+            count_query = f"SELECT COUNT(*) as total FROM ({base_query})"
+            cursor.execute(count_query)
+            total_count = cursor.fetchone()['total']
+
+            # Add pagination and ordering
+            base_query += ' ORDER BY LOWER(pc.product_name) ASC LIMIT ? OFFSET ?'
+
+            cursor.execute(base_query, (limit, offset))
+            products = cursor.fetchall()
+
+            # Rows come from our own tables, so skip per-row model validation
+            product_list = product_summary_rows(products)
+
+            return FastJSONResponse(api_response_bytes(
+                product_list,
+                metadata={
+                    "total_products": total_count,
+                    "filtered_products": len(product_list),
+                    "hide_allocated": hide_allocated
+                }
             ))
 
-        # Create pagination info
-        pagination = PaginationInfo(
-            page=(offset // limit) + 1,
-            page_size=limit,
-            total_items=total_count,
-            total_pages=(total_count + limit - 1) // limit,
-            has_next=offset + limit < total_count,
-            has_previous=offset > 0
-        )
+        except Exception as e:
+            raise BusinessLogicError(f"Error retrieving products: {str(e)}")
 
-        return APIResponse(
-            data=product_list,
-            metadata={
-                "total_products": total_count,
-                "filtered_products": len(product_list),
-                "hide_allocated": hide_allocated
-            },
-            pagination=pagination
-        )
+    return await executor.read(query)
 
-    except Exception as e:
-        raise BusinessLogicError(f"Error retrieving products: {str(e)}")
+@app.get("/api/products/page", response_model=APIResponse)
+async def get_product_page(
+    hide_allocated: bool = Query(False, description="Hide products with category assignments"),
+    limit: int = Query(services.PAGE_LIMIT, ge=1, le=services.MAX_PAGE_LIMIT, description="Products per page"),
+    offset: int = Query(0, ge=0, description="Number of products to skip")
+):
+    """
+    Get a page of products with their resolved categories and counts
+
+    One request and one query per page instead of /api/products followed by
+    bulk-categories, bulk-categories-summary and per-product calls.
+    """
+    def query(db: sqlite3.Connection):
+        page = services.get_product_page(db, limit, offset, hide_allocated)
+        products = page.pop("products")
+        for product in products:
+            product["last_modified"] = format_timestamp(product["last_modified"])
+        page["filtered_products"] = len(products)
+        return FastJSONResponse(api_response_bytes(products, metadata=page))
+
+    return await executor.read(query)
+
+@app.post("/api/products/query", response_model=APIResponse)
+async def query_products(request: ProductQueryRequest):
+    """
+    Get products matching a boolean expression over categories
+
+    For example {"and": ["Tile Adhesives", "Waterproofing", {"not": "Primers"}]};
+    a {"category": name, "subtree": true} term includes every category below it.
+    """
+    def query(db: sqlite3.Connection):
+        result = services.query_products(db, request.expression, request.limit, request.offset,
+                                         request.count_only)
+        products = result.pop("products", None)
+        return FastJSONResponse(api_response_bytes(products, metadata=result))
+
+    return await executor.read(query)
 
 @app.get("/api/products/{product_id}/categories", response_model=APIResponse)
-def get_product_categories(product_id: str, db: sqlite3.Connection = Depends(get_db_connection)):
+async def get_product_categories(product_id: str):
     """
     Get all categories for a specific product
     """
-    try:
-        cursor = db.cursor()
-
-        # Verify product exists
-        cursor.execute('SELECT product_name FROM product_categories WHERE product_id = ?', (product_id,))
-        product = cursor.fetchone()
-        if not product:
-            raise BusinessLogicError(f"Product not found: {product_id}", {"product_id": product_id})
+    def query(db: sqlite3.Connection):
+        try:
+            cursor = db.cursor()
+
+            # Verify product exists
+            cursor.execute('SELECT product_name FROM product_categories WHERE product_id = ?', (product_id,))
+            product = cursor.fetchone()
+            if not product:
+                raise BusinessLogicError(f"Product not found: {product_id}", {"product_id": product_id})
+
+            # Get all categories for the product
+            category_ids = services.get_product_category_ids(db, product_id)
+
+            # Get category details from JSON file
+            all_categories = load_categories_from_json()
+
+            # Format categories with their full details
+            categories = []
+            for category_id in category_ids:
+                category = next((cat for cat in all_categories if cat['category_name'] == category_id), None)
+                if category:
+                    categories.append(format_category_from_json(category))
+
+            return APIResponse(
+                data=categories,
+                metadata={
+                    "product_id": product_id,
+                    "product_name": product['product_name'],
+                    "total_categories": len(categories),
+                    "category_ids": category_ids
+                }
+            )
+
+        except Exception as e:
+            raise BusinessLogicError(f"Error retrieving product categories: {str(e)}")
+
+    return await executor.read(query)
 
-        # Get all categories for the product
-        cursor.execute('''
-            SELECT category_id
-            FROM product_category_mapping
-            WHERE product_id = ?
-        ''', (product_id,))
+@app.post("/api/products/{product_id}/categories", response_model=SuccessResponse)
+async def assign_categories(
+    product_id: str,
+    request: AssignCategoriesRequest
+):
+    """
+    Assign categories to a product
+    """
+    def assign(db: sqlite3.Connection):
+        try:
+            result = services.assign_categories(db, product_id, request.category_ids)
+
+            return SuccessResponse(
+                message='Categories assigned successfully',
+                details={
+                    'added_categories': result['added_categories'],
+                    'parent_categories_added': result['parent_categories_added'],
+                    'total_categories': result['total_categories']
+                }
+            )
+
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise BusinessLogicError(f"Error assigning categories: {str(e)}")
+
+    return await executor.write(assign)
 
-        category_ids = [row[0] for row in cursor.fetchall()]
+@app.delete("/api/products/{product_id}/category/{category_id}", response_model=SuccessResponse)
+async def remove_category(
+    product_id: str,
+    category_id: str
+):
+    """
+    Remove a category from a product
+    """
+    def remove(db: sqlite3.Connection):
+        try:
+            services.remove_category(db, product_id, category_id)
+            return SuccessResponse(message='Category removed successfully')
 
-        # Get category details from JSON file
-        all_categories = load_categories_from_json()
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise BusinessLogicError(f"Error removing category: {str(e)}")
 
-        # Format categories with their full details
-        categories = []
-        for category_id in category_ids:
-            category = next((cat for cat in all_categories if cat['category_name'] == category_id), None)
-            if category:
-                categories.append(format_category_from_json(category))
+    return await executor.write(remove)
 
+@app.get("/api/products/{product_id}/last-modified", response_model=APIResponse)
+async def get_product_last_modified(product_id: str):
+    """
+    Get the last modified timestamp for a product
+    """
+    def query(db: sqlite3.Connection):
         return APIResponse(
-            data=categories,
+            data={"last_modified": services.get_product_last_modified(db, product_id)},
+            metadata={"product_id": product_id}
+        )
+
+    return await executor.read(query)
+
+@app.post("/api/products/bulk-categories", response_model=APIResponse)
+async def get_bulk_product_categories(request: ProductIdsRequest):
+    """
+    Get categories for multiple products in a single request
+    """
+    def query(db: sqlite3.Connection):
+        categories = services.get_bulk_product_categories(db, request.product_ids)
+        return FastJSONResponse(api_response_bytes(
+            categories,
             metadata={
-                "product_id": product_id,
-                "product_name": product['product_name'],
-                "total_categories": len(categories),
-                "category_ids": category_ids
+                "requested_products": len(request.product_ids),
+                "products_with_categories": len(categories)
             }
-        )
+        ))
 
-    except Exception as e:
-        raise BusinessLogicError(f"Error retrieving product categories: {str(e)}")
+    return await executor.bulk(query)
 
-@app.post("/api/products/{product_id}/categories", response_model=SuccessResponse)
-def assign_categories(
-    product_id: str,
-    request: AssignCategoriesRequest,
-    db: sqlite3.Connection = Depends(get_db_connection)
-):
+@app.post("/api/products/bulk-categories-summary", response_model=APIResponse)
+async def get_bulk_categories_summary(request: ProductIdsRequest):
     """
-    Assign categories to a product
+    Get category counts for multiple products in a single request
     """
-    try:
-        cursor = db.cursor()
+    def query(db: sqlite3.Connection):
+        counts = services.get_bulk_categories_summary(db, request.product_ids)
+        return FastJSONResponse(api_response_bytes(
+            counts,
+            metadata={"requested_products": len(request.product_ids)}
+        ))
 
-        # Get current categories
-        cursor.execute('''
-            SELECT category_id
-            FROM product_category_mapping
-            WHERE product_id = ?
-        ''', (product_id,))
-        current_categories = {row[0] for row in cursor.fetchall()}
+    return await executor.bulk(query)
 
-        # Get parent categories for all selected categories
-        all_categories = load_categories_from_json()
-        parent_categories = set()
-        for category_id in request.category_ids:
-            # Find the category and its parents
-            current_category = next((cat for cat in all_categories if cat['category_name'] == category_id), None)
-            while current_category and current_category.get('connected_to'):
-                parent_name = current_category['connected_to']
-                parent_categories.add(parent_name)
-                current_category = next((cat for cat in all_categories if cat['category_name'] == parent_name), None)
-
-        # Combine all categories to add (including parents)
-        categories_to_add = set(request.category_ids) | parent_categories
-
-        # Update last_modified timestamp
-        cursor.execute('''
-            UPDATE product_categories
-            SET last_modified = CURRENT_TIMESTAMP
-            WHERE product_id = ?
-        ''', (product_id,))
-
-        # Add all missing categories
-        added_categories = []
-        for category_id in categories_to_add:
-            if category_id not in current_categories:
-                try:
-                    cursor.execute(
-                        'INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)',
-                        (product_id, category_id)
-                    )
-                    added_categories.append(category_id)
-                except sqlite3.IntegrityError:
-                    continue
-
-        db.commit()
+@app.post("/api/products/bulk-assign-categories", response_model=SuccessResponse)
+async def bulk_assign_multiple_categories(request: BulkAssignCategoriesRequest, http_request: Request):
+    """
+    Assign multiple categories to multiple products at once
+    """
+    def respond(stats: dict):
+        return SuccessResponse(
+            message=f'Successfully assigned {len(request.category_ids)} categories to {len(request.product_ids)} products',
+            details={"stats": stats, "assigned_categories": request.category_ids}
+        )
+
+    payload = {"product_ids": request.product_ids, "category_ids": request.category_ids}
+    return await admitted_bulk(http_request, "bulk-assign", payload, respond)
 
+@app.post("/api/products/bulk-remove-categories", response_model=SuccessResponse)
+async def bulk_remove_multiple_categories(request: BulkRemoveCategoriesRequest, http_request: Request):
+    """
+    Remove multiple categories from multiple products at once
+    """
+    def respond(stats: dict):
         return SuccessResponse(
-            message='Categories assigned successfully',
-            details={
-                'added_categories': added_categories,
-                'parent_categories_added': len(parent_categories - set(request.category_ids)),
-                'total_categories': len(categories_to_add)
-            }
+            message=f'Successfully removed {len(request.category_ids)} categories from {stats["products_updated"]} products',
+            details={"stats": stats, "removed_categories": request.category_ids}
         )
 
-    except Exception as e:
-        db.rollback()
-        raise BusinessLogicError(f"Error assigning categories: {str(e)}")
+    payload = {"product_ids": request.product_ids, "category_ids": request.category_ids}
+    return await admitted_bulk(http_request, "bulk-remove", payload, respond)
 
-@app.delete("/api/products/{product_id}/category/{category_id}", response_model=SuccessResponse)
-def remove_category(
-    product_id: str,
-    category_id: str,
-    db: sqlite3.Connection = Depends(get_db_connection)
-):
+@app.get("/api/products/statistics", response_model=APIResponse)
+async def get_product_statistics(request: Request):
     """
-    Remove a category from a product
+    Get product statistics including categorized/uncategorized counts
     """
-    try:
-        cursor = db.cursor()
+    def build(db: sqlite3.Connection) -> bytes:
+        statistics = ProductStatistics(**services.get_product_statistics(db))
+        return dumps(APIResponse(data=statistics).model_dump(mode="json"))
 
-        # Update last_modified timestamp
-        cursor.execute('''
-            UPDATE product_categories
-            SET last_modified = CURRENT_TIMESTAMP
-            WHERE product_id = ?
-        ''', (product_id,))
+    return await coalesced_response(request, "products:statistics", ("products", "taxonomy"), executor.read, build)
 
-        # Remove category mapping
-        cursor.execute('''
-            DELETE FROM product_category_mapping
-            WHERE product_id = ? AND category_id = ?
-        ''', (product_id, category_id))
+@app.get("/api/products/categorization-status", response_model=APIResponse)
+async def get_products_categorization_status(request: Request):
+    """
+    Get all products with their categorization status for efficient filtering
 
-        db.commit()
-        return SuccessResponse(message='Category removed successfully')
+    Send `Accept: application/x-ndjson` to stream one product per line instead.
+    """
+    if wants_ndjson(request):
+        return stream_ndjson(services.CATEGORIZATION_STATUS_QUERY, (), services.categorization_status_row)
 
-    except Exception as e:
-        db.rollback()
-        raise BusinessLogicError(f"Error removing category: {str(e)}")
+    def build(db: sqlite3.Connection):
+        products = services.get_categorization_status(db)
+        return api_response_bytes(products, metadata={"total_products": len(products)})
+
+    return await coalesced_response(request, "products:categorization-status", ("products",), executor.bulk, build)
 
 @app.get("/api/categories/level1", response_model=APIResponse)
-def get_level1_categories():
+async def get_level1_categories(request: Request):
     """
     Get all level 1 categories
     """
-    try:
+    def build(db: sqlite3.Connection):
         all_categories = load_categories_from_json()
+        counts = rollups.get_counts(db)
 
         # Get all level 1 categories
         level1_categories = [
-            format_category_from_json(cat)
+            format_category_from_json(cat, counts)
             for cat in all_categories
             if cat['category_level'] == 'Level 1 Category'
         ]
@@ -347,23 +595,31 @@ def get_level1_categories():
             }
         )
 
+    try:
+        return await executor.read(
+            lambda db: cached_response(request, "categories:level1", ("products", "taxonomy"), lambda: build(db))
+        )
+
+    except LaneBusyError:
+        raise
     except Exception as e:
         raise BusinessLogicError(f"Error retrieving level 1 categories: {str(e)}")
 
 @app.get("/api/categories/level{level}/{parent}", response_model=APIResponse)
-def get_child_categories(level: int, parent: str):
+async def get_child_categories(level: int, parent: str, request: Request):
     """
     Get child categories for a specific level and parent
     """
-    try:
-        if level not in [2, 3]:
-            raise BusinessLogicError("Level must be 2 or 3", {"requested_level": level})
+    if level not in [2, 3]:
+        raise BusinessLogicError("Level must be 2 or 3", {"requested_level": level})
 
+    def build(db: sqlite3.Connection):
         all_categories = load_categories_from_json()
+        counts = rollups.get_counts(db)
 
         level_name = f"Level {level} Category"
         child_categories = [
-            format_category_from_json(cat)
+            format_category_from_json(cat, counts)
             for cat in all_categories
             if cat['category_level'] == level_name and cat['connected_to'] == parent
         ]
@@ -378,16 +634,26 @@ def get_child_categories(level: int, parent: str):
             }
         )
 
+    try:
+        return await executor.read(
+            lambda db: cached_response(
+                request, ("categories:children", level, parent), ("products", "taxonomy"), lambda: build(db)
+            )
+        )
+
+    except LaneBusyError:
+        raise
     except Exception as e:
         raise BusinessLogicError(f"Error retrieving child categories: {str(e)}")
 
 @app.get("/api/categories", response_model=APIResponse)
-def get_all_categories():
+async def get_all_categories(request: Request):
     """
     Get all categories with hierarchy display
     """
-    try:
+    def build(db: sqlite3.Connection):
         all_categories = load_categories_from_json()
+        counts = rollups.get_counts(db)
 
         # Format categories for dropdown - show hierarchy
         formatted_categories = []
@@ -396,6 +662,7 @@ def get_all_categories():
         level3_count = 0
 
         for cat in all_categories:
+            direct, subtree = counts.get(cat['category_name'], (0, 0))
             if cat['category_level'] == 'Level 1 Category':
                 level1_count += 1
                 formatted_categories.append(CategoryBase(
@@ -406,7 +673,9 @@ def get_all_categories():
                         subcat['category_level'] == 'Level 2 Category' and
                         subcat['connected_to'] == cat['category_name']
                         for subcat in all_categories
-                    )
+                    ),
+                    product_count=direct,
+                    subtree_product_count=subtree
                 ))
             elif cat['connected_to']:
                 if cat['category_level'] == 'Level 2 Category':
@@ -417,7 +686,9 @@ def get_all_categories():
                     id=cat['category_name'],
                     name=f"{cat['connected_to']} > {cat['category_name']}",
                     level=2 if cat['category_level'] == 'Level 2 Category' else 3,
-                    parent_id=cat['connected_to']
+                    parent_id=cat['connected_to'],
+                    product_count=direct,
+                    subtree_product_count=subtree
                 ))
 
         return APIResponse(
@@ -431,12 +702,205 @@ def get_all_categories():
             }
         )
 
+    try:
+        return await executor.read(
+            lambda db: cached_response(request, "categories:all", ("products", "taxonomy"), lambda: build(db))
+        )
+
+    except LaneBusyError:
+        raise
     except Exception as e:
         raise BusinessLogicError(f"Error retrieving categories: {str(e)}")
 
+@app.get("/api/categories/tree", response_model=APIResponse)
+async def get_category_tree(
+    request: Request,
+    root: Optional[str] = Query(None, description="Return only the subtree under this category"),
+    depth: Optional[int] = Query(None, ge=1, description="Number of levels to return")
+):
+    """
+    Get the category hierarchy as nested nodes with child and product counts
+
+    Replaces walking level1 and then levelN/{parent} for every expanded node.
+    """
+    def build(db: sqlite3.Connection):
+        tree = services.get_category_tree(db, root, depth)
+        return api_response_bytes(tree.pop("tree"), metadata=tree)
+
+    return await coalesced_response(
+        request, ("categories:tree", root, depth), ("products", "taxonomy"), executor.read, build
+    )
+
+@app.post("/api/categories/create", response_model=SuccessResponse)
+async def create_category(request: CategoryCreateRequest):
+    """
+    Create a new category and add it to the category.json file
+    """
+    def create(db: sqlite3.Connection):
+        category = services.create_category(db, request.name, request.level, request.parent_id)
+        return SuccessResponse(message='Category created successfully', details={"category": category})
+
+    return await executor.write(create)
+
+@app.delete("/api/categories/delete", response_model=SuccessResponse)
+async def delete_category(request: CategoryDeleteRequest):
+    """
+    Delete a category and remove it from all products
+    """
+    def delete(db: sqlite3.Connection):
+        details = services.delete_category(db, request.category_name)
+        return SuccessResponse(message='Category deleted successfully', details=details)
+
+    return await executor.write(delete)
+
+@app.put("/api/categories/{category_name}", response_model=SuccessResponse)
+async def update_category(category_name: str, request: CategoryUpdateRequest):
+    """
+    Rename a category and/or move it, with everything below it, under another parent
+    """
+    def update(db: sqlite3.Connection):
+        details = services.update_category(db, category_name, request.model_dump(exclude_unset=True))
+        return SuccessResponse(message='Category updated successfully', details=details)
+
+    return await executor.write(update)
+
+@app.get("/api/categories/{category_name}/info", response_model=APIResponse)
+async def get_category_info(category_name: str):
+    """
+    Get detailed information about a category including product and child counts
+    """
+    def query(db: sqlite3.Connection):
+        return APIResponse(data=services.get_category_info(db, category_name))
+
+    return await executor.read(query)
+
+@app.get("/api/categories/{category_id}/products", response_model=APIResponse)
+async def get_products_by_category(category_id: str):
+    """
+    Get all products assigned to a specific category
+    """
+    def query(db: sqlite3.Connection):
+        products = services.get_products_by_category(db, category_id)
+        return FastJSONResponse(api_response_bytes(
+            products,
+            metadata={"category_id": category_id, "total_products": len(products)}
+        ))
+
+    return await executor.read(query)
+
+@app.post("/api/categories/{category_id}/products", response_model=SuccessResponse)
+async def bulk_assign_category(category_id: str, request: ProductIdsRequest, http_request: Request):
+    """
+    Assign a category to multiple products at once
+    """
+    def respond(stats: dict):
+        del stats['total_categories']
+        return SuccessResponse(message='Categories assigned successfully', details={"stats": stats})
+
+    payload = {"product_ids": request.product_ids, "category_ids": [category_id], "require_known": True}
+    return await admitted_bulk(http_request, "bulk-assign", payload, respond)
+
+@app.get("/api/export/csv")
+async def export_csv(request: Request):
+    """
+    Export product categories as CSV from a cached, precompressed snapshot
+    """
+    # The snapshot is rebuilt only after a commit or a taxonomy change
+    return await coalesced_response(
+        request,
+        "export:csv",
+        ("products", "taxonomy"),
+        executor.bulk,
+        services.export_csv_bytes,
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=product_categories.csv"}
+    )
+
+@app.get("/api/events")
+async def change_events(request: Request, last_event_id: Optional[int] = Query(None)):
+    """
+    Stream mapping and taxonomy changes to editors as Server-Sent Events
+
+    Each event carries the affected product ids with their new category
+    counts and the added/removed category ids. Reconnecting clients resume
+    from the Last-Event-ID header.
+    """
+    header_id = changefeed.parse_last_event_id(request.headers.get("last-event-id"))
+    return StreamingResponse(
+        changefeed.aiter_sse(header_id if header_id is not None else last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/stats")
+async def get_stats():
+    """
+    Runtime counters: request coalescing, database lanes, bulk admission and SQL statements
+    """
+    return {
+        "single_flight": flights.stats(),
+        "db_lanes": executor.stats(),
+        "bulk_admission": admission.bulk.stats(),
+        "bulk_jobs": await executor.read(jobs.queue_stats),
+        "write_transactions": services.write_metrics.stats(),
+        "statements": sqltrace.statement_stats.stats(),
+    }
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus metrics; a plain def so collectors run in the threadpool
+    """
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+def require_profiling_token(request: Request):
+    """Allow profile admin endpoints only with the profiling token"""
+    token = request.headers.get(profiling.HEADER) or request.query_params.get(profiling.QUERY_PARAM)
+    error = profiling.admin_error(token)
+    if error is not None:
+        raise HTTPException(status_code=error[0], detail=error[1])
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_profiling_token)])
+async def list_profiles():
+    """
+    Profiled requests kept in this worker's ring buffer, newest first
+    """
+    return APIResponse(data=profiling.profiles.list())
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_profiling_token)])
+async def get_profile(profile_id: str, format: str = Query("text", pattern="^(text|pstats)$")):
+    """
+    A kept profile as a cumulative-time summary or a pstats file download
+    """
+    record = profiling.profiles.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if format == "pstats":
+        return Response(
+            record.pstats,
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename={profile_id}.prof"}
+        )
+    return Response(record.summary, media_type="text/plain")
+
+@app.get("/api/jobs/{job_id}", response_model=APIResponse)
+async def get_job(job_id: str):
+    """
+    Status and result of a queued bulk operation
+    """
+    return APIResponse(data=await executor.read(jobs.get_job, job_id))
+
+@app.get("/api/ready")
+async def ready():
+    """
+    Readiness probe: 200 once this process has warmed its caches
+    """
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 # Root endpoint for testing
 @app.get("/")
-def root():
+async def root():
     """Root endpoint"""
     return {"message": "Tag Manager V2 API", "version": "2.0.0"}
 
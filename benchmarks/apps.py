@@ -0,0 +1,161 @@
+"""
+In-process clients for benchmarking both apps
+
+load_app() imports the Flask or FastAPI app from the current working
+directory's data/ (see catalog.py). It then runs the app's normal warm-up.
+The returned client exposes one async request() method for both apps:
+
+- FastAPI runs through httpx's ASGI transport on the running event loop
+- Flask runs through its test client on a worker thread, so concurrent
+  callers behave like a threaded WSGI server
+
+URLClient sends the same requests to a running server instead.
+
+Response bodies, including streamed ones, are read completely and then
+closed, so the timing covers what a real client waits for. They are
+counted chunk by chunk and not kept, so a client never holds a whole
+large response and memory measurements see only the app's own use.
+"""
+
+import asyncio
+import json as jsonlib
+import sys
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import unquote
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+APPS = ("fastapi", "flask")
+
+
+class ASGIClient:
+    """Calls an ASGI app directly; httpx's ASGI transport buffers whole bodies"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _call(self, method: str, url: str, json=None, headers: Optional[dict] = None,
+                    keep_body: bool = False) -> Tuple[int, int, bytes]:
+        path, _, query = url.partition("?")
+        body = b"" if json is None else jsonlib.dumps(json).encode("utf-8")
+        raw_headers = [(b"host", b"bench")]
+        if json is not None:
+            raw_headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        raw_headers += [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in (headers or {}).items()]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": unquote(path), "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"), "root_path": "", "headers": raw_headers,
+            "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        complete = asyncio.Event()
+        request_sent = False
+        status, size, chunks = 500, 0, []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+                if not message.get("more_body", False):
+                    complete.set()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            complete.set()
+        return status, size, b"".join(chunks)
+
+    async def request(self, method: str, url: str, json=None, headers: Optional[dict] = None) -> Tuple[int, int]:
+        """Send a request; returns (status, body bytes)"""
+        status, size, _ = await self._call(method, url, json, headers)
+        return status, size
+
+    async def get_json(self, url: str):
+        status, _, body = await self._call("GET", url, keep_body=True)
+        if status != 200:
+            raise RuntimeError(f"GET {url} returned {status}")
+        return jsonlib.loads(body)
+
+    async def close(self):
+        pass
+
+
+class URLClient:
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        import httpx
+        self._client = httpx.AsyncClient(base_url=base_url, timeout=timeout,
+                                         limits=httpx.Limits(max_connections=None))
+
+    async def request(self, method: str, url: str, json=None, headers: Optional[dict] = None) -> Tuple[int, int]:
+        """Send a request; returns (status, body bytes)"""
+        async with self._client.stream(method, url, json=json, headers=headers) as response:
+            size = 0
+            async for chunk in response.aiter_raw():
+                size += len(chunk)
+            return response.status_code, size
+
+    async def get_json(self, url: str):
+        response = await self._client.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class WSGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    def _request(self, method: str, url: str, json=None, headers: Optional[dict] = None) -> Tuple[int, int]:
+        # Test clients are not thread-safe; they are cheap to create
+        response = self.app.test_client().open(url, method=method, json=json, headers=headers)
+        try:
+            return response.status_code, sum(len(chunk) for chunk in response.iter_encoded())
+        finally:
+            response.close()
+
+    async def request(self, method: str, url: str, json=None, headers: Optional[dict] = None) -> Tuple[int, int]:
+        """Send a request; returns (status, body bytes)"""
+        return await asyncio.to_thread(self._request, method, url, json, headers)
+
+    def _get_json(self, url: str):
+        response = self.app.test_client().get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return response.get_json()
+
+    async def get_json(self, url: str):
+        return await asyncio.to_thread(self._get_json, url)
+
+    async def close(self):
+        pass
+
+
+async def load_app(name: str):
+    """Import and warm up an app in this process; returns a client for it"""
+    if name == "fastapi":
+        import app_fastapi
+        await app_fastapi.startup_event()
+        return ASGIClient(app_fastapi.app)
+    if name == "flask":
+        import app
+        await asyncio.to_thread(app.warm_worker)
+        return WSGIClient(app.app)
+    raise ValueError(f"Unknown app {name!r}; expected one of {', '.join(APPS)}")
@@ -0,0 +1,143 @@
+"""
+Benchmark read latency on the FastAPI app while a bulk assignment is running
+
+A bulk assignment of one category to N products (default 50k) runs on the
+bulk lane while concurrent clients keep reading product pages and product
+categories through the ASGI app in-process. Reports p50/p95/p99 read latency.
+
+Usage:
+    python benchmarks/bench_concurrency.py [--products 50000] [--clients 8] [--single-lane]
+
+--single-lane routes reads through the bulk lane to show the latency reads
+would see if they queued behind bulk writes.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def prepare_workdir(products: int) -> str:
+    """Create a scratch data/ directory with `products` products"""
+    workdir = tempfile.mkdtemp(prefix="tagmgr-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(ROOT / "data" / "category.json", os.path.join(workdir, "data", "category.json"))
+    os.chdir(workdir)
+
+    import database
+    database.ensure_table_schema()
+    with database.get_db_connection_context() as conn:
+        conn.executemany(
+            "INSERT INTO product_categories (product_id, product_name) VALUES (?, ?)",
+            ((f"product-{i:07d}", f"Benchmark Product {i}") for i in range(products))
+        )
+        conn.commit()
+    return workdir
+
+
+def bulk_assign(conn: sqlite3.Connection, product_ids, category_ids):
+    """Same per-product work as the Flask bulk-assign-categories endpoint"""
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    for product_id in product_ids:
+        cursor.execute('SELECT category_id FROM product_category_mapping WHERE product_id = ?', (product_id,))
+        current = {row[0] for row in cursor.fetchall()}
+        for category_id in category_ids:
+            if category_id not in current:
+                cursor.execute(
+                    'INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)',
+                    (product_id, category_id)
+                )
+        cursor.execute(
+            'UPDATE product_categories SET last_modified = CURRENT_TIMESTAMP WHERE product_id = ?',
+            (product_id,)
+        )
+    conn.commit()
+
+
+async def reader(client, product_count: int, stop: asyncio.Event, latencies: list):
+    rng = random.Random()
+    while not stop.is_set():
+        if rng.random() < 0.5:
+            url = f"/api/products/product-{rng.randrange(product_count):07d}/categories"
+        else:
+            url = f"/api/products?limit=50&offset={rng.randrange(max(product_count - 50, 1))}"
+        start = time.perf_counter()
+        response = await client.get(url)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} -> {response.status_code}: {response.text[:200]}")
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(args):
+    import httpx
+    from app_fastapi import app
+    from db_executor import executor
+
+    if args.single_lane:
+        executor.lanes["read"] = executor.lanes["bulk"]
+
+    product_ids = [f"product-{i:07d}" for i in range(args.products)]
+    latencies = []
+    stop = asyncio.Event()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up connections and caches before measuring
+        await client.get("/api/products?limit=1")
+
+        readers = [
+            asyncio.create_task(reader(client, args.products, stop, latencies))
+            for _ in range(args.clients)
+        ]
+        start = time.perf_counter()
+        await executor.bulk(bulk_assign, product_ids, ["Tiling Products", "Tile Adhesives"])
+        bulk_seconds = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*readers)
+
+    to_ms = 1000
+    print(f"mode:            {'single lane' if args.single_lane else 'priority lanes'}")
+    print(f"bulk assign:     {args.products:,} products in {bulk_seconds:.2f}s")
+    print(f"reads completed: {len(latencies):,} ({len(latencies) / bulk_seconds:,.0f}/s)")
+    if latencies:
+        print(f"read p50:        {statistics.median(latencies) * to_ms:.2f} ms")
+        print(f"read p95:        {percentile(latencies, 95) * to_ms:.2f} ms")
+        print(f"read p99:        {percentile(latencies, 99) * to_ms:.2f} ms")
+        print(f"read max:        {max(latencies) * to_ms:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--single-lane", action="store_true")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir(args.products)
+    try:
+        asyncio.run(run(args))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
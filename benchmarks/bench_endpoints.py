@@ -0,0 +1,304 @@
+"""
+Time every endpoint of both apps in-process on synthetic catalogs
+
+For each catalog size a deterministic catalog is generated (see
+catalog.py). Each app then runs in its own subprocess on a fresh copy of
+the catalog and times every endpoint. The first call of each endpoint is
+reported separately (cold caches) from the median of the rest. Reads run
+before writes, and the writes are built so that every repetition does real
+work. Bulk pacing is disabled (BULK_ROWS_PER_SECOND=0) to time the
+database work itself.
+
+Results are written as JSON (benchmarks/results/ by default). Pass
+--compare with an earlier file to see how medians moved. Each endpoint's
+first size over --slo-ms is reported as where it stops scaling.
+
+Usage:
+    python benchmarks/bench_endpoints.py [--sizes 1000 10000 100000 1000000] [--apps fastapi flask]
+        [--repeat 5] [--slo-ms 500] [--output results.json] [--compare earlier.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import catalog  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Products per bulk request and per bulk-categories lookup
+BATCH = 1000
+
+# Seconds spent repeating one endpoint after its first call
+BUDGET = 10.0
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def endpoint_cases(conn: sqlite3.Connection, products: int, repeat: int) -> List[dict]:
+    """
+    Requests to time, as {name, method, url(i), json(i), headers, write}.
+
+    url and json take the repetition number, so writes touch different rows
+    each time and removals find something to remove.
+    """
+    batch = min(BATCH, products)
+    ids = [catalog.product_id(i) for i in range(products)]
+    middle = catalog.product_id(products // 2)
+    # Names follow catalog.build_taxonomy
+    level1, level2, level3 = "Category 01", "Category 01.01", "Category 01.01.01"
+    mapped = conn.execute('''
+        SELECT product_id, category_id FROM product_category_mapping
+        WHERE category_id LIKE '%.%.%' ORDER BY product_id LIMIT ?
+    ''', (repeat + 1,)).fetchall()
+
+    def ids_for(i: int) -> List[str]:
+        start = (i * batch) % max(products - batch + 1, 1)
+        return ids[start:start + batch]
+
+    def case(name, method, url, body=None, headers=None, write=False):
+        return {
+            "name": name,
+            "method": method,
+            "url": url if callable(url) else (lambda i, url=url: url),
+            "json": body if callable(body) or body is None else (lambda i, body=body: body),
+            "headers": headers,
+            "write": write,
+        }
+
+    return [
+        case("products page", "GET", f"/api/products?limit=50&offset={products // 2}"),
+        case("products unallocated", "GET", "/api/products?hide_allocated=true&limit=50"),
+        case("products ndjson", "GET", "/api/products", headers=NDJSON),
+        case("products page hydrated", "GET", f"/api/products/page?limit=50&offset={products // 2}"),
+        case("product categories", "GET", f"/api/products/{middle}/categories"),
+        case("product last-modified", "GET", f"/api/products/{middle}/last-modified"),
+        case("bulk-categories", "POST", "/api/products/bulk-categories", lambda i: {"product_ids": ids_for(i)}),
+        case("bulk-categories-summary", "POST", "/api/products/bulk-categories-summary",
+             lambda i: {"product_ids": ids_for(i)}),
+        case("products query", "POST", "/api/products/query",
+             {"expression": {"and": [level1, "Category 02", {"not": level2}]}, "limit": 50}),
+        case("products query subtree count", "POST", "/api/products/query",
+             {"expression": {"not": {"category": level1, "subtree": True}}, "count_only": True}),
+        case("statistics", "GET", "/api/products/statistics"),
+        case("categorization-status", "GET", "/api/products/categorization-status"),
+        case("categorization-status ndjson", "GET", "/api/products/categorization-status", headers=NDJSON),
+        case("export csv", "GET", "/api/export/csv"),
+        case("categories", "GET", "/api/categories"),
+        case("categories level1", "GET", "/api/categories/level1"),
+        case("categories level2", "GET", f"/api/categories/level2/{level1}"),
+        case("categories level3", "GET", f"/api/categories/level3/{level2}"),
+        case("categories tree", "GET", "/api/categories/tree"),
+        case("category info", "GET", f"/api/categories/{level2}/info"),
+        case("category products", "GET", f"/api/categories/{level3}/products"),
+        case("assign categories", "POST", lambda i: f"/api/products/{ids[i % products]}/categories",
+             {"category_ids": ["Category 16.08.04"]}, write=True),
+        case("remove category", "DELETE",
+             lambda i: f"/api/products/{mapped[i % len(mapped)][0]}/category/{mapped[i % len(mapped)][1]}",
+             write=True),
+        case("bulk-assign", "POST", "/api/products/bulk-assign-categories",
+             lambda i: {"product_ids": ids_for(i), "category_ids": ["Category 16.08.03"]}, write=True),
+        case("bulk-remove", "POST", "/api/products/bulk-remove-categories",
+             lambda i: {"product_ids": ids_for(i), "category_ids": ["Category 16.08.03"]}, write=True),
+        case("category assign products", "POST", f"/api/categories/{level3}/products",
+             lambda i: {"product_ids": ids_for(i)}, write=True),
+        case("create category", "POST", "/api/categories/create",
+             lambda i: {"name": f"Bench Category {i}", "level": 1}, write=True),
+        case("delete category", "DELETE", "/api/categories/delete",
+             lambda i: {"category_name": f"Bench Category {i}"}, write=True),
+    ]
+
+
+async def time_app(app_name: str, products: int, repeat: int, budget: float) -> List[dict]:
+    """Worker side: time every case against one app in this process"""
+    from apps import load_app
+
+    client = await load_app(app_name)
+    conn = sqlite3.connect("data/products.db")
+    cases = endpoint_cases(conn, products, repeat)
+    conn.close()
+
+    results = []
+    try:
+        for spec in cases:
+            timings, statuses, size = [], set(), 0
+            started = time.perf_counter()
+            for i in range(repeat + 1):
+                if i > 1 and time.perf_counter() - started > budget:
+                    break
+                begin = time.perf_counter()
+                status, size = await client.request(
+                    spec["method"], spec["url"](i),
+                    json=spec["json"](i) if spec["json"] else None,
+                    headers=spec["headers"]
+                )
+                timings.append((time.perf_counter() - begin) * 1000)
+                statuses.add(status)
+            warm = timings[1:] or timings
+            results.append({
+                "app": app_name,
+                "products": products,
+                "endpoint": spec["name"],
+                "method": spec["method"],
+                "url": spec["url"](0),
+                "write": spec["write"],
+                "status": sorted(statuses),
+                "runs": len(timings),
+                "first_ms": round(timings[0], 3),
+                "median_ms": round(statistics.median(warm), 3),
+                "min_ms": round(min(warm), 3),
+                "max_ms": round(max(warm), 3),
+                "bytes": size,
+            })
+    finally:
+        await client.close()
+    return results
+
+
+def run_worker(app_name: str, workdir: str, products: int, repeat: int, budget: float,
+               timeout: float) -> List[dict]:
+    """Run time_app in a fresh process on its own copy of the catalog"""
+    app_dir = tempfile.mkdtemp(prefix=f"tagmgr-{app_name}-")
+    shutil.copytree(os.path.join(workdir, "data"), os.path.join(app_dir, "data"))
+    env = dict(os.environ, BULK_ROWS_PER_SECOND="0", PYTHONPATH=str(ROOT))
+    command = [sys.executable, str(Path(__file__).resolve()), "--worker", app_name,
+               "--products", str(products), "--repeat", str(repeat), "--budget", str(budget)]
+    try:
+        completed = subprocess.run(command, cwd=app_dir, env=env, capture_output=True, text=True,
+                                   timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return [{"app": app_name, "products": products, "error": f"timed out after {timeout:.0f}s"}]
+    finally:
+        shutil.rmtree(app_dir, ignore_errors=True)
+    if completed.returncode != 0:
+        return [{"app": app_name, "products": products, "error": completed.stderr.strip()[-2000:]}]
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scaling_limits(results: List[dict], slo_ms: float) -> Dict[str, Dict[str, Optional[int]]]:
+    """Per app and endpoint, the first catalog size whose median exceeds slo_ms"""
+    limits: Dict[str, Dict[str, Optional[int]]] = {}
+    for result in sorted((r for r in results if "error" not in r), key=lambda r: r["products"]):
+        endpoints = limits.setdefault(result["app"], {})
+        endpoints.setdefault(result["endpoint"], None)
+        if endpoints[result["endpoint"]] is None and result["median_ms"] > slo_ms:
+            endpoints[result["endpoint"]] = result["products"]
+    return limits
+
+
+def print_table(results: List[dict], sizes: List[int]):
+    for app_name in dict.fromkeys(r["app"] for r in results):
+        rows = [r for r in results if r["app"] == app_name]
+        for error in (r for r in rows if "error" in r):
+            print(f"{app_name} at {error['products']:,} products failed: {error['error']}")
+        print(f"\n{app_name}: median ms (first call ms)")
+        print(f"{'endpoint':<30}" + "".join(f"{size:>22,}" for size in sizes))
+        for endpoint in dict.fromkeys(r["endpoint"] for r in rows if "error" not in r):
+            cells = []
+            for size in sizes:
+                match = next((r for r in rows if r.get("endpoint") == endpoint and r["products"] == size), None)
+                cells.append(f"{match['median_ms']:>10.1f} ({match['first_ms']:>8.1f})" if match else f"{'-':>22}")
+            print(f"{endpoint:<30}" + "".join(f"{cell:>22}" for cell in cells))
+
+
+def print_comparison(results: List[dict], previous_path: str):
+    with open(previous_path) as f:
+        previous = {(r["app"], r["products"], r["endpoint"]): r for r in json.load(f)["results"] if "error" not in r}
+    print(f"\nmedian vs {previous_path}")
+    for result in results:
+        before = previous.get((result["app"], result["products"], result.get("endpoint")))
+        if before is None or "error" in result or not before["median_ms"]:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        flag = "  <-- slower" if ratio > 1.2 else ""
+        print(f"{result['app']:<8} {result['products']:>9,} {result['endpoint']:<30} "
+              f"{before['median_ms']:>10.1f} -> {result['median_ms']:>10.1f} ms ({ratio:.2f}x){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--apps", nargs="+", default=["fastapi", "flask"], choices=["fastapi", "flask"])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per endpoint after the first")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="Seconds of repeats per endpoint")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds per app and size")
+    parser.add_argument("--slo-ms", type=float, default=500, help="Median latency counted as not scaling")
+    parser.add_argument("--density", type=float, default=catalog.DENSITY)
+    parser.add_argument("--seed", type=int, default=catalog.SEED)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/endpoints-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare medians with")
+    parser.add_argument("--worker", choices=["fastapi", "flask"], help=argparse.SUPPRESS)
+    parser.add_argument("--products", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        results = asyncio.run(time_app(args.worker, args.products, args.repeat, args.budget))
+        print(json.dumps(results))
+        return
+
+    results, catalogs = [], {}
+    for size in args.sizes:
+        workdir, info = catalog.scratch_catalog(size, density=args.density, seed=args.seed)
+        catalogs[size] = info
+        print(f"catalog {size:,}: {info['mappings']:,} mappings, built in {info['build_seconds']:.1f}s",
+              flush=True)
+        try:
+            for app_name in args.apps:
+                results.extend(run_worker(app_name, workdir, size, args.repeat, args.budget, args.timeout))
+        finally:
+            catalog.remove_catalog(workdir)
+
+    limits = scaling_limits(results, args.slo_ms)
+    report = {
+        "benchmark": "endpoints",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {"repeat": args.repeat, "budget": args.budget, "slo_ms": args.slo_ms,
+                     "density": args.density, "seed": args.seed},
+        "catalogs": catalogs,
+        "scaling_limits": limits,
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"endpoints-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print_table(results, args.sizes)
+    print(f"\nfirst size over {args.slo_ms:.0f} ms:")
+    for app_name, endpoints in limits.items():
+        over = {endpoint: size for endpoint, size in endpoints.items() if size is not None}
+        print(f"  {app_name}: " + (", ".join(f"{e} at {s:,}" for e, s in over.items()) or "none"))
+    if args.compare:
+        print_comparison(results, args.compare)
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
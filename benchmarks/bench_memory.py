@@ -0,0 +1,313 @@
+"""
+Peak memory of import, export and large listings on synthetic catalogs
+
+Each scenario runs in a fresh subprocess on its own copy of a catalog (see
+catalog.py), so one scenario's caches and allocator state do not affect
+the next. Scenarios:
+
+- import:   database.init_products() loading data/input_file.csv into an
+            empty products.db
+- per app:  GET /api/export/csv, the full /api/products listing (Flask;
+            FastAPI pages at 1000) and /api/products/categorization-status,
+            each as JSON and as NDJSON where the endpoint streams
+
+Two numbers are reported for each scenario, from separate runs:
+
+- RSS: the process's peak resident set during the scenario. On Linux the
+  high-water mark is reset after the app has loaded and warmed up, so it
+  covers only the scenario. Elsewhere it is the process's lifetime peak.
+  This is what a memory-capped container compares against its limit.
+- tracemalloc: the peak of Python (and numpy) allocations during the
+  scenario. SQLite's own memory is not included. It runs separately
+  because tracing inflates RSS.
+
+--max-rss-mb fails any scenario whose peak RSS is over a limit, such as
+the container's memory cap. --baseline fails any scenario whose RSS
+growth or tracemalloc peak went up by more than --tolerance compared
+with an earlier --output file. On failure the script exits with status 1.
+
+Usage:
+    python benchmarks/bench_memory.py [--sizes 10000 100000 1000000] [--apps fastapi flask]
+        [--max-rss-mb 512] [--baseline earlier.json] [--tolerance 0.2] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import catalog  # noqa: E402
+from bench_endpoints import NDJSON, git_commit  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+MB = 1024 * 1024
+
+# (name, method, url, headers) measured against each app
+REQUESTS = (
+    ("export csv", "GET", "/api/export/csv", None),
+    ("products", "GET", "/api/products?limit=1000", None),
+    ("products ndjson", "GET", "/api/products", NDJSON),
+    ("categorization-status", "GET", "/api/products/categorization-status", None),
+    ("categorization-status ndjson", "GET", "/api/products/categorization-status", NDJSON),
+)
+
+IMPORT = "import"
+
+
+def scenarios(apps: List[str]) -> List[tuple]:
+    """(app or None, scenario name) pairs in run order"""
+    return [(None, IMPORT)] + [(app_name, request[0]) for app_name in apps for request in REQUESTS]
+
+
+class RSSMonitor:
+    """Peak resident set size of this process from reset() on"""
+
+    STATUS = "/proc/self/status"
+    CLEAR_REFS = "/proc/self/clear_refs"
+
+    def __init__(self):
+        self.resettable = os.access(self.CLEAR_REFS, os.W_OK)
+
+    def _status(self, field: str) -> Optional[int]:
+        try:
+            with open(self.STATUS) as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def current(self) -> int:
+        rss = self._status("VmRSS")
+        return rss if rss is not None else self.peak()
+
+    def reset(self):
+        if self.resettable:
+            # Writing 5 resets the VmHWM high-water mark (Linux 4.0+)
+            with open(self.CLEAR_REFS, "w") as f:
+                f.write("5")
+
+    def peak(self) -> int:
+        hwm = self._status("VmHWM")
+        if hwm is not None:
+            return hwm
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+async def prepare(app_name: Optional[str], scenario: str):
+    """Load what the scenario needs; returns an async callable running it"""
+    if app_name is None:
+        import database
+
+        async def run_import():
+            database.init_products()
+            with sqlite3.connect(database.DATABASE) as conn:
+                return conn.execute("SELECT COUNT(*) FROM product_categories").fetchone()[0]
+        return run_import, None
+
+    from apps import load_app
+
+    client = await load_app(app_name)
+    _, method, url, headers = next(request for request in REQUESTS if request[0] == scenario)
+
+    async def run_request():
+        status, size = await client.request(method, url, headers=headers)
+        if status != 200:
+            raise RuntimeError(f"{method} {url} returned {status}")
+        return size
+    return run_request, client
+
+
+async def measure(app_name: Optional[str], scenario: str, mode: str) -> dict:
+    """Worker side: run one scenario in this process and measure it"""
+    run, client = await prepare(app_name, scenario)
+    gc.collect()
+    result = {"app": app_name, "scenario": scenario}
+    try:
+        if mode == "rss":
+            monitor = RSSMonitor()
+            before = monitor.current()
+            monitor.reset()
+            started = time.perf_counter()
+            output = await run()
+            result.update({
+                "seconds": round(time.perf_counter() - started, 3),
+                "rss_before_mb": round(before / MB, 1),
+                "rss_peak_mb": round(monitor.peak() / MB, 1),
+                "rss_growth_mb": round(max(monitor.peak() - before, 0) / MB, 1),
+                "rss_peak_scoped": monitor.resettable,
+            })
+        else:
+            tracemalloc.start()
+            output = await run()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["tracemalloc_peak_mb"] = round(peak / MB, 1)
+        result["output"] = output
+    finally:
+        if client is not None:
+            await client.close()
+    return result
+
+
+def run_worker(app_name: Optional[str], scenario: str, mode: str, workdir: str, timeout: float) -> dict:
+    """Run measure() in a fresh process on its own copy of the catalog"""
+    scratch = tempfile.mkdtemp(prefix="tagmgr-memory-")
+    data_dir = os.path.join(scratch, "data")
+    shutil.copytree(os.path.join(workdir, "data"), data_dir)
+    if app_name is None:
+        # The import starts from an empty database
+        os.remove(os.path.join(data_dir, "products.db"))
+    else:
+        # Startup would otherwise re-import the CSV
+        os.remove(os.path.join(data_dir, "input_file.csv"))
+    env = dict(os.environ, BULK_ROWS_PER_SECOND="0", PYTHONPATH=str(ROOT))
+    command = [sys.executable, str(Path(__file__).resolve()), "--worker", scenario, "--mode", mode]
+    if app_name:
+        command += ["--app", app_name]
+    try:
+        completed = subprocess.run(command, cwd=scratch, env=env, capture_output=True, text=True,
+                                   timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"app": app_name, "scenario": scenario, "error": f"timed out after {timeout:.0f}s"}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if completed.returncode != 0:
+        return {"app": app_name, "scenario": scenario, "error": completed.stderr.strip()[-2000:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def key(result: dict) -> str:
+    return f"{result['app'] or '-'}/{result['scenario']}/{result['products']}"
+
+
+def check(results: List[dict], args) -> List[str]:
+    """Threshold failures, empty when everything is within limits"""
+    failures = [f"{key(r)}: {(r['error'].splitlines() or ['failed'])[-1]}" for r in results if "error" in r]
+    measured = [r for r in results if "error" not in r]
+    if args.max_rss_mb is not None:
+        failures += [f"{key(r)}: peak RSS {r['rss_peak_mb']:.1f} MB over {args.max_rss_mb:.0f} MB"
+                     for r in measured if r.get("rss_peak_mb", 0) > args.max_rss_mb]
+    if args.baseline:
+        with open(args.baseline) as f:
+            previous = {key(r): r for r in json.load(f)["results"] if "error" not in r}
+        for result in measured:
+            before = previous.get(key(result))
+            if before is None:
+                continue
+            for field in ("rss_growth_mb", "tracemalloc_peak_mb"):
+                old, new = before.get(field), result.get(field)
+                # Changes under a megabyte are noise
+                if old is None or new is None or new - old < 1:
+                    continue
+                if new > old * (1 + args.tolerance):
+                    failures.append(f"{key(result)}: {field} {old:.1f} -> {new:.1f} MB "
+                                    f"(over {args.tolerance:.0%} tolerance)")
+    return failures
+
+
+def print_table(results: List[dict], sizes: List[int]):
+    print("\npeak RSS MB (growth MB) / tracemalloc peak MB")
+    print(f"{'scenario':<40}" + "".join(f"{size:>26,}" for size in sizes))
+    for app_name, scenario in dict.fromkeys((r["app"], r["scenario"]) for r in results):
+        cells = []
+        for size in sizes:
+            match = next((r for r in results if (r["app"], r["scenario"], r["products"]) ==
+                          (app_name, scenario, size)), None)
+            if match is None:
+                cells.append("-")
+            elif "error" in match:
+                cells.append("error")
+            else:
+                cells.append(f"{match.get('rss_peak_mb', 0):.0f} ({match.get('rss_growth_mb', 0):.0f}) / "
+                             f"{match.get('tracemalloc_peak_mb', 0):.0f}")
+        label = f"{app_name} {scenario}" if app_name else scenario
+        print(f"{label:<40}" + "".join(f"{cell:>26}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--apps", nargs="+", default=["fastapi", "flask"], choices=["fastapi", "flask"])
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Only measure RSS")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per scenario run")
+    parser.add_argument("--density", type=float, default=catalog.DENSITY)
+    parser.add_argument("--seed", type=int, default=catalog.SEED)
+    parser.add_argument("--max-rss-mb", type=float, help="Fail when a scenario's peak RSS exceeds this")
+    parser.add_argument("--baseline", help="Earlier --output file; fail when memory grew beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/memory-<time>.json)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--app", choices=["fastapi", "flask"], help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=["rss", "tracemalloc"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(measure(args.app, args.worker, args.mode))))
+        return
+
+    modes = ["rss"] if args.no_tracemalloc else ["rss", "tracemalloc"]
+    results, catalogs = [], {}
+    for size in args.sizes:
+        workdir, info = catalog.scratch_catalog(size, density=args.density, seed=args.seed, with_csv=True)
+        catalogs[size] = info
+        print(f"catalog {size:,}: {info['mappings']:,} mappings, built in {info['build_seconds']:.1f}s",
+              flush=True)
+        try:
+            for app_name, scenario in scenarios(args.apps):
+                result = {"products": size}
+                for mode in modes:
+                    result.update(run_worker(app_name, scenario, mode, workdir, args.timeout))
+                    if "error" in result:
+                        break
+                results.append(result)
+        finally:
+            catalog.remove_catalog(workdir)
+
+    failures = check(results, args)
+    report = {
+        "benchmark": "memory",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {"density": args.density, "seed": args.seed, "modes": modes},
+        "catalogs": catalogs,
+        "results": results,
+        "failures": failures,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"memory-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print_table(results, args.sizes)
+    print(f"\nresults written to {output}")
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
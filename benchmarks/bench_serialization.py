@@ -0,0 +1,98 @@
+"""
+Benchmark the /api/products serialization paths - model validation vs trusted fast path
+
+Usage:
+    python benchmarks/bench_serialization.py [--sizes 1000 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+# Add project root to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import APIResponse, ProductSummary
+from serialization import api_response_bytes, product_summary_rows
+
+RESPONSE_FIELD = create_response_field(name="response", type_=APIResponse)
+
+
+def build_rows(count: int):
+    """Create `count` rows shaped like the get_products query result"""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE product_categories (
+            product_id TEXT PRIMARY KEY,
+            product_name TEXT NOT NULL,
+            last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO product_categories (product_id, product_name) VALUES (?, ?)",
+        ((f"product-{i:07d}", f"Benchmark Product {i}") for i in range(count))
+    )
+    rows = conn.execute(
+        "SELECT *, (rowid % 4) AS category_count FROM product_categories"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def model_path(rows) -> bytes:
+    """Previous behaviour: ProductSummary per row, APIResponse, response_model re-validation"""
+    product_list = [
+        ProductSummary(
+            product_id=row['product_id'],
+            product_name=row['product_name'],
+            has_allocations=row['category_count'] > 0,
+            category_count=row['category_count'],
+            last_modified=row['last_modified'] if row['last_modified'] else None
+        )
+        for row in rows
+    ]
+    response = APIResponse(data=product_list, metadata={"filtered_products": len(product_list)})
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=response))
+    return JSONResponse(content).body
+
+
+def fast_path(rows) -> bytes:
+    """Trusted-output path used by get_products"""
+    product_list = product_summary_rows(rows)
+    return api_response_bytes(product_list, metadata={"filtered_products": len(product_list)})
+
+
+def measure(func, rows, repeat: int) -> float:
+    """Return the best rows/sec over `repeat` runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - start)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'model rows/s':>14}  {'fast rows/s':>14}  {'speedup':>8}")
+    for size in args.sizes:
+        rows = build_rows(size)
+        before = measure(model_path, rows, args.repeat)
+        after = measure(fast_path, rows, args.repeat)
+        print(f"{size:>8}  {before:>14,.0f}  {after:>14,.0f}  {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Time from process start to the first served request, for both apps
+
+Each run is a fresh interpreter on its own copy of a synthetic catalog
+(see catalog.py) that includes the product CSV. The run is split into
+phases: interpreter start, importing the app module, the app's startup
+(FastAPI's startup event, Flask's per-worker warm-up), and the first
+request (GET /api/products?limit=50). The sum is the time to first
+request. How long the CSV import took to finish in the background is
+reported separately.
+
+Two catalog states are measured:
+
+- changed:   the CSV has not been imported yet, as after a deploy with a
+             new file; IMPORT_ON_STARTUP decides whether startup waits for it
+- unchanged: the CSV was already imported, as on a plain restart
+
+Pass --importtime to list the slowest module imports of each app.
+
+Usage:
+    python benchmarks/bench_startup.py [--sizes 10000 100000 1000000] [--apps fastapi flask]
+        [--modes background blocking] [--repeat 3] [--importtime] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import catalog  # noqa: E402
+from bench_endpoints import git_commit  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+MODULES = {"fastapi": "app_fastapi", "flask": "app"}
+FIRST_REQUEST = "/api/products?limit=50"
+PHASES = ("interpreter", "import_app", "startup", "first_request")
+
+
+async def time_startup(app_name: str, spawned: float) -> dict:
+    """Worker side: start one app in this fresh process and time each phase"""
+    phases = {"interpreter": time.time() - spawned}
+    started = time.perf_counter()
+    module = importlib.import_module(MODULES[app_name])
+    phases["import_app"] = time.perf_counter() - started
+
+    from apps import ASGIClient, WSGIClient
+    import warmup
+
+    started = time.perf_counter()
+    if app_name == "fastapi":
+        await module.startup_event()
+        client = ASGIClient(module.app)
+    else:
+        await asyncio.to_thread(module.warm_worker)
+        client = WSGIClient(module.app)
+    phases["startup"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    status, _ = await client.request("GET", FIRST_REQUEST)
+    phases["first_request"] = time.perf_counter() - started
+    first_request_at = time.time() - spawned
+    pandas_loaded = "pandas" in sys.modules
+
+    while warmup.import_status()["state"] == "running":
+        await asyncio.sleep(0.05)
+    return {
+        "status": status,
+        "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        "time_to_first_request_ms": round(first_request_at * 1000, 1),
+        "import_finished_ms": round((time.time() - spawned) * 1000, 1),
+        "import": warmup.import_status(),
+        "pandas_loaded_before_first_request": pandas_loaded,
+    }
+
+
+def run_worker(app_name: str, workdir: str, mode: str, timeout: float, importtime: bool = False) -> dict:
+    """Start an app in a fresh process on its own copy of the catalog"""
+    scratch = tempfile.mkdtemp(prefix="tagmgr-startup-")
+    # copytree keeps modification times, so an imported CSV stays recognised
+    shutil.copytree(os.path.join(workdir, "data"), os.path.join(scratch, "data"))
+    env = dict(os.environ, IMPORT_ON_STARTUP=mode, PYTHONPATH=str(ROOT))
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [
+        str(Path(__file__).resolve()), "--worker", app_name, "--spawned", repr(time.time())]
+    try:
+        completed = subprocess.run(command, cwd=scratch, env=env, capture_output=True, text=True,
+                                   timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {timeout:.0f}s"}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip()[-2000:]}
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if importtime:
+        result["slowest_imports"] = slowest_imports(completed.stderr)
+    return result
+
+
+def slowest_imports(stderr: str, limit: int = 15) -> List[dict]:
+    """Packages by cumulative import time, from -X importtime output"""
+    totals: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # A package's own import includes its submodules and dependencies
+        package = name.strip().split(".")[0]
+        if package not in MODULES.values():
+            totals[package] = max(totals.get(package, 0), int(cumulative))
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"module": name, "ms": round(us / 1000, 1)} for name, us in ranked]
+
+
+def summarize(runs: List[dict]) -> dict:
+    """Median of each timing over repeated runs"""
+    ok = [run for run in runs if "error" not in run]
+    if not ok:
+        return {"error": runs[-1]["error"]}
+    return {
+        "runs": len(ok),
+        "status": sorted({run["status"] for run in ok}),
+        "phases_ms": {phase: round(statistics.median(run["phases_ms"][phase] for run in ok), 1)
+                      for phase in PHASES},
+        "time_to_first_request_ms": round(statistics.median(run["time_to_first_request_ms"] for run in ok), 1),
+        "import_finished_ms": round(statistics.median(run["import_finished_ms"] for run in ok), 1),
+        "import_state": ok[-1]["import"]["state"],
+        "pandas_loaded_before_first_request": any(run["pandas_loaded_before_first_request"] for run in ok),
+    }
+
+
+def print_table(results: List[dict]):
+    print(f"\n{'app':<8} {'products':>10} {'csv':<10} {'mode':<11}"
+          + "".join(f"{phase:>15}" for phase in PHASES) + f"{'first req ms':>14}{'import done':>13}")
+    for result in results:
+        prefix = f"{result['app']:<8} {result['products']:>10,} {result['csv']:<10} {result['mode']:<11}"
+        if "error" in result:
+            print(f"{prefix} failed: {result['error'].splitlines()[-1] if result['error'] else ''}")
+            continue
+        print(prefix + "".join(f"{result['phases_ms'][phase]:>15.1f}" for phase in PHASES)
+              + f"{result['time_to_first_request_ms']:>14.1f}{result['import_finished_ms']:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--apps", nargs="+", default=["fastapi", "flask"], choices=["fastapi", "flask"])
+    parser.add_argument("--modes", nargs="+", default=["background", "blocking"],
+                        choices=["background", "blocking", "off"], help="IMPORT_ON_STARTUP values to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per combination; medians are reported")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds per run")
+    parser.add_argument("--importtime", action="store_true", help="Also list the slowest imports per app")
+    parser.add_argument("--seed", type=int, default=catalog.SEED)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/startup-<time>.json)")
+    parser.add_argument("--worker", choices=["fastapi", "flask"], help=argparse.SUPPRESS)
+    parser.add_argument("--spawned", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(time_startup(args.worker, args.spawned))))
+        return
+
+    results, catalogs, imports = [], {}, {}
+    for size in args.sizes:
+        workdir, info = catalog.scratch_catalog(size, seed=args.seed, with_csv=True)
+        catalogs[size] = info
+        print(f"catalog {size:,}: built in {info['build_seconds']:.1f}s", flush=True)
+        try:
+            for csv_state in ("changed", "unchanged"):
+                if csv_state == "unchanged":
+                    # Record the CSV as imported, as a previous start would have
+                    subprocess.run([sys.executable, str(ROOT / "warmup.py"), "import"], cwd=workdir,
+                                   env=dict(os.environ, PYTHONPATH=str(ROOT)), capture_output=True, check=True)
+                # The import mode only matters while there is something to import
+                for mode in args.modes if csv_state == "changed" else args.modes[:1]:
+                    for app_name in args.apps:
+                        runs = [run_worker(app_name, workdir, mode, args.timeout) for _ in range(args.repeat)]
+                        results.append({"app": app_name, "products": size, "csv": csv_state, "mode": mode,
+                                        **summarize(runs)})
+            if args.importtime and size == args.sizes[0]:
+                for app_name in args.apps:
+                    run = run_worker(app_name, workdir, "off", args.timeout, importtime=True)
+                    imports[app_name] = run.get("slowest_imports", run.get("error"))
+        finally:
+            catalog.remove_catalog(workdir)
+
+    report = {
+        "benchmark": "startup",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "settings": {"repeat": args.repeat, "modes": args.modes, "seed": args.seed},
+        "catalogs": catalogs,
+        "results": results,
+        "slowest_imports": imports,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"startup-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print_table(results)
+    for app_name, modules in imports.items():
+        print(f"\n{app_name}: slowest imports (cumulative ms)")
+        if isinstance(modules, str):
+            print(f"  failed: {modules}")
+            continue
+        for entry in modules:
+            print(f"  {entry['module']:<40} {entry['ms']:>8.1f}")
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Deterministic synthetic catalogs for benchmarks
+
+Builds a scratch data/ directory with the same layout the apps read from:
+a 3-level taxonomy in data/category.json (shaped like the real one), a
+products.db with N products and category mappings, and optionally the
+import CSV (data/input_file.csv) with Handle/Title and filler columns.
+The same seed and sizes always produce the same catalog.
+
+Mapping density is the share of products with categories. Each of them
+gets LEAVES categories on average, chosen from levels 2 and 3. Every
+chosen category is stored with its ancestors, the same way the assign
+endpoints store them.
+
+Usage:
+    python benchmarks/catalog.py --products 100000 --out /tmp/catalog [--density 0.6] [--csv]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Categories per level: level 1, level 2 per level 1, level 3 per level 2
+TAXONOMY_SHAPE = (16, 8, 4)
+DENSITY = 0.6
+LEAVES = 1.5
+SEED = 42
+
+WORDS = (
+    "Acrylic Adhesive Anchor Bond Cement Coating Compound Concrete Crack Epoxy Fibre Filler "
+    "Flexible Floor Grout Hybrid Joint Membrane Mortar Patch Polymer Primer Rapid Render Repair "
+    "Resin Screed Sealant Silicone Structural Tile Waterproof Wall Board Joint Liquid Heavy Duty"
+).split()
+
+CSV_COLUMNS = ("Handle", "Title", "Body (HTML)", "Vendor", "Type", "Variant SKU", "Variant Price", "Status")
+
+
+def build_taxonomy(shape: Tuple[int, int, int] = TAXONOMY_SHAPE) -> List[Dict[str, Optional[str]]]:
+    """category.json entries for a full tree of the given shape"""
+    level1, level2, level3 = shape
+    entries = []
+    for a in range(level1):
+        top = f"Category {a + 1:02d}"
+        entries.append({"category_name": top, "category_level": "Level 1 Category", "connected_to": None})
+        for b in range(level2):
+            middle = f"{top}.{b + 1:02d}"
+            entries.append({"category_name": middle, "category_level": "Level 2 Category", "connected_to": top})
+            for c in range(level3):
+                entries.append({
+                    "category_name": f"{middle}.{c + 1:02d}",
+                    "category_level": "Level 3 Category",
+                    "connected_to": middle,
+                })
+    return entries
+
+
+def product_id(index: int) -> str:
+    return f"synthetic-{index:07d}"
+
+
+def product_name(rng: random.Random, index: int) -> str:
+    return f"{' '.join(rng.sample(WORDS, 3))} {index}"
+
+
+def iter_mappings(products: int, taxonomy: List[dict], density: float, leaves: float,
+                  seed: int) -> Iterator[Tuple[str, str]]:
+    """(product_id, category_id) pairs including ancestors, deterministic for a seed"""
+    rng = random.Random(seed + 1)
+    parents = {entry["category_name"]: entry["connected_to"] for entry in taxonomy}
+    choices = [entry["category_name"] for entry in taxonomy if entry["connected_to"] is not None]
+    extra = max(0.0, leaves - 1)
+    for index in range(products):
+        if rng.random() >= density:
+            continue
+        count = 1 + int(extra) + (1 if rng.random() < extra - int(extra) else 0)
+        categories = set()
+        for leaf in rng.sample(choices, min(count, len(choices))):
+            while leaf is not None:
+                categories.add(leaf)
+                leaf = parents[leaf]
+        pid = product_id(index)
+        for category in sorted(categories):
+            yield pid, category
+
+
+def write_csv(path: str, products: int, seed: int = SEED):
+    """An import file with the columns init_products reads plus some filler"""
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for index in range(products):
+            name = product_name(rng, index)
+            writer.writerow((
+                product_id(index), name, f"<p>{name} for professional use.</p>", "Synthetic",
+                "Building Materials", f"SKU-{index:07d}", f"{10 + index % 90}.95", "active",
+            ))
+
+
+def build_catalog(workdir: str, products: int, density: float = DENSITY, leaves: float = LEAVES,
+                  shape: Tuple[int, int, int] = TAXONOMY_SHAPE, seed: int = SEED,
+                  with_csv: bool = False, with_db: bool = True) -> Dict[str, float]:
+    """
+    Write data/category.json, data/products.db and optionally data/input_file.csv.
+
+    Changes the working directory to `workdir`, because database.py resolves
+    its paths relative to it. Returns counts and the build time.
+    """
+    started = time.perf_counter()
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    os.chdir(workdir)
+
+    taxonomy = build_taxonomy(shape)
+    with open(os.path.join(data_dir, "category.json"), "w") as f:
+        json.dump(taxonomy, f, indent=2)
+    if with_csv:
+        write_csv(os.path.join(data_dir, "input_file.csv"), products, seed)
+
+    mappings = 0
+    if with_db:
+        import database
+        database.ensure_table_schema()
+        conn = sqlite3.connect(database.DATABASE)
+        conn.execute("PRAGMA synchronous = OFF")
+        rng = random.Random(seed)
+        conn.executemany(
+            "INSERT INTO product_categories (product_id, product_name) VALUES (?, ?)",
+            ((product_id(index), product_name(rng, index)) for index in range(products))
+        )
+        conn.executemany(
+            "INSERT INTO product_category_mapping (product_id, category_id) VALUES (?, ?)",
+            iter_mappings(products, taxonomy, density, leaves, seed)
+        )
+        mappings = conn.execute("SELECT COUNT(*) FROM product_category_mapping").fetchone()[0]
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.close()
+
+    return {
+        "products": products,
+        "categories": len(taxonomy),
+        "mappings": mappings,
+        "build_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def scratch_catalog(products: int, **kwargs) -> Tuple[str, Dict[str, float]]:
+    """Build a catalog in a new temporary directory; returns (workdir, info)"""
+    workdir = tempfile.mkdtemp(prefix="tagmgr-catalog-")
+    return workdir, build_catalog(workdir, products, **kwargs)
+
+
+def remove_catalog(workdir: str):
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--out", required=True, help="Directory to write data/ into")
+    parser.add_argument("--density", type=float, default=DENSITY, help="Share of products with categories")
+    parser.add_argument("--leaves", type=float, default=LEAVES, help="Mean categories chosen per mapped product")
+    parser.add_argument("--shape", type=int, nargs=3, default=TAXONOMY_SHAPE, metavar=("L1", "L2", "L3"))
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--csv", action="store_true", help="Also write data/input_file.csv")
+    args = parser.parse_args()
+
+    info = build_catalog(os.path.abspath(args.out), args.products, args.density, args.leaves,
+                         tuple(args.shape), args.seed, with_csv=args.csv)
+    print(json.dumps(info, indent=2))
+
+
+if __name__ == "__main__":
+    main()
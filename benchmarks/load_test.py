@@ -0,0 +1,341 @@
+"""
+Concurrent load test with a mixed editor workload
+
+Virtual users loop for --duration seconds, each picking an operation by
+weight and waiting --think-ms between operations:
+
+- browse:   a page of the product list at a random offset
+- filter:   unallocated products, a category's products or a category's children
+- view:     one product's categories
+- assign:   assign a category to one product, or remove it again
+- bulk:     bulk assign a category to --bulk-size products, or bulk remove it
+- export:   the CSV export
+- stats:    product statistics
+
+Per operation it reports throughput, p50/p95/p99 latency, and three rates:
+errors (other 4xx/5xx and exceptions), busy responses (503, i.e. the
+database was locked or a lane was full) and rejections (429 from bulk
+admission). Requests made during --warmup are not counted.
+
+The target is the FastAPI or Flask app run in-process on a synthetic
+catalog (see catalog.py), an existing data directory, or a running
+server (--url). Thresholds (--max-p99-ms, --max-error-rate,
+--max-busy-rate, or --baseline with --tolerance) make it exit with status 1,
+so it can gate releases.
+
+Usage:
+    python benchmarks/load_test.py --app fastapi --products 10000 --concurrency 16 --duration 30
+    python benchmarks/load_test.py --url http://localhost:8000 --concurrency 32 --duration 60
+    python benchmarks/load_test.py --app flask --mix browse=60,filter=20,view=20 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import catalog  # noqa: E402
+from apps import URLClient, load_app  # noqa: E402
+
+DEFAULT_MIX = "browse=35,filter=15,view=20,assign=15,bulk=5,export=5,stats=5"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name.strip()!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Catalog:
+    """Product and category ids the workload picks from"""
+
+    def __init__(self, product_ids: List[str], categories: List[dict]):
+        self.product_ids = product_ids
+        self.categories = categories
+        # "name" is the display path; "id" is what the endpoints take
+        self.level1 = [c["id"] for c in categories if c.get("level") == 1] or [c["id"] for c in categories]
+        self.assignable = [c["id"] for c in categories if c.get("level") != 1] or self.level1
+        # Categories written by the workload, kept apart from the filtered ones
+        self.assign_category = self.assignable[-1]
+        self.bulk_category = self.assignable[-2] if len(self.assignable) > 1 else self.assignable[-1]
+
+    @classmethod
+    async def discover(cls, client) -> "Catalog":
+        """Read ids from the running app, for any catalog"""
+        products = await _get_json(client, "/api/products?limit=1000")
+        categories = await _get_json(client, "/api/categories")
+        if not products or not categories:
+            raise SystemExit("The target has no products or no categories to load-test with")
+        return cls([p["product_id"] for p in products], categories)
+
+
+async def _get_json(client, url: str):
+    # Both apps serve the same data; FastAPI wraps it in an APIResponse
+    body = await client.get_json(url)
+    return body["data"] if isinstance(body, dict) and "data" in body else body
+
+
+class Workload:
+    """The operations, each sending one request through the client"""
+
+    def __init__(self, client, ids: Catalog, bulk_size: int):
+        self.client = client
+        self.ids = ids
+        self.bulk_size = bulk_size
+        # Alternate assign/remove so repeated runs keep the catalog stable
+        self._assigned: Dict[str, bool] = {}
+
+    async def browse(self, rng: random.Random) -> int:
+        offset = rng.randrange(max(len(self.ids.product_ids) - 50, 1))
+        status, _ = await self.client.request("GET", f"/api/products?limit=50&offset={offset}")
+        return status
+
+    async def filter(self, rng: random.Random) -> int:
+        choice = rng.random()
+        if choice < 0.4:
+            url = "/api/products?hide_allocated=true&limit=50"
+        elif choice < 0.7:
+            url = f"/api/categories/{quote(rng.choice(self.ids.assignable), safe='')}/products"
+        else:
+            url = f"/api/categories/level2/{quote(rng.choice(self.ids.level1), safe='')}"
+        status, _ = await self.client.request("GET", url)
+        return status
+
+    async def view(self, rng: random.Random) -> int:
+        status, _ = await self.client.request("GET", f"/api/products/{quote(rng.choice(self.ids.product_ids), safe='')}/categories")
+        return status
+
+    async def assign(self, rng: random.Random) -> int:
+        product_id = rng.choice(self.ids.product_ids)
+        category_id = self.ids.assign_category
+        key = f"{product_id}/{category_id}"
+        if self._assigned.pop(key, False):
+            status, _ = await self.client.request(
+                "DELETE", f"/api/products/{quote(product_id, safe='')}/category/{quote(category_id, safe='')}")
+        else:
+            self._assigned[key] = True
+            status, _ = await self.client.request(
+                "POST", f"/api/products/{quote(product_id, safe='')}/categories", json={"category_ids": [category_id]})
+        return status
+
+    async def bulk(self, rng: random.Random) -> int:
+        ids = self.ids.product_ids
+        size = min(self.bulk_size, len(ids))
+        start = rng.randrange(max(len(ids) - size + 1, 1))
+        body = {"product_ids": ids[start:start + size], "category_ids": [self.ids.bulk_category]}
+        endpoint = "bulk-assign-categories" if rng.random() < 0.5 else "bulk-remove-categories"
+        status, _ = await self.client.request("POST", f"/api/products/{endpoint}", json=body)
+        return status
+
+    async def export(self, rng: random.Random) -> int:
+        status, _ = await self.client.request("GET", "/api/export/csv")
+        return status
+
+    async def stats(self, rng: random.Random) -> int:
+        status, _ = await self.client.request("GET", "/api/products/statistics")
+        return status
+
+
+OPERATIONS = ("browse", "filter", "view", "assign", "bulk", "export", "stats")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.outcomes: Dict[str, Dict[str, int]] = {op: {"ok": 0, "error": 0, "busy": 0, "rejected": 0}
+                                                   for op in OPERATIONS}
+
+    def record(self, op: str, seconds: float, status: Optional[int]):
+        self.latencies[op].append(seconds)
+        if status is None or (status >= 400 and status not in (429, 503)):
+            outcome = "error"
+        elif status == 503:
+            outcome = "busy"
+        elif status == 429:
+            outcome = "rejected"
+        else:
+            outcome = "ok"
+        self.outcomes[op][outcome] += 1
+
+    def report(self, duration: float) -> Dict[str, dict]:
+        report = {}
+        for op in OPERATIONS:
+            latencies = self.latencies[op]
+            if not latencies:
+                continue
+            count = len(latencies)
+            outcomes = self.outcomes[op]
+            report[op] = {
+                "requests": count,
+                "throughput_rps": round(count / duration, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "max_ms": round(max(latencies) * 1000, 2),
+                "error_rate": round(outcomes["error"] / count, 4),
+                "busy_rate": round(outcomes["busy"] / count, 4),
+                "rejected_rate": round(outcomes["rejected"] / count, 4),
+                **outcomes,
+            }
+        return report
+
+
+async def virtual_user(workload: Workload, mix: Dict[str, float], seed: int, think: float,
+                       measure_from: float, stop_at: float, recorder: Recorder):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < stop_at:
+        op = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            status = await getattr(workload, op)(rng)
+        except Exception:
+            status = None
+        if started >= measure_from:
+            recorder.record(op, time.perf_counter() - started, status)
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+
+async def run(args, mix: Dict[str, float]) -> dict:
+    if args.url:
+        client = URLClient(args.url)
+    else:
+        if args.app == "flask":
+            # One thread per virtual user, like a threaded WSGI server
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(args.concurrency))
+        client = await load_app(args.app)
+    ids = await Catalog.discover(client)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    try:
+        await asyncio.gather(*(
+            virtual_user(Workload(client, ids, args.bulk_size), mix, args.seed + user, args.think_ms / 1000,
+                         measure_from, stop_at, recorder)
+            for user in range(args.concurrency)
+        ))
+    finally:
+        await client.close()
+    measured = time.perf_counter() - measure_from
+
+    operations = recorder.report(measured)
+    total = sum(op["requests"] for op in operations.values())
+    return {
+        "benchmark": "load",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "target": args.url or args.app,
+        "settings": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+                     "think_ms": args.think_ms, "bulk_size": args.bulk_size, "mix": mix,
+                     "products": None if args.url or args.data else args.products, "seed": args.seed},
+        "total": {
+            "requests": total,
+            "throughput_rps": round(total / measured, 2),
+            "error_rate": round(sum(op["error"] for op in operations.values()) / total, 4) if total else 0,
+            "busy_rate": round(sum(op["busy"] for op in operations.values()) / total, 4) if total else 0,
+            "rejected_rate": round(sum(op["rejected"] for op in operations.values()) / total, 4) if total else 0,
+        },
+        "operations": operations,
+    }
+
+
+def check(result: dict, args) -> List[str]:
+    """Threshold violations, as messages"""
+    failures = []
+    for name, op in result["operations"].items():
+        if args.max_p99_ms is not None and op["p99_ms"] > args.max_p99_ms:
+            failures.append(f"{name}: p99 {op['p99_ms']} ms > {args.max_p99_ms} ms")
+        if args.max_error_rate is not None and op["error_rate"] > args.max_error_rate:
+            failures.append(f"{name}: error rate {op['error_rate']:.2%} > {args.max_error_rate:.2%}")
+        if args.max_busy_rate is not None and op["busy_rate"] > args.max_busy_rate:
+            failures.append(f"{name}: busy rate {op['busy_rate']:.2%} > {args.max_busy_rate:.2%}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["operations"]
+        for name, op in result["operations"].items():
+            before = baseline.get(name)
+            if before and op["p95_ms"] > before["p95_ms"] * (1 + args.tolerance):
+                failures.append(f"{name}: p95 {op['p95_ms']} ms vs baseline {before['p95_ms']} ms")
+    return failures
+
+
+def print_report(result: dict):
+    print(f"{'operation':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'errors':>8} {'busy':>8} {'429':>8}")
+    for name, op in result["operations"].items():
+        print(f"{name:<10} {op['requests']:>9,} {op['throughput_rps']:>8.1f} {op['p50_ms']:>9.1f} "
+              f"{op['p95_ms']:>9.1f} {op['p99_ms']:>9.1f} {op['error_rate']:>8.2%} {op['busy_rate']:>8.2%} "
+              f"{op['rejected_rate']:>8.2%}")
+    total = result["total"]
+    print(f"{'total':<10} {total['requests']:>9,} {total['throughput_rps']:>8.1f} {'':>29} "
+          f"{total['error_rate']:>8.2%} {total['busy_rate']:>8.2%} {total['rejected_rate']:>8.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--app", choices=["fastapi", "flask"], default="fastapi", help="Run this app in-process")
+    target.add_argument("--url", help="Load a running server instead, e.g. http://localhost:8000")
+    parser.add_argument("--data", help="Existing directory containing data/ for an in-process app")
+    parser.add_argument("--products", type=int, default=10_000, help="Synthetic catalog size for an in-process app")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds before measuring")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a user's operations")
+    parser.add_argument("--bulk-size", type=int, default=500)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--seed", type=int, default=catalog.SEED)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--max-busy-rate", type=float)
+    parser.add_argument("--baseline", help="Earlier --output file; fail when p95 regresses beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.url:
+        if args.data:
+            os.chdir(args.data)
+        else:
+            workdir, info = catalog.scratch_catalog(args.products, seed=args.seed)
+            print(f"catalog: {info['products']:,} products, {info['mappings']:,} mappings", flush=True)
+    try:
+        result = asyncio.run(run(args, args.mix))
+    finally:
+        if workdir:
+            catalog.remove_catalog(workdir)
+
+    print_report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    failures = check(result, args)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+In-memory category bitmaps for Tag Manager V2
+
+Each category's products are kept as a bitset over product ordinals (the
+product_int of product_categories): one bit per product, packed eight to a byte
+with NumPy, about 125 KB per category per million products. Set algebra
+over categories ("in A and B but not C") is then a few vectorised AND, OR
+and AND NOT passes over those arrays instead of joins over the mapping.
+
+The bitsets follow product_category_links through category_counts.changes,
+which the mapping triggers bump for every row added or removed (see
+database.py and rollups.py). When the products scope moves, one query over
+category_counts finds the categories whose counter changed and only those
+are reloaded; growth past the allocated ordinal range reloads everything.
+
+Snapshots are immutable once published, so queries read them without
+locking while a refresh builds the next one.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import invalidation
+import metrics
+
+# Bitsets grow in steps of this many products, so imports rarely force a full reload
+ORDINAL_BLOCK = 1 << 16
+
+# Set bits per byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class Snapshot:
+    """Category bitsets and the set of all products as of one database state"""
+
+    def __init__(self, size: int, universe: np.ndarray, bitmaps: Dict[str, np.ndarray],
+                 changes: Dict[str, int], products: Tuple[int, int]):
+        self.size = size
+        self.universe = universe
+        self.bitmaps = bitmaps
+        self.changes = changes
+        self.products = products
+        self.empty = np.zeros(size // 8, dtype=np.uint8)
+
+    def category(self, name: str) -> np.ndarray:
+        return self.bitmaps.get(name, self.empty)
+
+    def union(self, bitsets: Iterable[np.ndarray]) -> np.ndarray:
+        result = self.empty.copy()
+        for bits in bitsets:
+            np.bitwise_or(result, bits, out=result)
+        return result
+
+    def intersection(self, bitsets: Iterable[np.ndarray]) -> np.ndarray:
+        result = self.universe.copy()
+        for bits in bitsets:
+            np.bitwise_and(result, bits, out=result)
+        return result
+
+    def difference(self, bits: np.ndarray, excluded: Iterable[np.ndarray]) -> np.ndarray:
+        result = bits.copy()
+        for other in excluded:
+            np.bitwise_and(result, np.invert(other), out=result)
+        return result
+
+
+def count(bits: np.ndarray) -> int:
+    """Number of products in a bitset"""
+    return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def ordinals(bits: np.ndarray, offset: int = 0, limit: Optional[int] = None) -> List[int]:
+    """Product ordinals in a bitset, ascending, optionally one page of them"""
+    found = np.flatnonzero(np.unpackbits(bits, bitorder='little'))
+    end = None if limit is None else offset + limit
+    return found[offset:end].tolist()
+
+
+def _bitset(rows: Iterable[tuple], size: int) -> np.ndarray:
+    positions = np.fromiter((row[0] for row in rows), dtype=np.int64)
+    flags = np.zeros(size, dtype=bool)
+    flags[positions] = True
+    return np.packbits(flags, bitorder='little')
+
+
+class BitmapIndex:
+    """The current Snapshot for this process, refreshed when the products scope moves"""
+
+    def __init__(self):
+        self._snapshot: Optional[Snapshot] = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self, conn) -> Snapshot:
+        # Read before the database, so a change committed meanwhile is seen next time
+        version = invalidation.version('products')
+        snapshot = self._snapshot
+        if snapshot is not None and self._version == version:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._version != version:
+                self.misses += 1
+                self._snapshot = self._refresh(conn, self._snapshot)
+                self._version = version
+            return self._snapshot
+
+    def _refresh(self, conn, previous: Optional[Snapshot]) -> Snapshot:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        # One read transaction, so counters and mapping rows agree
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            cursor.execute('BEGIN')
+        try:
+            products = tuple(cursor.execute(
+                'SELECT COUNT(*), COALESCE(MAX(product_int), 0) FROM product_categories'
+            ).fetchone())
+            size = (products[1] // ORDINAL_BLOCK + 1) * ORDINAL_BLOCK
+            reuse = previous is not None and previous.size == size
+
+            if reuse and previous.products == products:
+                universe = previous.universe
+            else:
+                universe = _bitset(cursor.execute('SELECT product_int FROM product_categories'), size)
+
+            changes = {}
+            bitmaps = {}
+            for name, category_int, changed in cursor.execute('''
+                SELECT ci.name, cc.category_int, cc.changes
+                FROM category_counts cc JOIN category_ids ci ON ci.category_int = cc.category_int
+                WHERE cc.direct_count > 0
+            ''').fetchall():
+                changes[name] = changed
+                if reuse and previous.changes.get(name) == changed:
+                    bitmaps[name] = previous.bitmaps[name]
+                    continue
+                bitmaps[name] = _bitset(cursor.execute(
+                    'SELECT product_int FROM product_category_links WHERE category_int = ?', (category_int,)
+                ), size)
+        finally:
+            if own_transaction:
+                conn.commit()
+        return Snapshot(size, universe, bitmaps, changes, products)
+
+
+index = BitmapIndex()
+
+metrics.register_cache('category_bitmaps', lambda: (index.hits, index.misses))
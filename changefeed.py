@@ -0,0 +1,308 @@
+"""
+Change feed for Tag Manager V2: pushes mapping changes to open editor sessions
+
+Write paths in services.py record a compact event in the change_events table
+inside the same transaction as the change itself:
+
+    {"type": "mapping", "products": [{"product_id": "...", "category_count": 3}],
+     "added": ["..."], "removed": ["..."]}
+    {"type": "taxonomy", "created": "..."} / {"type": "taxonomy", "deleted": "..."}
+
+Each worker process reads new rows once per change (woken by the
+invalidation channel) and fans them out in memory to every connected
+Server-Sent Events client, so the number of viewers no longer multiplies
+queries against SQLite. Clients resume after a reconnect with Last-Event-ID;
+a client that fell too far behind receives a `reset` event and refetches.
+"""
+
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+import database
+import invalidation
+from serialization import dumps
+
+
+# Events kept in the table for clients resuming after a reconnect
+RETENTION = int(os.environ.get('CHANGE_FEED_RETENTION', '10000'))
+
+# Events buffered per client before it is considered lagging
+CLIENT_BUFFER = 1000
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+def record(conn: sqlite3.Connection, event: dict):
+    """Add an event in the caller's transaction; it is published on commit"""
+    cursor = conn.execute(
+        'INSERT INTO change_events (payload) VALUES (?)', (dumps(event).decode('utf-8'),)
+    )
+    if cursor.lastrowid > RETENTION:
+        conn.execute('DELETE FROM change_events WHERE id <= ?', (cursor.lastrowid - RETENTION,))
+
+
+def category_counts(conn: sqlite3.Connection, product_ids_json: str) -> List[dict]:
+    """Current category count of each existing product in a JSON id list"""
+    return [
+        {'product_id': row[0], 'category_count': row[1]}
+        for row in conn.execute('''
+            SELECT pc.product_id, COUNT(l.category_int)
+            FROM product_categories pc
+            LEFT JOIN product_category_links l ON l.product_int = pc.product_int
+            WHERE pc.product_id IN (SELECT value FROM json_each(?))
+            GROUP BY pc.product_id
+        ''', (product_ids_json,))
+    ]
+
+
+def mapping_event(conn: sqlite3.Connection, product_ids: List[str],
+                  added: List[str] = (), removed: List[str] = ()) -> Optional[dict]:
+    """Build a mapping event for products whose categories just changed"""
+    if not product_ids:
+        return None
+    return {
+        'type': 'mapping',
+        'products': category_counts(conn, json.dumps(product_ids)),
+        'added': sorted(added),
+        'removed': sorted(removed),
+    }
+
+
+def link_events(conn: sqlite3.Connection, links: Iterable[Tuple[int, int]], change: str) -> List[dict]:
+    """
+    Mapping events for (product_int, category_int) rows just inserted or
+    deleted, with change 'added' or 'removed'. Products are grouped by the
+    exact categories they gained or lost, so no event reports a change a
+    product did not get.
+    """
+    by_product: Dict[int, Set[int]] = {}
+    for product_int, category_int in links:
+        by_product.setdefault(product_int, set()).add(category_int)
+    if not by_product:
+        return []
+
+    category_ints = sorted(set().union(*by_product.values()))
+    names = dict(conn.execute(
+        'SELECT category_int, name FROM category_ids WHERE category_int IN (SELECT value FROM json_each(?))',
+        (json.dumps(category_ints),)
+    ))
+    product_ids = dict(conn.execute(
+        'SELECT product_int, product_id FROM product_categories WHERE product_int IN (SELECT value FROM json_each(?))',
+        (json.dumps(sorted(by_product)),)
+    ))
+    groups: Dict[FrozenSet[int], List[str]] = {}
+    for product_int, changed in by_product.items():
+        groups.setdefault(frozenset(changed), []).append(product_ids[product_int])
+    return [
+        mapping_event(conn, members, **{change: [names[c] for c in changed]})
+        for changed, members in groups.items()
+    ]
+
+
+def format_sse(event_id: int, payload: str, event: str = None) -> str:
+    """Encode one Server-Sent Events message"""
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'id: {event_id}')
+    lines.append(f'data: {payload}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscriber:
+    """A connected client's buffer of pending (id, payload) events"""
+
+    def __init__(self):
+        # Id of the newest event handed to this client; guarded by the feed lock
+        self.delivered_id = 0
+        self.queue: "queue.Queue" = queue.Queue(maxsize=CLIENT_BUFFER)
+
+    def deliver(self, rows: List[Tuple[int, str]]):
+        rows = [row for row in rows if row[0] > self.delivered_id]
+        if not rows:
+            return
+        self.delivered_id = rows[-1][0]
+        try:
+            for row in rows:
+                self.queue.put_nowait(row)
+        except queue.Full:
+            self.reset()
+
+    def reset(self):
+        """Drop the backlog and tell the client to refetch its state"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait((self.delivered_id, None))
+
+    def get(self, timeout: float) -> Tuple[int, Optional[str]]:
+        return self.queue.get(timeout=timeout)
+
+
+class AsyncSubscriber(Subscriber):
+    """Subscriber whose events are awaited from an asyncio event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def deliver(self, rows: List[Tuple[int, str]]):
+        super().deliver(rows)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    def reset(self):
+        super().reset()
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def get_async(self, timeout: float) -> Tuple[int, Optional[str]]:
+        self.ready.clear()
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.queue.get_nowait()
+
+
+class ChangeFeed:
+    """Per-process fan-out of change_events rows to connected clients"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_path = None
+        self._last_id: Optional[int] = None
+        self._subscribers = set()
+        self._subscribed = False
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_path != database.DATABASE:
+            self._conn = sqlite3.connect(database.DATABASE, check_same_thread=False)
+            self._conn_path = database.DATABASE
+        return self._conn
+
+    def _read_since(self, after_id: int) -> List[Tuple[int, str]]:
+        return self._connection().execute(
+            'SELECT id, payload FROM change_events WHERE id > ? ORDER BY id', (after_id,)
+        ).fetchall()
+
+    def _oldest_id(self) -> int:
+        row = self._connection().execute('SELECT MIN(id) FROM change_events').fetchone()
+        return row[0] or 0
+
+    def _latest_id(self) -> int:
+        row = self._connection().execute('SELECT MAX(id) FROM change_events').fetchone()
+        return row[0] or 0
+
+    def _on_change(self, scope: str):
+        with self._lock:
+            if not self._subscribers:
+                # Nobody is listening; resume from the newest row on next subscribe
+                self._last_id = None
+                return
+            rows = self._read_since(self._last_id)
+            if not rows:
+                return
+            self._last_id = rows[-1][0]
+            for subscriber in self._subscribers:
+                subscriber.deliver(rows)
+
+    def subscribe(self, subscriber: Subscriber, last_event_id: Optional[int] = None) -> Subscriber:
+        """Register a client; replays events after last_event_id when given"""
+        with self._lock:
+            if not self._subscribed:
+                for scope in invalidation.DATA_SCOPES:
+                    invalidation.subscribe(scope, self._on_change)
+                self._subscribed = True
+        # Make sure this process is polling for changes
+        invalidation.version('products')
+
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = self._latest_id()
+            subscriber.delivered_id = self._last_id
+            if last_event_id is not None and last_event_id < self._last_id:
+                if last_event_id < self._oldest_id() - 1:
+                    # Events the client missed were already pruned
+                    subscriber.reset()
+                else:
+                    subscriber.delivered_id = last_event_id
+                    subscriber.deliver(self._read_since(last_event_id))
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_path = None
+        self._last_id = None
+        self._subscribers = set()
+
+
+feed = ChangeFeed()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=feed.reset_after_fork)
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    """Last-Event-ID header or query value as an int, if valid"""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def _format_item(item: Tuple[int, Optional[str]]) -> str:
+    event_id, payload = item
+    if payload is None:
+        return format_sse(event_id, '{}', event='reset')
+    return format_sse(event_id, payload)
+
+
+def iter_sse(last_event_id: Optional[int] = None) -> Iterator[str]:
+    """Blocking SSE stream for WSGI servers; holds one thread per client"""
+    subscriber = feed.subscribe(Subscriber(), last_event_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                yield _format_item(subscriber.get(KEEPALIVE_INTERVAL))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+async def aiter_sse(last_event_id: Optional[int] = None):
+    """SSE stream for ASGI servers"""
+    subscriber = feed.subscribe(AsyncSubscriber(asyncio.get_running_loop()), last_event_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                yield _format_item(await subscriber.get_async(KEEPALIVE_INTERVAL))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+    finally:
+        feed.unsubscribe(subscriber)
@@ -0,0 +1,307 @@
+"""
+Response compression and precompressed payload cache for Tag Manager V2
+
+Dynamic responses are compressed on the way out (gzip, or brotli when the
+`brotli` package is installed) once they reach COMPRESSION_MIN_SIZE bytes.
+Cacheable payloads are stored once per data version together with their ETag
+and each encoding is produced at most once, so repeated requests are served
+without recompressing.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """Whether a content type is worth compressing"""
+    # Event streams must reach the client unbuffered
+    if not content_type or content_type.startswith('text/event-stream'):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported encoding from an Accept-Encoding header"""
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in (accept_encoding or '').split(',')
+        if part.strip() and not part.replace(' ', '').endswith(';q=0')
+    }
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a complete body with the given encoding"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(COMPRESSION_LEVEL, 11))
+    return gzip.compress(body, compresslevel=COMPRESSION_LEVEL)
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes every chunk so streams stay live"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=min(COMPRESSION_LEVEL, 11))
+        else:
+            self._compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def add_vary(headers, value: str = 'Accept-Encoding'):
+    """Append to the Vary header without duplicating entries"""
+    existing = headers.get('Vary')
+    if not existing:
+        headers['Vary'] = value
+    elif value.lower() not in existing.lower():
+        headers['Vary'] = f'{existing}, {value}'
+
+
+class CachedPayload:
+    """A response body with its ETag and lazily built compressed variants"""
+
+    def __init__(self, body: bytes, media_type: str, headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.media_type = media_type
+        self.headers = headers or {}
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self._variants: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Return the body for an encoding, compressing it only the first time"""
+        if encoding is None or len(self.body) < COMPRESSION_MIN_SIZE:
+            return self.body, None
+        variant = self._variants.get(encoding)
+        if variant is None:
+            with self._lock:
+                variant = self._variants.get(encoding)
+                if variant is None:
+                    variant = compress(self.body, encoding)
+                    self._variants[encoding] = variant
+        return variant, encoding
+
+    def negotiate(self, accept_encoding: str, if_none_match: Optional[str]) -> Tuple[int, bytes, Dict[str, str]]:
+        """Resolve a request against this payload into status, body and headers"""
+        headers = dict(self.headers)
+        headers['ETag'] = self.etag
+        headers['Vary'] = 'Accept-Encoding'
+        if if_none_match and self.etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, b'', headers
+        body, encoding = self.encoded(choose_encoding(accept_encoding))
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+
+class PrecompressedCache:
+    """LRU cache of CachedPayload objects keyed by name and data version"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, CachedPayload, Tuple[str, ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Hashable, version: Hashable,
+                     build: Callable[[], Tuple[bytes, str]],
+                     headers: Optional[Dict[str, str]] = None,
+                     scopes: Tuple[str, ...] = ()) -> CachedPayload:
+        """
+        Return the cached payload for `key`, rebuilding it when `version` changed.
+
+        `scopes` names what the payload depends on, so invalidate(scope) can
+        drop it without waiting for the next request to notice the new version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        body, media_type = build()
+        payload = CachedPayload(body, media_type, headers)
+
+        with self._lock:
+            self._entries[key] = (version, payload, tuple(scopes))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def invalidate(self, scope: str):
+        """Drop every payload that depends on scope"""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if scope in entry[2]]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def compress_flask_response(response, accept_encoding: str, minimum_size: int = COMPRESSION_MIN_SIZE):
+    """Compress a Flask/Werkzeug response in place when the client accepts it"""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.direct_passthrough
+            or not is_compressible(response.mimetype)):
+        return response
+
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        chunks = response.response
+        compressor = StreamCompressor(encoding)
+
+        def generate():
+            try:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode(response.charset or 'utf-8')
+                    data = compressor.compress(chunk)
+                    if data:
+                        yield data
+                yield compressor.finish()
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < minimum_size:
+            return response
+        response.set_data(compress(body, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    add_vary(response.headers)
+    return response
+
+
+class CompressionMiddleware:
+    """ASGI middleware applying gzip/brotli compression above a size threshold"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ''
+        for name, value in scope.get('headers', []):
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+                break
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {'start': None, 'compressor': None, 'passthrough': False}
+
+        async def send_compressed(message):
+            if message['type'] == 'http.response.start':
+                state['start'] = message
+                headers = {k.lower(): v for k, v in message.get('headers', [])}
+                content_type = headers.get(b'content-type', b'').decode('latin-1')
+                state['passthrough'] = (
+                    b'content-encoding' in headers
+                    or message['status'] < 200 or message['status'] in (204, 304)
+                    or not is_compressible(content_type)
+                )
+                return
+
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            start = state['start']
+            if state['passthrough']:
+                if start is not None:
+                    state['start'] = None
+                    await send(start)
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if start is not None:
+                state['start'] = None
+                if not more_body and len(body) < self.minimum_size:
+                    state['passthrough'] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers = [
+                    (k, v) for k, v in start.get('headers', [])
+                    if k.lower() not in (b'content-length', b'vary')
+                ]
+                vary = [v for k, v in start.get('headers', []) if k.lower() == b'vary']
+                vary_value = b', '.join(vary + [b'Accept-Encoding']) if vary else b'Accept-Encoding'
+                headers.append((b'content-encoding', encoding.encode('latin-1')))
+                headers.append((b'vary', vary_value))
+
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+                    await send({**start, 'headers': headers})
+                    await send({'type': 'http.response.body', 'body': body})
+                    return
+
+                state['compressor'] = StreamCompressor(encoding)
+                await send({**start, 'headers': headers})
+
+            compressor = state['compressor']
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.finish()
+            await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,86 @@
+"""
+Shared fixtures for the service-level tests
+"""
+
+import json
+
+import pytest
+
+import bitmaps
+import database
+import invalidation
+import rollups
+import taxonomy
+
+TAXONOMY = [
+    {'category_name': 'Adhesives & Sealants', 'category_level': 'Level 1 Category', 'connected_to': None},
+    {'category_name': 'Waterproofing Products', 'category_level': 'Level 1 Category', 'connected_to': None},
+    {'category_name': 'Adhesives', 'category_level': 'Level 2 Category', 'connected_to': 'Adhesives & Sealants'},
+    {'category_name': 'Sealants', 'category_level': 'Level 2 Category', 'connected_to': 'Adhesives & Sealants'},
+    {'category_name': 'Waterproofing Membranes', 'category_level': 'Level 2 Category',
+     'connected_to': 'Waterproofing Products'},
+    {'category_name': 'Acrylic Adhesives', 'category_level': 'Level 3 Category', 'connected_to': 'Adhesives'},
+    {'category_name': 'Epoxy Adhesives', 'category_level': 'Level 3 Category', 'connected_to': 'Adhesives'},
+    {'category_name': 'Liquid Membranes', 'category_level': 'Level 3 Category',
+     'connected_to': 'Waterproofing Membranes'},
+]
+
+PRODUCTS = [(f'product-{n}', f'Product {n}') for n in range(1, 7)]
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """An empty data directory the database and category.json point into"""
+    directory = tmp_path / 'data'
+    directory.mkdir()
+    (directory / 'category.json').write_text(json.dumps(TAXONOMY, indent=2))
+    # The data paths are relative to the working directory; the database
+    # path is made absolute so connections kept across tests notice the move
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'DATABASE', str(directory / 'products.db'))
+    # Check for changes on every read instead of from a poller thread
+    monkeypatch.setattr(invalidation.channel, 'poll_interval', 0)
+    monkeypatch.setattr(taxonomy, '_index', None)
+    monkeypatch.setattr(bitmaps, 'index', bitmaps.BitmapIndex())
+    return directory
+
+
+@pytest.fixture
+def conn(data_dir):
+    """A connection to a fresh database holding PRODUCTS, none categorised"""
+    connection = database.connect()
+    connection.executemany('INSERT INTO product_categories (product_id, product_name) VALUES (?, ?)', PRODUCTS)
+    connection.commit()
+    # As the apps' warm-up does
+    rollups.ensure_current(connection)
+    yield connection
+    connection.close()
+
+
+def assert_counts_match_rebuild(conn):
+    """The trigger-maintained counts equal what a full rebuild computes"""
+    counts = {name: value for name, value in rollups.get_counts(conn).items() if value != (0, 0)}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rollups.rebuild(conn, taxonomy.get_category_index())
+        rebuilt = {name: value for name, value in rollups.get_counts(conn).items() if value != (0, 0)}
+    finally:
+        conn.rollback()
+    assert counts == rebuilt
+
+
+@pytest.fixture
+def flask_client(conn):
+    """A test client for the Flask app, serving the conn fixture's database"""
+    import app
+    with app.app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def fastapi_client(conn):
+    """A test client for the FastAPI app; startup hooks (import, warm-up) do not run"""
+    from fastapi.testclient import TestClient
+
+    import app_fastapi
+    return TestClient(app_fastapi.app)
@@ -42,10 +42,12 @@ def insert_products():
 
         print(f"Inserting {len(product_data)} products and {len(category_data)} category mappings...")
 
-        # Bulk insert products using INSERT OR REPLACE to handle duplicates
+        # Bulk upsert products; updating in place keeps each product's integer id
         cursor.executemany('''
-            INSERT OR REPLACE INTO product_categories (product_id, product_name, last_modified)
+            INSERT INTO product_categories (product_id, product_name, last_modified)
             VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (product_id) DO UPDATE SET
+                product_name = excluded.product_name, last_modified = excluded.last_modified
         ''', product_data)
 
         # Bulk insert category mappings
@@ -2,90 +2,388 @@
 Database management module for Tag Manager V2
 """
 
+import json
 import sqlite3
-from contextlib import contextmanager
-from typing import Generator, Optional
+import threading
+from contextlib import closing, contextmanager
+from typing import Dict, Generator, Iterable, Iterator, Optional, Sequence, Tuple
 import os
-from fastapi import Depends
+
+import metrics
+from sqltrace import TracedConnection
 
 
 DATABASE = 'data/products.db'
+CATEGORY_FILE = 'data/category.json'
+IMPORT_FILE = 'data/input_file.csv'
 
+# Only these CSV columns are read; rows are imported in chunks of this size
+IMPORT_COLUMNS = ['Handle', 'Title']
+IMPORT_CHUNK_ROWS = 5000
 
-def get_db_connection() -> Generator[sqlite3.Connection, None, None]:
-    """Dependency for database connections with proper cleanup"""
-    conn = sqlite3.connect(DATABASE)
+# Seconds a connection waits on a locked database before failing
+BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', '5'))
+
+# Ids per json_each() batch; bounds memory per statement, not correctness
+ID_CHUNK_SIZE = 50000
+
+
+def _open(check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(DATABASE, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread,
+                           factory=TracedConnection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign key constraints
+    return conn
+
+
+def connect(check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open a configured connection to the products database, checking its schema on first use"""
+    if _database_identity() not in _schema_checked:
+        ensure_table_schema()
+    return _open(check_same_thread)
+
+
+def get_db_connection() -> Generator[sqlite3.Connection, None, None]:
+    """Dependency for database connections with proper cleanup"""
+    conn = connect()
     try:
         yield conn
     finally:
         conn.close()
 
 
+# Connections currently held through get_db_connection_context (Flask's "pool")
+_open_connections = 0
+_open_connections_lock = threading.Lock()
+
+
 @contextmanager
 def get_db_connection_context():
     """Context manager for database connections"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    global _open_connections
+    conn = connect()
+    with _open_connections_lock:
+        _open_connections += 1
     try:
         yield conn
     finally:
         conn.close()
+        with _open_connections_lock:
+            _open_connections -= 1
 
 
-def ensure_table_schema():
-    """Ensure the product_categories and product_category_mapping tables have the correct schema."""
-    with get_db_connection_context() as conn:
-        cursor = conn.cursor()
+def _collect_connections():
+    family = metrics.GaugeFamily('db_connections_open', 'Request-scoped database connections currently open')
+    family.add((), _open_connections)
+    return [family]
 
-        # Check if product_categories table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='product_categories'")
-        if cursor.fetchone() is None:
+
+metrics.register_collector(_collect_connections)
+
+
+def id_chunks(ids: Sequence[str], chunk_size: int = ID_CHUNK_SIZE) -> Iterator[list]:
+    """Split ids into de-duplicated chunks of at most chunk_size"""
+    unique_ids = list(dict.fromkeys(ids))
+    for start in range(0, len(unique_ids), chunk_size):
+        yield unique_ids[start:start + chunk_size]
+
+
+def iter_rows_for_ids(conn: sqlite3.Connection, query: str, ids: Sequence[str],
+                      chunk_size: int = ID_CHUNK_SIZE) -> Iterator[sqlite3.Row]:
+    """
+    Run a query for an arbitrarily large id set and yield its rows.
+
+    The query must take the ids as its single parameter through
+    `json_each(?)`, e.g. `WHERE product_id IN (SELECT value FROM json_each(?))`,
+    so it never hits SQLite's bound-variable limit. Ids are de-duplicated and
+    sent in chunks; callers see one continuous row stream.
+    """
+    for chunk in id_chunks(ids, chunk_size):
+        yield from conn.execute(query, (json.dumps(chunk),))
+
+
+def category_file_version(path: str = CATEGORY_FILE) -> Tuple[int, int]:
+    """Return a token that changes whenever the category taxonomy file is rewritten"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Database files whose schema was checked by this process, as (path, device, inode),
+# so a file that is replaced gets checked again
+_schema_checked = set()
+_schema_lock = threading.Lock()
+
+
+def _database_identity() -> Optional[Tuple[str, int, int]]:
+    try:
+        stat = os.stat(DATABASE)
+    except FileNotFoundError:
+        return None
+    return (os.path.abspath(DATABASE), stat.st_dev, stat.st_ino)
+
+
+# A product counts towards an ancestor's subtree while any of its mappings
+# falls under that ancestor, so subtree counts only move on the first
+# mapping added below an ancestor, or the last one removed. changes counts
+# every mapping row added or removed for a category, so in-memory copies of
+# a category's products (see bitmaps.py) know when to reload.
+_COUNT_MAPPING_IN = '''
+        INSERT OR IGNORE INTO category_counts (category_int) VALUES (NEW.category_int);
+        UPDATE category_counts SET direct_count = direct_count + 1, changes = changes + 1
+        WHERE category_int = NEW.category_int;
+        UPDATE category_counts SET subtree_count = subtree_count + 1
+        WHERE category_int IN (
+            SELECT cl.ancestor FROM category_closure cl
+            WHERE cl.descendant = NEW.category_int AND NOT EXISTS (
+                SELECT 1 FROM product_category_links m
+                JOIN category_closure other ON other.descendant = m.category_int AND other.ancestor = cl.ancestor
+                WHERE m.product_int = NEW.product_int AND m.category_int <> NEW.category_int
+            )
+        );'''
+
+# {exclude} keeps a row that still exists out of the "other mapping" check
+_COUNT_MAPPING_OUT = '''
+        UPDATE category_counts SET direct_count = direct_count - 1, changes = changes + 1
+        WHERE category_int = OLD.category_int;
+        UPDATE category_counts SET subtree_count = subtree_count - 1
+        WHERE category_int IN (
+            SELECT cl.ancestor FROM category_closure cl
+            WHERE cl.descendant = OLD.category_int AND NOT EXISTS (
+                SELECT 1 FROM product_category_links m
+                JOIN category_closure other ON other.descendant = m.category_int AND other.ancestor = cl.ancestor
+                WHERE m.product_int = OLD.product_int{exclude}
+            )
+        );'''
+
+# Set-based rewrites that recount afterwards pause the triggers; see rollups.suspended
+_COUNTING = '''
+    WHEN NOT EXISTS (SELECT 1 FROM category_rollup_pause)'''
+
+CATEGORY_COUNT_TRIGGERS = {
+    'category_counts_links_insert': f'''
+    AFTER INSERT ON product_category_links{_COUNTING}
+    BEGIN{_COUNT_MAPPING_IN}
+    END''',
+    'category_counts_links_delete': f'''
+    AFTER DELETE ON product_category_links{_COUNTING}
+    BEGIN{_COUNT_MAPPING_OUT.format(exclude='')}
+    END''',
+    # The old row is counted out while the new one already exists, so the
+    # new row is skipped there and counted in afterwards
+    'category_counts_links_update': f'''
+    AFTER UPDATE OF product_int, category_int ON product_category_links{_COUNTING}
+    BEGIN{_COUNT_MAPPING_OUT.format(exclude="""
+                  AND NOT (m.product_int = NEW.product_int AND m.category_int = NEW.category_int)""")}{_COUNT_MAPPING_IN}
+    END''',
+}
+
+# product_category_mapping is a view over product_category_links that spells
+# ids out as text, for code and scripts that still read and write it by
+# product_id and category name. Writes through it behave like writes to the
+# table it replaced, except that cursor.rowcount stays 0.
+_MAPPING_PRODUCT_EXISTS = '''
+        SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed')
+        WHERE NOT EXISTS (SELECT 1 FROM product_categories WHERE product_id = NEW.product_id);'''
+
+MAPPING_VIEW = '''
+    CREATE VIEW IF NOT EXISTS product_category_mapping AS
+    SELECT pc.product_id, ci.name AS category_id
+    FROM product_category_links l
+    JOIN product_categories pc ON pc.product_int = l.product_int
+    JOIN category_ids ci ON ci.category_int = l.category_int
+'''
+
+MAPPING_VIEW_TRIGGERS = {
+    'product_category_mapping_insert': f'''
+    INSTEAD OF INSERT ON product_category_mapping
+    BEGIN
+        INSERT OR IGNORE INTO category_ids (name) VALUES (NEW.category_id);{_MAPPING_PRODUCT_EXISTS}
+        INSERT INTO product_category_links (product_int, category_int)
+        SELECT pc.product_int, ci.category_int
+        FROM product_categories pc, category_ids ci
+        WHERE pc.product_id = NEW.product_id AND ci.name = NEW.category_id;
+    END''',
+    'product_category_mapping_delete': '''
+    INSTEAD OF DELETE ON product_category_mapping
+    BEGIN
+        DELETE FROM product_category_links
+        WHERE product_int = (SELECT product_int FROM product_categories WHERE product_id = OLD.product_id)
+          AND category_int = (SELECT category_int FROM category_ids WHERE name = OLD.category_id);
+    END''',
+    'product_category_mapping_update': f'''
+    INSTEAD OF UPDATE ON product_category_mapping
+    BEGIN
+        INSERT OR IGNORE INTO category_ids (name) VALUES (NEW.category_id);{_MAPPING_PRODUCT_EXISTS}
+        UPDATE product_category_links SET
+            product_int = (SELECT product_int FROM product_categories WHERE product_id = NEW.product_id),
+            category_int = (SELECT category_int FROM category_ids WHERE name = NEW.category_id)
+        WHERE product_int = (SELECT product_int FROM product_categories WHERE product_id = OLD.product_id)
+          AND category_int = (SELECT category_int FROM category_ids WHERE name = OLD.category_id);
+    END''',
+}
+
+
+def intern_categories(conn: sqlite3.Connection, names: Iterable[str]):
+    """Give category names their integer ids in category_ids; call inside a write transaction"""
+    conn.execute('INSERT OR IGNORE INTO category_ids (name) SELECT value FROM json_each(?)',
+                 (json.dumps(list(names)),))
+
+
+def category_int(conn: sqlite3.Connection, name: Optional[str]) -> Optional[int]:
+    """Integer id of a category name, or None if it was never used"""
+    row = conn.execute('SELECT category_int FROM category_ids WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _create_triggers(cursor: sqlite3.Cursor, triggers: Dict[str, str]):
+    """Create triggers, replacing any whose definition has changed"""
+    existing = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    for name, body in triggers.items():
+        sql = f'CREATE TRIGGER {name}{body}'
+        if existing.get(name) != sql:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(sql)
+
+
+PRODUCTS_TABLE = '''
+    CREATE TABLE {name} (
+        product_int INTEGER PRIMARY KEY,
+        product_id TEXT NOT NULL UNIQUE,
+        product_name TEXT NOT NULL,
+        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+CATEGORY_IDS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS category_ids (
+        category_int INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+'''
+
+# Clustered by product; idx_product_category_links_category covers the
+# other direction
+MAPPING_TABLE = '''
+    CREATE TABLE IF NOT EXISTS product_category_links (
+        product_int INTEGER NOT NULL REFERENCES product_categories(product_int),
+        category_int INTEGER NOT NULL REFERENCES category_ids(category_int),
+        PRIMARY KEY (product_int, category_int)
+    ) WITHOUT ROWID
+'''
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> list:
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+
+
+def _migrate_to_integer_ids(conn: sqlite3.Connection):
+    """
+    Move a database with text-keyed mapping rows onto integer ids.
+
+    product_categories gains product_int, taken from its old rowid so
+    product order is unchanged, and the product_category_mapping table is
+    copied into product_category_links. The category closure and counts are
+    derived data, so they are dropped and rebuilt under integer keys at
+    warm-up (see rollups.py). Everything happens in one transaction; an
+    up to date database is left alone.
+    """
+    cursor = conn.cursor()
+    products = _columns(cursor, 'product_categories')
+    mapping_table = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_category_mapping'"
+    ).fetchone() is not None
+    text_counts = 'category_id' in _columns(cursor, 'category_counts')
+    rebuild_products = bool(products) and 'product_int' not in products
+    if not (rebuild_products or mapping_table or text_counts):
+        return
+
+    # Dropping and renaming tables must not trip the old foreign keys midway
+    cursor.execute('PRAGMA foreign_keys = OFF')
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if not mapping_table:
+            cursor.execute('DROP VIEW IF EXISTS product_category_mapping')
+
+        if rebuild_products:
+            last_modified = 'last_modified' if 'last_modified' in products else 'CURRENT_TIMESTAMP'
+            cursor.execute(PRODUCTS_TABLE.format(name='product_categories_new'))
+            cursor.execute(f'''
+                INSERT INTO product_categories_new (product_int, product_id, product_name, last_modified)
+                SELECT rowid, product_id, product_name, {last_modified} FROM product_categories
+            ''')
+            cursor.execute('DROP TABLE product_categories')
+            cursor.execute('ALTER TABLE product_categories_new RENAME TO product_categories')
+
+        if mapping_table:
+            cursor.execute(CATEGORY_IDS_TABLE)
             cursor.execute('''
-                CREATE TABLE product_categories (
-                    product_id TEXT PRIMARY KEY,
-                    product_name TEXT NOT NULL,
-                    last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                INSERT OR IGNORE INTO category_ids (name)
+                SELECT DISTINCT category_id FROM product_category_mapping
+                WHERE category_id IS NOT NULL ORDER BY category_id
             ''')
-        else:
-            # Add last_modified column if it doesn't exist
-            cursor.execute("PRAGMA table_info(product_categories)")
-            columns = [column[1] for column in cursor.fetchall()]
-            if 'last_modified' not in columns:
-                # Create a new table with the desired schema
-                cursor.execute('''
-                    CREATE TABLE product_categories_new (
-                        product_id TEXT PRIMARY KEY,
-                        product_name TEXT NOT NULL,
-                        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # Copy data from old table to new table
-                cursor.execute('''
-                    INSERT INTO product_categories_new (product_id, product_name, last_modified)
-                    SELECT product_id, product_name, CURRENT_TIMESTAMP
-                    FROM product_categories
-                ''')
-
-                # Drop old table and rename new table
-                cursor.execute('DROP TABLE product_categories')
-                cursor.execute('ALTER TABLE product_categories_new RENAME TO product_categories')
-
-        # Check if product_category_mapping table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='product_category_mapping'")
-        if cursor.fetchone() is None:
+            cursor.execute(MAPPING_TABLE)
             cursor.execute('''
-                CREATE TABLE product_category_mapping (
-                    product_id TEXT,
-                    category_id TEXT,
-                    PRIMARY KEY (product_id, category_id),
-                    FOREIGN KEY (product_id) REFERENCES product_categories(product_id)
-                )
+                INSERT OR IGNORE INTO product_category_links (product_int, category_int)
+                SELECT pc.product_int, ci.category_int
+                FROM product_category_mapping pcm
+                JOIN product_categories pc ON pc.product_id = pcm.product_id
+                JOIN category_ids ci ON ci.name = pcm.category_id
+                ORDER BY 1, 2
             ''')
+            cursor.execute('DROP TABLE product_category_mapping')
+
+        if text_counts:
+            for table in ('category_counts', 'category_closure', 'category_rollup_state'):
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute('PRAGMA foreign_keys = ON')
+
+
+def ensure_table_schema(force: bool = False):
+    """
+    Ensure the product_categories and product_category_mapping tables have the correct schema.
+
+    The check runs once per database file and process; connect() calls it
+    on first use, so nothing touches the database at import time.
+    """
+    with _schema_lock:
+        if not force and _database_identity() in _schema_checked:
+            return
+        _create_schema()
+        _schema_checked.add(_database_identity())
+
+
+def _create_schema():
+    with closing(_open()) as conn:
+        cursor = conn.cursor()
+
+        # WAL lets readers proceed while a writer holds the database
+        # (fetched, so the statement is finished before any table is dropped)
+        cursor.execute("PRAGMA journal_mode = WAL").fetchall()
+
+        # Mapping rows used to name products and categories by their text
+        # ids; they are now integer pairs, see _migrate_to_integer_ids
+        _migrate_to_integer_ids(conn)
+
+        # product_int aliases the rowid, so it stays put through VACUUM
+        cursor.execute(PRODUCTS_TABLE.format(name='IF NOT EXISTS product_categories'))
+
+        # One row per category name ever mapped or in the taxonomy; a name
+        # keeps its integer id for good
+        cursor.execute(CATEGORY_IDS_TABLE)
+        cursor.execute(MAPPING_TABLE)
+        # Products in a category without scanning every product; warm-up runs this lookup on each lane thread
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_category_links_category '
+                       'ON product_category_links(category_int, product_int)')
+        cursor.execute(MAPPING_VIEW)
+        _create_triggers(cursor, MAPPING_VIEW_TRIGGERS)
 
         # Check if categories table exists
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='categories'")
@@ -102,33 +400,153 @@ def ensure_table_schema():
                 )
             ''')
 
+        # One version row per cache scope, bumped by the writers that change
+        # it; see invalidation.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                scope TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO cache_versions (scope, version) VALUES ('products', 0), ('taxonomy', 0), ('jobs', 0)")
+
+        # Recent mapping/taxonomy changes pushed to editors; see changefeed.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                payload TEXT NOT NULL
+            )
+        ''')
+
+        # Bulk operations queued for background execution; see jobs.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                rows INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'queued',
+                result TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bulk_jobs_status ON bulk_jobs(status, created_at)')
+
+        # Which version of the import file was last loaded; see init_products
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS product_imports (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Name indexes let listings stream rows in order without a full sort
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_categories_name ON product_categories(product_name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_categories_name_lower ON product_categories(LOWER(product_name))')
+
+        # Per-category product counts kept current by triggers; see rollups.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS category_closure (
+                ancestor INTEGER NOT NULL,
+                descendant INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor, descendant)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_category_closure_descendant '
+                       'ON category_closure(descendant, ancestor)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS category_counts (
+                category_int INTEGER PRIMARY KEY,
+                direct_count INTEGER NOT NULL DEFAULT 0,
+                subtree_count INTEGER NOT NULL DEFAULT 0,
+                changes INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS category_rollup_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                fingerprint TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS category_rollup_pause (
+                id INTEGER PRIMARY KEY CHECK (id = 1)
+            )
+        ''')
+        _create_triggers(cursor, CATEGORY_COUNT_TRIGGERS)
+
         conn.commit()
 
 
-def init_products():
-    """Initialize the database with products from CSV file"""
-    if not os.path.exists('data/input_file.csv'):
-        return
+def import_file_signature(path: str = IMPORT_FILE) -> Optional[str]:
+    """A token that changes whenever the import file is rewritten, or None without one"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f'{stat.st_mtime_ns}:{stat.st_size}'
 
-    ensure_table_schema()  # Ensure schema is correct
 
-    import pandas as pd
+def imported_signature(conn: sqlite3.Connection, path: str = IMPORT_FILE) -> Optional[str]:
+    """Signature of the import file as of its last completed import"""
+    row = conn.execute('SELECT signature FROM product_imports WHERE path = ?', (path,)).fetchone()
+    return row[0] if row else None
 
-    df = pd.read_csv('data/input_file.csv')
-    products = df[['Handle', 'Title']].values.tolist()
 
+def import_pending(path: str = IMPORT_FILE) -> bool:
+    """Whether the import file exists and has changed since it was last imported"""
+    signature = import_file_signature(path)
+    if signature is None:
+        return False
     with get_db_connection_context() as conn:
-        cursor = conn.cursor()
+        return imported_signature(conn, path) != signature
 
-        # Insert products if they don't exist
-        for handle, title in products:
-            cursor.execute(
-                "INSERT OR IGNORE INTO product_categories (product_id, product_name) VALUES (?, ?)",
-                (handle, title)
-            )
 
-        conn.commit()
+def init_products(force: bool = False) -> Optional[int]:
+    """
+    Load products from the CSV import file.
+
+    Skipped when this version of the file was already imported, unless
+    force is set. Only the Handle and Title columns are read, in chunks of
+    IMPORT_CHUNK_ROWS, each committed separately, so memory stays flat and
+    the write lock is never held for long. Existing products are kept.
+    Returns the number of rows read, or None when nothing was imported.
+    """
+    signature = import_file_signature()
+    if signature is None or not (force or import_pending()):
+        return None
+
+    # Heavy, and only needed here
+    import pandas as pd
+    import invalidation
+    import services
+
+    rows = 0
+    with metrics.IMPORT_DURATION.time(), get_db_connection_context() as conn:
+        chunks = pd.read_csv(IMPORT_FILE, usecols=IMPORT_COLUMNS, dtype=str, chunksize=IMPORT_CHUNK_ROWS)
+        for chunk in chunks:
+            products = list(chunk[IMPORT_COLUMNS].itertuples(index=False, name=None))
+            def write():
+                conn.executemany(
+                    "INSERT OR IGNORE INTO product_categories (product_id, product_name) VALUES (?, ?)",
+                    products
+                )
+                invalidation.bump(conn, 'products')
+
+            services.write_transaction(conn, write, 'import_products')
+            invalidation.notify()
+            rows += len(products)
 
+        services.write_transaction(conn, lambda: conn.execute('''
+            INSERT OR REPLACE INTO product_imports (path, signature, rows, imported_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (IMPORT_FILE, signature, rows)), 'import_products')
+    return rows
 
-# Initialize database on module import
-ensure_table_schema()
\ No newline at end of file
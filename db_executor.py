@@ -0,0 +1,192 @@
+"""
+Async database access layer for Tag Manager V2
+
+sqlite3 is blocking, so FastAPI handlers hand their database work to
+dedicated threads instead of Starlette's shared threadpool. Work is split
+into lanes by priority class, each with its own threads and a bounded queue:
+
+- read:  short interactive queries, several threads (WAL lets them run
+         alongside a writer)
+- write: interactive edits such as single-product assignments
+- bulk:  bulk assignments, exports and other long-running work
+
+A slow bulk job can only ever occupy the bulk lane, so cheap reads never
+queue behind it.
+"""
+
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import database
+import metrics
+import profiling
+
+
+class LaneBusyError(Exception):
+    """Raised when a lane's queue is full and new work is rejected"""
+    def __init__(self, lane: str, queue_limit: int):
+        self.lane = lane
+        self.queue_limit = queue_limit
+        super().__init__(f"Database {lane} queue is full ({queue_limit} pending)")
+
+
+class Lane:
+    """A fixed set of threads, each holding its own SQLite connection"""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._start()
+
+    def _start(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"db-{self.name}")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "path", None) != database.DATABASE:
+            if conn is not None:
+                conn.close()
+            conn = database.connect()
+            self._local.conn = conn
+            self._local.path = database.DATABASE
+        return conn
+
+    def _run(self, fn: Callable, args: tuple) -> Any:
+        with self._lock:
+            self.pending -= 1
+            self.active += 1
+        conn = self._connection()
+        try:
+            return fn(conn, *args)
+        finally:
+            # Never hand an open transaction to the next job on this thread
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def submit(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on this lane and await its result"""
+        with self._lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                raise LaneBusyError(self.name, self.max_queue)
+            self.pending += 1
+        if profiling.ENABLED:
+            fn = profiling.wrap(fn)
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, self._run, fn, args)
+        future.add_done_callback(self._release_if_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _release_if_cancelled(self, future):
+        # A job cancelled before it started never reaches _run
+        if future.cancelled():
+            with self._lock:
+                self.pending -= 1
+
+    async def warm(self, prepare: Callable):
+        """Open a connection on every thread of this lane and run prepare(conn) on it"""
+        # Each job holds its thread until all have started, so every thread gets one
+        barrier = threading.Barrier(self.workers)
+
+        def prime(conn: sqlite3.Connection):
+            prepare(conn)
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+
+        await asyncio.gather(*(self.submit(prime) for _ in range(self.workers)))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self.pending,
+                "active": self.active,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def reset_after_fork(self):
+        """Replace threads and connections inherited from a parent process"""
+        # The parent's threads do not exist in the child, and its
+        # connections must not be used from two processes
+        self._start()
+
+
+class DatabaseExecutor:
+    """The set of priority lanes used by the FastAPI app"""
+
+    def __init__(self, read_workers: int = 4, write_workers: int = 1, bulk_workers: int = 1,
+                 max_queue: int = 256):
+        self.lanes = {
+            "read": Lane("read", read_workers, max_queue),
+            "write": Lane("write", write_workers, max_queue),
+            "bulk": Lane("bulk", bulk_workers, max_queue),
+        }
+
+    async def read(self, fn: Callable, *args) -> Any:
+        return await self.lanes["read"].submit(fn, *args)
+
+    async def write(self, fn: Callable, *args) -> Any:
+        return await self.lanes["write"].submit(fn, *args)
+
+    async def bulk(self, fn: Callable, *args) -> Any:
+        return await self.lanes["bulk"].submit(fn, *args)
+
+    async def warm(self, prepare: Callable):
+        """Open and prime a connection on every thread of every lane"""
+        await asyncio.gather(*(lane.warm(prepare) for lane in self.lanes.values()))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.shutdown()
+
+    def reset_after_fork(self):
+        for lane in self.lanes.values():
+            lane.reset_after_fork()
+
+
+executor = DatabaseExecutor(
+    read_workers=int(os.environ.get("DB_READ_WORKERS", "4")),
+    write_workers=int(os.environ.get("DB_WRITE_WORKERS", "1")),
+    bulk_workers=int(os.environ.get("DB_BULK_WORKERS", "1")),
+    max_queue=int(os.environ.get("DB_MAX_QUEUE", "256")),
+)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=executor.reset_after_fork)
+
+
+def _collect_lanes():
+    stats = executor.stats()
+    for lane in stats.values():
+        lane["utilization"] = lane["active"] / lane["workers"]
+    return metrics.families_from_stats(
+        "db_lane", "Database lane", "lane", stats, counters=("completed", "rejected")
+    )
+
+
+metrics.register_collector(_collect_lanes)
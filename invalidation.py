@@ -0,0 +1,187 @@
+"""
+Cross-worker cache invalidation for Tag Manager V2
+
+Every worker process keeps its own in-memory caches (taxonomy index,
+precompressed responses, statistics). This module tells all of them when
+those caches go stale, using only the SQLite database they already share:
+
+- products: products or their category mappings changed.
+- taxonomy: category.json or the categories table changed; the file's
+            mtime is also watched so edits made outside the apps are
+            picked up.
+- jobs:     a bulk job was queued; wakes the job runners (see jobs.py) and
+            invalidates no cache.
+
+Writers bump the scope's row in cache_versions inside their own transaction
+with bump(), then call notify() after committing so their own process sees
+the change immediately. Commits that bump nothing (job status updates,
+change events, import records) wake no one.
+
+A background thread per process polls every INVALIDATION_POLL_INTERVAL
+seconds (default 0.005) and bumps in-memory generation counters. An idle
+poll is one PRAGMA data_version and one stat of category.json, under ten
+microseconds; the cache_versions table is read only after data_version shows
+another connection committed. Request paths read the counters without
+touching the database, and caches subscribe to drop entries as soon as a
+scope changes. A commit in one worker therefore reaches the others within
+one poll interval plus the time their subscribers take, about 5 ms by
+default.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database
+
+
+POLL_INTERVAL = float(os.environ.get('INVALIDATION_POLL_INTERVAL', '0.005'))
+
+# Scopes that change what the API returns; caches and the change feed follow these
+DATA_SCOPES = ('products', 'taxonomy')
+
+SCOPES = DATA_SCOPES + ('jobs',)
+
+
+class InvalidationChannel:
+    """Per-process view of the shared cache versions"""
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._generations: Dict[str, int] = {scope: 0 for scope in SCOPES}
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {scope: [] for scope in SCOPES}
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._rows: Dict[str, int] = {}
+        self._file_version = None
+        self._reset_connection_state()
+
+    def _reset_connection_state(self):
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_path = None
+        self._check_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def subscribe(self, scope: str, callback: Callable[[str], None]):
+        """Call callback(scope) whenever scope changes"""
+        with self._lock:
+            self._subscribers[scope].append(callback)
+
+    def version(self, *scopes: str) -> Tuple[int, ...]:
+        """Current generation of each scope; in-memory, no I/O"""
+        if self.poll_interval <= 0:
+            # Polling disabled: check synchronously instead
+            self.check()
+        else:
+            self._ensure_polling()
+        return tuple(self._generations[scope] for scope in scopes)
+
+    def check(self):
+        """Look for changes made since the last check and notify subscribers"""
+        with self._check_lock:
+            changed = set()
+            if self._conn is None or self._conn_path != database.DATABASE:
+                if self._conn_path is not None and self._conn_path != database.DATABASE:
+                    # Another database: its versions are not comparable with ours
+                    changed.update(SCOPES)
+                    self._rows = {}
+                self._connect()
+
+            # Only commits from other connections move data_version, and most
+            # of those (job bookkeeping, change events) bump no version row
+            data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                rows = self._read_rows()
+                for scope, value in rows.items():
+                    if self._rows.get(scope, value) != value:
+                        changed.add(scope)
+                self._rows.update(rows)
+
+            file_version = database.category_file_version()
+            if self._file_version is not None and file_version != self._file_version:
+                changed.add('taxonomy')
+            self._file_version = file_version
+
+            if changed:
+                with self._lock:
+                    for scope in changed:
+                        self._generations[scope] += 1
+                    callbacks = [(scope, cb) for scope in changed for cb in self._subscribers[scope]]
+            else:
+                callbacks = []
+
+        for scope, callback in callbacks:
+            callback(scope)
+
+    def _connect(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = sqlite3.connect(database.DATABASE, check_same_thread=False)
+        self._conn_path = database.DATABASE
+        self._data_version = None
+
+    def _read_rows(self) -> Dict[str, int]:
+        try:
+            return dict(self._conn.execute('SELECT scope, version FROM cache_versions'))
+        except sqlite3.OperationalError:
+            # Database created before cache_versions existed
+            return {}
+
+    def _ensure_polling(self):
+        if self._thread is not None or self.poll_interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._poll, name='cache-invalidation', daemon=True)
+        self.check()
+        self._thread.start()
+
+    def _poll(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.check()
+            except sqlite3.Error:
+                # Database briefly unavailable; try again next tick
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+
+    def reset_after_fork(self):
+        # Keep the generations (inherited caches are tagged with them) but
+        # open a new connection and poller in the child
+        self._lock = threading.Lock()
+        self._reset_connection_state()
+
+
+channel = InvalidationChannel()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=channel.reset_after_fork)
+
+
+def version(*scopes: str) -> Tuple[int, ...]:
+    """Current generation of the given scopes"""
+    return channel.version(*scopes)
+
+
+def subscribe(scope: str, callback: Callable[[str], None]):
+    """Register a cache to be told when scope changes"""
+    channel.subscribe(scope, callback)
+
+
+def bump(conn: sqlite3.Connection, *scopes: str):
+    """Mark scopes changed inside the caller's open transaction; call notify() after committing"""
+    conn.executemany(
+        'UPDATE cache_versions SET version = version + 1 WHERE scope = ?',
+        [(scope,) for scope in scopes]
+    )
+
+
+def notify():
+    """Pick up changes this process has just committed without waiting for the poller"""
+    channel.check()
@@ -0,0 +1,275 @@
+"""
+Queued bulk jobs for Tag Manager V2
+
+Bulk requests sent with `Prefer: respond-async` are stored in the bulk_jobs
+table and answered with 202 and a status URL (/api/jobs/<id>) instead of
+holding the connection open. Because the queue lives in the shared
+database, any worker process can report a job's status, and each process
+runs a background thread that claims queued jobs one at a time. Jobs run
+under the same admission limits and row budget as synchronous bulk
+requests (see admission.py).
+
+The queue holds at most BULK_JOB_QUEUE_LIMIT unfinished jobs; beyond that
+submissions are rejected with 429 like any other over-limit request. A job
+still running after BULK_JOB_LEASE seconds is taken to have died with its
+worker and is queued again, so it is not lost and does not hold a queue
+slot for good.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+import admission
+import database
+import invalidation
+import metrics
+import services
+from services import NotFoundError, ServiceError
+
+logger = logging.getLogger('tag_manager.jobs')
+
+QUEUE_LIMIT = int(os.environ.get('BULK_JOB_QUEUE_LIMIT', '16'))
+
+# Finished jobs kept for status queries
+RETENTION = 1000
+
+# Seconds between checks for jobs when no change notification arrives
+POLL_INTERVAL = 5.0
+
+# Seconds a job may stay running before it is taken to have died with its
+# worker and is queued again. The bulk handlers are idempotent, so a job
+# that was in fact still running is repeated, not applied twice.
+JOB_LEASE = float(os.environ.get('BULK_JOB_LEASE', '900'))
+
+JOB_DURATION = metrics.histogram('bulk_job_duration_seconds', 'Run time of queued bulk jobs by kind and outcome',
+                                 ('kind', 'status'), metrics.DURATION_BUCKETS)
+
+
+def _bulk_assign(conn: sqlite3.Connection, payload: dict, ticket: admission.Ticket) -> dict:
+    return services.bulk_assign_categories(
+        conn, payload['product_ids'], payload['category_ids'],
+        require_known=payload.get('require_known', False), pacer=ticket
+    )
+
+
+def _bulk_remove(conn: sqlite3.Connection, payload: dict, ticket: admission.Ticket) -> dict:
+    return services.bulk_remove_categories(conn, payload['product_ids'], payload['category_ids'], pacer=ticket)
+
+
+HANDLERS: Dict[str, Callable[[sqlite3.Connection, dict, admission.Ticket], dict]] = {
+    'bulk-assign': _bulk_assign,
+    'bulk-remove': _bulk_remove,
+}
+
+
+def job_rows(payload: dict) -> int:
+    """Rough number of mapping rows a bulk payload touches"""
+    return len(payload['product_ids']) * len(payload['category_ids'])
+
+
+def submit(conn: sqlite3.Connection, kind: str, payload: dict) -> dict:
+    """Queue a bulk operation, or raise AdmissionRejected when the queue is full"""
+    if not payload['product_ids']:
+        raise ServiceError('No products provided')
+    if not payload['category_ids']:
+        raise ServiceError('No categories provided')
+    job_id = uuid.uuid4().hex
+
+    def write():
+        unfinished = conn.execute(
+            "SELECT COUNT(*) FROM bulk_jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+        if unfinished >= QUEUE_LIMIT:
+            raise admission.AdmissionRejected(
+                'Bulk job queue is full', admission.bulk.retry_after(), {'queue_limit': QUEUE_LIMIT}
+            )
+        conn.execute(
+            'INSERT INTO bulk_jobs (id, kind, payload, rows) VALUES (?, ?, ?, ?)',
+            (job_id, kind, json.dumps(payload), job_rows(payload))
+        )
+        conn.execute('''
+            DELETE FROM bulk_jobs
+            WHERE status IN ('done', 'failed')
+              AND id NOT IN (SELECT id FROM bulk_jobs WHERE status IN ('done', 'failed')
+                             ORDER BY finished_at DESC LIMIT ?)
+        ''', (RETENTION,))
+        # Wakes the runners in the other workers
+        invalidation.bump(conn, 'jobs')
+
+    services.write_transaction(conn, write, 'submit_job')
+    invalidation.notify()
+    runner.wake()
+    return get_job(conn, job_id)
+
+
+def get_job(conn: sqlite3.Connection, job_id: str) -> dict:
+    """Status of a queued job"""
+    row = conn.execute('''
+        SELECT id, kind, rows, status, result, error, created_at, started_at, finished_at
+        FROM bulk_jobs WHERE id = ?
+    ''', (job_id,)).fetchone()
+    if row is None:
+        raise NotFoundError(f'Job {job_id} not found', {'job_id': job_id})
+    return {
+        'job_id': row[0],
+        'kind': row[1],
+        'rows': row[2],
+        'status': row[3],
+        'result': json.loads(row[4]) if row[4] else None,
+        'error': row[5],
+        'created_at': row[6],
+        'started_at': row[7],
+        'finished_at': row[8],
+    }
+
+
+def queue_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Number of jobs in each state across all workers"""
+    stats = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+    stats.update(dict(conn.execute('SELECT status, COUNT(*) FROM bulk_jobs GROUP BY status')))
+    stats['queue_limit'] = QUEUE_LIMIT
+    return stats
+
+
+class JobRunner:
+    """Background thread that claims and runs queued jobs in this process"""
+
+    def __init__(self):
+        self._reset()
+        # Jobs submitted or requeued by other workers bump the jobs scope
+        invalidation.subscribe('jobs', lambda scope: self._wake.set())
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='bulk-jobs', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        conn = None
+        # Look for lost jobs on start, then whenever the queue has been idle
+        recover = True
+        while True:
+            try:
+                if conn is None:
+                    conn = database.connect()
+                if recover:
+                    self._requeue_stale(conn)
+                while self._run_next(conn):
+                    pass
+            except (sqlite3.Error, services.DatabaseBusyError):
+                logger.exception('Bulk job runner failed; retrying')
+                if conn is not None:
+                    conn.close()
+                conn = None
+            recover = not self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _requeue_stale(self, conn: sqlite3.Connection) -> int:
+        """Queue again jobs left running longer than JOB_LEASE, e.g. by a worker that crashed"""
+        stale = "status = 'running' AND started_at < datetime('now', ?)"
+        cutoff = (f'-{JOB_LEASE} seconds',)
+        if conn.execute(f'SELECT 1 FROM bulk_jobs WHERE {stale} LIMIT 1', cutoff).fetchone() is None:
+            return 0
+
+        def requeue():
+            requeued = conn.execute(
+                f"UPDATE bulk_jobs SET status = 'queued', started_at = NULL WHERE {stale}", cutoff
+            ).rowcount
+            if requeued:
+                invalidation.bump(conn, 'jobs')
+            return requeued
+
+        requeued = services.write_transaction(conn, requeue, 'requeue_jobs')
+        if requeued:
+            logger.warning('Requeued %d bulk jobs left running for over %.0fs', requeued, JOB_LEASE)
+        return requeued
+
+    def _claim(self, conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+        # A new job wakes the runner in every worker, so look before taking the write lock
+        if conn.execute("SELECT 1 FROM bulk_jobs WHERE status = 'queued' LIMIT 1").fetchone() is None:
+            return None
+
+        # The write lock makes the claim atomic across worker processes
+        def claim():
+            return conn.execute('''
+                UPDATE bulk_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = (SELECT id FROM bulk_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1)
+                RETURNING id, kind, payload, rows
+            ''').fetchone()
+
+        return services.write_transaction(conn, claim, 'claim_job')
+
+    def _finish(self, conn: sqlite3.Connection, job_id: str, status: str,
+                result: Optional[dict] = None, error: Optional[str] = None):
+        def finish():
+            conn.execute('''
+                UPDATE bulk_jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, json.dumps(result) if result is not None else None, error, job_id))
+
+        services.write_transaction(conn, finish, 'finish_job')
+
+    def _run_next(self, conn: sqlite3.Connection) -> bool:
+        job = self._claim(conn)
+        if job is None:
+            return False
+        job_id, kind, payload, rows = job
+        services.write_endpoint.set(f'job {kind}')
+        started = time.perf_counter()
+        try:
+            with admission.bulk.slot(rows) as ticket, metrics.background_request(f'job {kind}', job_id):
+                result = HANDLERS[kind](conn, json.loads(payload), ticket)
+        except Exception as e:
+            logger.warning('Bulk job %s failed: %s', job_id, e)
+            self._finish(conn, job_id, 'failed', error=getattr(e, 'message', str(e)))
+            JOB_DURATION.observe(time.perf_counter() - started, (kind, 'failed'))
+        else:
+            self._finish(conn, job_id, 'done', result=result)
+            JOB_DURATION.observe(time.perf_counter() - started, (kind, 'done'))
+        return True
+
+    def reset_after_fork(self):
+        self._reset()
+
+
+runner = JobRunner()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=runner.reset_after_fork)
+
+
+def start():
+    """Start this process's job runner so jobs left queued are picked up"""
+    runner.start()
+
+
+def _collect_queue():
+    conn = database.connect()
+    try:
+        stats = queue_stats(conn)
+    finally:
+        conn.close()
+    family = metrics.GaugeFamily('bulk_jobs', 'Queued bulk jobs by status, across all workers', ('status',))
+    for status in ('queued', 'running', 'done', 'failed'):
+        family.add((status,), stats[status])
+    return [family]
+
+
+metrics.register_collector(_collect_queue)
@@ -0,0 +1,421 @@
+"""
+Prometheus-style metrics for Tag Manager V2
+
+Both apps serve GET /metrics in the Prometheus text exposition format:
+
+- per route: request counts by status, latency histogram, database time
+  histogram, SQL statements and rows returned (the route is the matched
+  rule or path template, never the raw URL)
+- response cache hits and misses per cache, with a hit ratio gauge
+- bulk write throughput, admission and job queue state, write lock waits
+- CSV import and export durations
+- database pool utilization (FastAPI lanes, Flask open connections)
+
+Request accounting is one small object per request, found by database code
+through a ContextVar; statement timing and row counting live in sqltrace.py.
+Gauges for state that other modules already track are read only when
+/metrics is scraped, through registered collectors.
+
+Each request also carries a request id, taken from a well-formed incoming
+X-Request-ID header or generated. It is echoed in the X-Request-ID response
+header, included in error and success bodies, and added to every log record
+as `request_id`, together with a Server-Timing header giving the time spent
+in the database, in JSON serialization and in total.
+"""
+
+import bisect
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'tagmanager_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric family with a fixed set of label names"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            for labels, value in items
+        ]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, labels: Labels = ()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        lines = self.header()
+        names = self.labelnames + ('le',)
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-1])}')
+        return lines
+
+
+class GaugeFamily(Metric):
+    """Gauge or counter samples produced at scrape time by a collector"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), kind: str = 'gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.samples: List[Tuple[Labels, float]] = []
+
+    def add(self, labels: Labels, value: float):
+        self.samples.append((labels, value))
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            for labels, value in self.samples
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[GaugeFamily]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[GaugeFamily]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # Collectors may report the same family (e.g. two caches); merge them
+        families: Dict[str, GaugeFamily] = {}
+        for collector in self._collectors:
+            for family in collector():
+                if family.name in families:
+                    families[family.name].samples.extend(family.samples)
+                else:
+                    families[family.name] = family
+        for family in families.values():
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_collector(collector: Callable[[], Iterable[GaugeFamily]]):
+    """Add a function returning GaugeFamily objects, called on every scrape"""
+    registry.register_collector(collector)
+
+
+def render() -> str:
+    return registry.render()
+
+
+# Per-request accounting
+
+REQUESTS = counter('http_requests_total', 'HTTP requests by route, method and status',
+                   ('route', 'method', 'status'))
+REQUEST_DURATION = histogram('http_request_duration_seconds', 'Time to serve a request, including streamed bodies',
+                             ('route', 'method'))
+DB_TIME = histogram('db_time_seconds', 'Time spent in SQLite statements per request',
+                    ('route', 'method'))
+DB_STATEMENTS = counter('db_statements_total', 'SQL statements executed', ('route', 'method'))
+DB_ROWS = counter('db_rows_total', 'Rows returned by SQL statements', ('route', 'method'))
+
+IMPORT_DURATION = histogram('import_duration_seconds', 'Duration of CSV product imports', (),
+                            DURATION_BUCKETS)
+EXPORT_DURATION = histogram('export_duration_seconds', 'Duration of CSV export builds', (),
+                            DURATION_BUCKETS)
+
+
+class RequestMetrics:
+    """Counters for one request, filled in by database code as it runs"""
+
+    __slots__ = ('request_id', 'started', 'db_seconds', 'serialize_seconds', 'statements',
+                 'rows', 'traces')
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        # Per-statement records kept by sqltrace for the slow-query log
+        self.traces: list = []
+
+
+current_request: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+_end_hooks: List[Callable[[RequestMetrics, str], None]] = []
+
+
+def accept_request_id(header_value: Optional[str]) -> Optional[str]:
+    """A client-supplied request id if it is safe to log and echo, else None"""
+    if header_value and _REQUEST_ID_PATTERN.fullmatch(header_value):
+        return header_value
+    return None
+
+
+def current_request_id() -> Optional[str]:
+    request_metrics = current_request.get()
+    return request_metrics.request_id if request_metrics is not None else None
+
+
+def on_request_end(hook: Callable[[RequestMetrics, str], None]):
+    """Add a function called with (request_metrics, route) when a request or job ends"""
+    _end_hooks.append(hook)
+
+
+def _run_end_hooks(request_metrics: RequestMetrics, route: str):
+    for hook in _end_hooks:
+        hook(request_metrics, route)
+
+
+def begin_request(request_id: Optional[str] = None) -> RequestMetrics:
+    """Start accounting for a request in the current context"""
+    global _in_flight
+    request_metrics = RequestMetrics(request_id)
+    current_request.set(request_metrics)
+    with _in_flight_lock:
+        _in_flight += 1
+    return request_metrics
+
+
+def end_request(request_metrics: RequestMetrics, route: str, method: str, status: int):
+    """Record a finished request; call once its body has been sent"""
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+    labels = (route, method)
+    REQUESTS.inc((route, method, str(status)))
+    REQUEST_DURATION.observe(time.perf_counter() - request_metrics.started, labels)
+    DB_TIME.observe(request_metrics.db_seconds, labels)
+    if request_metrics.statements:
+        DB_STATEMENTS.inc(labels, request_metrics.statements)
+        DB_ROWS.inc(labels, request_metrics.rows)
+    _run_end_hooks(request_metrics, f'{method} {route}')
+
+
+@contextmanager
+def background_request(label: str, request_id: Optional[str] = None):
+    """Trace database work outside HTTP requests (e.g. queued jobs) under an id"""
+    request_metrics = RequestMetrics(request_id)
+    token = current_request.set(request_metrics)
+    try:
+        yield request_metrics
+    finally:
+        _run_end_hooks(request_metrics, label)
+        current_request.reset(token)
+
+
+def server_timing(request_metrics: RequestMetrics) -> str:
+    """Server-Timing header value for the time spent so far, in milliseconds"""
+    total = time.perf_counter() - request_metrics.started
+    return (f'db;dur={request_metrics.db_seconds * 1000:.1f}, '
+            f'serialize;dur={request_metrics.serialize_seconds * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}')
+
+
+# Request ids in log records
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+_base_record_factory = logging.getLogRecordFactory()
+
+
+def _record_with_request_id(*args, **kwargs) -> logging.LogRecord:
+    record = _base_record_factory(*args, **kwargs)
+    record.request_id = current_request_id() or '-'
+    return record
+
+
+logging.setLogRecordFactory(_record_with_request_id)
+
+
+def _asgi_route(scope) -> str:
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+    # Mounted apps (static files) set a root path but no route
+    if scope.get('endpoint') is not None and scope.get('root_path'):
+        return scope['root_path'] + '/*'
+    return 'unmatched'
+
+
+class MetricsMiddleware:
+    """ASGI middleware accounting each request until its last body chunk is sent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get('headers', []):
+            if name == b'x-request-id':
+                request_id = accept_request_id(value.decode('latin-1'))
+                break
+        request_metrics = begin_request(request_id)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-request-id', request_metrics.request_id.encode('latin-1')),
+                    (b'server-timing', server_timing(request_metrics).encode('latin-1')),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            end_request(request_metrics, _asgi_route(scope), scope['method'], status)
+
+
+def _collect_in_flight() -> Iterable[GaugeFamily]:
+    family = GaugeFamily('http_requests_in_flight', 'Requests currently being served')
+    family.add((), _in_flight)
+    return [family]
+
+
+register_collector(_collect_in_flight)
+
+
+# Collectors for state tracked elsewhere
+
+def register_cache(name: str, counts: Callable[[], Tuple[int, int]]):
+    """Export a cache's hit/miss counters; counts() returns (hits, misses)"""
+    def collect() -> Iterable[GaugeFamily]:
+        hits, misses = counts()
+        requests = GaugeFamily('cache_requests_total', 'Cache lookups by result', ('cache', 'result'), 'counter')
+        requests.add((name, 'hit'), hits)
+        requests.add((name, 'miss'), misses)
+        ratio = GaugeFamily('cache_hit_ratio', 'Share of cache lookups served from the cache', ('cache',))
+        ratio.add((name,), hits / (hits + misses) if hits + misses else 0)
+        return [requests, ratio]
+    register_collector(collect)
+
+
+def families_from_stats(prefix: str, documentation: str, label: str,
+                        stats: Dict[str, Dict[str, float]], counters: Sequence[str] = ()) -> List[GaugeFamily]:
+    """Turn {label_value: {field: number}} stats into one family per field"""
+    families: Dict[str, GaugeFamily] = {}
+    for label_value, fields in stats.items():
+        for field, value in fields.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            family = families.get(field)
+            if family is None:
+                kind = 'counter' if field in counters else 'gauge'
+                name = f'{prefix}_{field}' + ('_total' if kind == 'counter' and not field.endswith('_total') else '')
+                family = families[field] = GaugeFamily(name, f'{documentation}: {field.replace("_", " ")}', (label,), kind)
+            family.add((label_value,), value)
+    return list(families.values())
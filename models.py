@@ -8,6 +8,8 @@ from datetime import datetime
 import re
 import uuid
 
+from metrics import current_request_id
+
 
 # Base response models for standardization
 class APIResponse(BaseModel):
@@ -47,7 +49,7 @@ class ErrorResponse(BaseModel):
     code: str = Field(..., description="Error code for programmatic handling")
     details: Optional[List[ErrorDetail]] = Field(None, description="Detailed error information")
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="Error timestamp")
-    request_id: Optional[str] = Field(None, description="Unique request identifier")
+    request_id: Optional[str] = Field(default_factory=current_request_id, description="Unique request identifier")
 
     class Config:
         json_encoders = {
@@ -93,6 +95,8 @@ class CategoryBase(BaseModel):
     level: int = Field(..., ge=1, le=3, description="Category level (1-3)")
     parent_id: Optional[str] = Field(None, description="Parent category ID")
     hasChildren: bool = Field(default=False, description="Whether category has child categories")
+    product_count: Optional[int] = Field(None, ge=0, description="Products assigned to this category")
+    subtree_product_count: Optional[int] = Field(None, ge=0, description="Products assigned to this category or any below it")
     created_at: Optional[datetime] = Field(None, description="Category creation timestamp")
     updated_at: Optional[datetime] = Field(None, description="Category last update timestamp")
 
@@ -128,6 +132,18 @@ class CategoryBase(BaseModel):
         }
 
 
+def clean_category_name(v: str) -> str:
+    """Strip a category name, rejecting empty, overlong or unsafe names"""
+    if not v or not v.strip():
+        raise ValueError("Category name cannot be empty")
+    if len(v.strip()) > 100:
+        raise ValueError("Category name cannot exceed 100 characters")
+    # Check for special characters that might cause issues
+    if re.search(r'[<>"/\\|?*\x00-\x1f]', v):
+        raise ValueError("Category name contains invalid characters")
+    return v.strip()
+
+
 class CategoryCreateRequest(BaseModel):
     """Enhanced request model for creating new categories"""
     name: str = Field(..., min_length=1, max_length=100, description="Category name")
@@ -137,14 +153,7 @@ class CategoryCreateRequest(BaseModel):
     @validator('name')
     def validate_name(cls, v):
         """Validate category name"""
-        if not v or not v.strip():
-            raise ValueError("Category name cannot be empty")
-        if len(v.strip()) > 100:
-            raise ValueError("Category name cannot exceed 100 characters")
-        # Check for special characters that might cause issues
-        if re.search(r'[<>"/\\|?*\x00-\x1f]', v):
-            raise ValueError("Category name contains invalid characters")
-        return v.strip()
+        return clean_category_name(v)
 
     @validator('level')
     def validate_level(cls, v):
@@ -169,11 +178,21 @@ class CategoryCreateRequest(BaseModel):
 
 
 class CategoryUpdateRequest(BaseModel):
-    """Request model for updating categories"""
+    """
+    Request model for updating categories
+
+    Only the fields sent are changed; an explicit null parent_id moves the
+    category to the top level.
+    """
     name: Optional[str] = Field(None, min_length=1, max_length=100, description="Category name")
     level: Optional[int] = Field(None, ge=1, le=3, description="Category level")
     parent_id: Optional[str] = Field(None, description="Parent category ID")
 
+    @validator('name')
+    def validate_name(cls, v):
+        """Validate category name"""
+        return v if v is None else clean_category_name(v)
+
 
 class AssignCategoriesRequest(BaseModel):
     """Enhanced request model for assigning categories to products"""
@@ -214,10 +233,31 @@ class BulkRemoveCategoriesRequest(BaseModel):
     category_ids: List[str] = Field(..., min_items=1, description="List of category IDs to remove")
 
 
+class ProductIdsRequest(BaseModel):
+    """Request model for endpoints that take a list of product IDs"""
+    product_ids: List[str] = Field(..., min_items=1, description="List of product IDs")
+
+
+class ProductQueryRequest(BaseModel):
+    """Request model for querying products by a boolean expression over categories"""
+    expression: Union[str, Dict[str, Any]] = Field(
+        ..., description='Category name, {"category": name, "subtree": bool}, {"and": [...]}, {"or": [...]} or {"not": ...}'
+    )
+    limit: int = Field(100, ge=1, le=1000, description="Products per page")
+    offset: int = Field(0, ge=0, description="Number of matching products to skip")
+    count_only: bool = Field(False, description="Return only the number of matching products")
+
+
+class CategoryDeleteRequest(BaseModel):
+    """Request model for deleting a category"""
+    category_name: str = Field(..., min_length=1, description="Name of the category to delete")
+
+
 class ErrorResponse(BaseModel):
     """Standard error response model"""
     error: str = Field(..., description="Error message")
     details: Dict[str, Any] = Field(default_factory=dict, description="Additional error details")
+    request_id: Optional[str] = Field(default_factory=current_request_id, description="Unique request identifier")
 
 
 class SuccessResponse(BaseModel):
@@ -226,7 +266,7 @@ class SuccessResponse(BaseModel):
     message: str = Field(..., description="Success message")
     details: Optional[Dict[str, Any]] = Field(None, description="Additional response details")
     timestamp: datetime = Field(default_factory=datetime.utcnow, description="Response timestamp")
-    request_id: Optional[str] = Field(None, description="Unique request identifier")
+    request_id: Optional[str] = Field(default_factory=current_request_id, description="Unique request identifier")
 
     class Config:
         json_encoders = {
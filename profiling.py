@@ -0,0 +1,302 @@
+"""
+On-demand request profiling for Tag Manager V2
+
+Set PROFILING_TOKEN to allow profiling in production. A request that
+carries the token, either in the X-Profile-Token header or in the
+profile_token query parameter, runs under cProfile. Its response gets an
+X-Profile-ID header. The profile is kept in a ring buffer of the last
+PROFILING_BUFFER_SIZE profiles, which is viewable with the same token at:
+
+    GET /api/admin/profiles               list of kept profiles
+    GET /api/admin/profiles/<id>          top functions by cumulative time
+    GET /api/admin/profiles/<id>?format=pstats
+                                          download for snakeviz, gprof2dot or
+                                          flameprof (flame graphs)
+
+In the FastAPI app only the request's own coroutine steps are profiled on
+the event loop thread, not other requests interleaved with it. Its work on
+the database lanes is profiled in those threads, and the profiles are then
+merged. In Flask the profile covers the handler and the streamed body.
+
+Without PROFILING_TOKEN the middlewares are not installed and the database
+lanes skip the check, so there is no overhead.
+"""
+
+import collections
+import cProfile
+import functools
+import hmac
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import metrics
+
+TOKEN = os.environ.get('PROFILING_TOKEN', '')
+BUFFER_SIZE = int(os.environ.get('PROFILING_BUFFER_SIZE', '20'))
+
+ENABLED = bool(TOKEN)
+
+HEADER = 'X-Profile-Token'
+QUERY_PARAM = 'profile_token'
+
+ADMIN_PREFIX = '/api/admin/'
+
+# Functions listed in the text summary
+SUMMARY_LIMIT = 40
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Whether a header or query value matches PROFILING_TOKEN"""
+    if not ENABLED or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), TOKEN.encode('utf-8'))
+
+
+def admin_error(token: Optional[str]) -> Optional[Tuple[int, str]]:
+    """(status, message) refusing an admin request, or None when it may proceed"""
+    if not ENABLED:
+        return 404, 'Profiling is not enabled'
+    if not authorized(token):
+        return 403, 'A valid profiling token is required'
+    return None
+
+
+def _query_token(query_string: str) -> Optional[str]:
+    values = parse_qs(query_string).get(QUERY_PARAM)
+    return values[0] if values else None
+
+
+class RequestProfile:
+    """cProfile data for one request, possibly gathered on several threads"""
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex[:16]
+        self.request_id = metrics.current_request_id()
+        self.method = method
+        self.path = path
+        self.created_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+
+    def new_profiler(self) -> cProfile.Profile:
+        # A cProfile.Profile must only be enabled on one thread at a time
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profiler)
+        return profiler
+
+    def runcall(self, fn: Callable, *args) -> Any:
+        return self.new_profiler().runcall(fn, *args)
+
+    def finish(self, status: Optional[int]) -> 'ProfileRecord':
+        duration = time.perf_counter() - self.started
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        return ProfileRecord(self, status, duration, stats)
+
+
+class ProfileRecord:
+    """A finished profile as kept in the ring buffer"""
+
+    def __init__(self, profile: RequestProfile, status: Optional[int], duration: float, stats: pstats.Stats):
+        self.profile_id = profile.profile_id
+        self.request_id = profile.request_id
+        self.method = profile.method
+        self.path = profile.path
+        self.status = status
+        self.created_at = profile.created_at
+        self.duration = duration
+        self.function_calls = stats.total_calls
+        self.pstats = marshal.dumps(stats.stats)
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats('cumulative').print_stats(SUMMARY_LIMIT)
+        self.summary = summary.getvalue()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'profile_id': self.profile_id,
+            'request_id': self.request_id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3),
+            'function_calls': self.function_calls,
+        }
+
+
+class ProfileStore:
+    """Ring buffer of the most recent profiles in this process"""
+
+    def __init__(self, size: int = BUFFER_SIZE):
+        self._records = collections.deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+
+    def add(self, record: ProfileRecord):
+        with self._lock:
+            self._records.append(record)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [record.info() for record in reversed(self._records)]
+
+    def get(self, profile_id: str) -> Optional[ProfileRecord]:
+        with self._lock:
+            for record in self._records:
+                if record.profile_id == profile_id:
+                    return record
+        return None
+
+
+profiles = ProfileStore()
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar('request_profile', default=None)
+
+
+def wrap(fn: Callable) -> Callable:
+    """fn, run under the current request's profile when there is one"""
+    profile = current_profile.get()
+    if profile is None:
+        return fn
+    return functools.partial(profile.runcall, fn)
+
+
+class _ProfiledSteps:
+    """Awaitable running each step of a coroutine under a profiler"""
+
+    def __init__(self, coro, profiler: cProfile.Profile):
+        self.coro = coro
+        self.profiler = profiler
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profiler.enable()
+            try:
+                if error is None:
+                    yielded = self.coro.send(value)
+                else:
+                    yielded = self.coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler.disable()
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that carry the profiling token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope.get('headers', []):
+            if name == b'x-profile-token':
+                token = value.decode('latin-1')
+                break
+        if token is None:
+            token = _query_token(scope.get('query_string', b'').decode('latin-1'))
+        if not authorized(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope['method'], scope['path'])
+        status = None
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-profile-id', profile.profile_id.encode('latin-1')),
+                ]
+            await send(message)
+
+        token_reset = current_profile.set(profile)
+        try:
+            await _ProfiledSteps(self.app(scope, receive, send_with_profile_id), profile.new_profiler())
+        finally:
+            current_profile.reset(token_reset)
+            profiles.add(profile.finish(status))
+
+
+class ProfilingWSGIMiddleware:
+    """WSGI middleware profiling requests that carry the profiling token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        token = environ.get('HTTP_X_PROFILE_TOKEN') or _query_token(environ.get('QUERY_STRING', ''))
+        if environ.get('PATH_INFO', '').startswith(ADMIN_PREFIX) or not authorized(token):
+            return self.app(environ, start_response)
+
+        profile = RequestProfile(environ.get('REQUEST_METHOD', ''), environ.get('PATH_INFO', ''))
+        profiler = profile.new_profiler()
+        state = {'status': None, 'closed': False}
+
+        def start_response_with_profile_id(status, headers, exc_info=None):
+            state['status'] = int(status.split(' ', 1)[0])
+            return start_response(status, list(headers) + [('X-Profile-ID', profile.profile_id)], exc_info)
+
+        def finish():
+            if state['closed']:
+                return
+            state['closed'] = True
+            profiler.disable()
+            profiles.add(profile.finish(state['status']))
+
+        # The body is iterated and closed on this thread after the handler returns
+        profiler.enable()
+        try:
+            body = self.app(environ, start_response_with_profile_id)
+        except BaseException:
+            finish()
+            raise
+        # The request id is assigned by the app's before_request hook
+        profile.request_id = metrics.current_request_id()
+        return _ClosingBody(body, finish)
+
+
+class _ClosingBody:
+    """WSGI body that runs a callback after the wrapped body is closed"""
+
+    def __init__(self, body, callback: Callable[[], None]):
+        self.body = body
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.callback()
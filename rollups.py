@@ -0,0 +1,268 @@
+"""
+Per-category product counts for Tag Manager V2
+
+category_counts holds two numbers for every category:
+
+- direct_count:  mapping rows naming the category
+- subtree_count: distinct products mapped to the category or any descendant
+
+Triggers on product_category_links (see database.py) keep both current on
+every insert, delete and update, whichever code path writes the mapping.
+They find a category's ancestors in category_closure, which holds one row
+per (ancestor, descendant) pair of the taxonomy in category.json, including
+each category paired with itself. Both tables are keyed by category_int
+from category_ids; get_counts translates back to names.
+
+The same triggers count every mapping row added or removed per category
+in category_counts.changes, which tells bitmaps.py what to reload.
+
+The closure is derived from category.json, so it records the fingerprint
+of the taxonomy it was built from. Category writes in services.py adjust
+the closure inside their own transaction. When the file was edited some
+other way, ensure_current rebuilds closure and counts: the apps call it
+from their cache warm-up, which runs at start and, under serve.py, after
+every taxonomy change, and category writes call it before their own
+change. Reads never take the write lock for a rebuild; until one runs they
+see the counts of the last taxonomy built.
+"""
+
+import hashlib
+import json
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import database
+import invalidation
+from taxonomy import CategoryIndex, get_category_index, load_category_index
+
+
+def fingerprint(categories: List[dict]) -> str:
+    """Identify a taxonomy by its parent links, which are all the closure depends on"""
+    links = sorted((cat['category_name'], cat.get('connected_to') or '') for cat in categories)
+    return hashlib.sha1(json.dumps(links).encode()).hexdigest()
+
+
+def closure_rows(index: CategoryIndex) -> Iterable[Tuple[str, str, int]]:
+    """(ancestor, descendant, depth) for every category and each of its ancestors"""
+    for name in index.by_name:
+        yield name, name, 0
+        for depth, ancestor in enumerate(index.ancestors(name), start=1):
+            if ancestor in index:
+                yield ancestor, name, depth
+
+
+def stored_fingerprint(conn: sqlite3.Connection) -> Optional[str]:
+    row = conn.execute('SELECT fingerprint FROM category_rollup_state WHERE id = 1').fetchone()
+    return row[0] if row else None
+
+
+def _store_fingerprint(conn: sqlite3.Connection, value: str):
+    conn.execute('INSERT OR REPLACE INTO category_rollup_state (id, fingerprint) VALUES (1, ?)', (value,))
+
+
+def rebuild(conn: sqlite3.Connection, index: CategoryIndex):
+    """Recreate closure and counts from scratch; call inside a write transaction"""
+    database.intern_categories(conn, index.by_name)
+    conn.execute('DELETE FROM category_closure')
+    conn.executemany('''
+        INSERT INTO category_closure (ancestor, descendant, depth)
+        SELECT a.category_int, d.category_int, ?3
+        FROM category_ids a, category_ids d
+        WHERE a.name = ?1 AND d.name = ?2
+    ''', closure_rows(index))
+    # Rows are reset rather than replaced so their change counters carry on
+    conn.execute('UPDATE category_counts SET direct_count = 0, subtree_count = 0')
+    conn.execute('''
+        WITH direct AS (
+            SELECT category_int, COUNT(*) AS products FROM product_category_links GROUP BY category_int
+        )
+        INSERT INTO category_counts (category_int, direct_count)
+        SELECT category_int, products FROM direct WHERE true
+        ON CONFLICT (category_int) DO UPDATE SET direct_count = excluded.direct_count
+    ''')
+    conn.execute('INSERT OR IGNORE INTO category_counts (category_int) SELECT ancestor FROM category_closure')
+    conn.execute('''
+        WITH subtree AS (
+            SELECT cl.ancestor, COUNT(DISTINCT l.product_int) AS products
+            FROM category_closure cl
+            JOIN product_category_links l ON l.category_int = cl.descendant
+            GROUP BY cl.ancestor
+        )
+        UPDATE category_counts SET subtree_count = subtree.products
+        FROM subtree WHERE subtree.ancestor = category_counts.category_int
+    ''')
+    conn.execute('''
+        DELETE FROM category_counts
+        WHERE direct_count = 0 AND category_int NOT IN (SELECT descendant FROM category_closure)
+    ''')
+    _store_fingerprint(conn, fingerprint(index.categories))
+
+
+def recount(conn: sqlite3.Connection, category_ints: Iterable[int], mappings_changed: bool = False):
+    """
+    Recompute both counts for some categories by integer id; call inside a
+    write transaction. With mappings_changed, their change counters also
+    advance, so bitmaps.py reloads them.
+    """
+    category_ints = list(category_ints)
+    conn.executemany('INSERT OR IGNORE INTO category_counts (category_int) VALUES (?)',
+                     ((c,) for c in category_ints))
+    if mappings_changed:
+        conn.executemany('UPDATE category_counts SET changes = changes + 1 WHERE category_int = ?',
+                         ((c,) for c in category_ints))
+    conn.executemany('''
+        UPDATE category_counts SET
+            direct_count = (SELECT COUNT(*) FROM product_category_links WHERE category_int = ?1),
+            subtree_count = (
+                SELECT COUNT(DISTINCT l.product_int)
+                FROM category_closure cl
+                JOIN product_category_links l ON l.category_int = cl.descendant
+                WHERE cl.ancestor = ?1
+            )
+        WHERE category_int = ?1
+    ''', ((c,) for c in category_ints))
+
+
+def add_category(conn: sqlite3.Connection, name: str, parent: Optional[str], categories: List[dict]):
+    """
+    Extend the closure with a new category; call inside a write transaction.
+
+    categories is the taxonomy including the new category, as written to
+    category.json.
+    """
+    database.intern_categories(conn, [name])
+    name_int = database.category_int(conn, name)
+    conn.execute('''
+        INSERT OR REPLACE INTO category_closure (ancestor, descendant, depth)
+        SELECT ancestor, ?1, depth + 1 FROM category_closure WHERE descendant = ?2
+        UNION ALL SELECT ?1, ?1, 0
+    ''', (name_int, database.category_int(conn, parent)))
+    # Mappings can outlive a deleted category of the same name
+    if conn.execute('SELECT 1 FROM product_category_links WHERE category_int = ?', (name_int,)).fetchone():
+        recount(conn, [row[0] for row in conn.execute(
+            'SELECT ancestor FROM category_closure WHERE descendant = ?', (name_int,)
+        )])
+    else:
+        conn.execute('INSERT OR IGNORE INTO category_counts (category_int) VALUES (?)', (name_int,))
+    _store_fingerprint(conn, fingerprint(categories))
+
+
+def remove_category(conn: sqlite3.Connection, name: str, categories: List[dict]):
+    """
+    Drop a leaf category whose mappings are already gone; call inside a write
+    transaction. categories is the taxonomy without it.
+    """
+    name_int = database.category_int(conn, name)
+    conn.execute('DELETE FROM category_closure WHERE descendant = ?1 OR ancestor = ?1', (name_int,))
+    conn.execute('DELETE FROM category_counts WHERE category_int = ?', (name_int,))
+    _store_fingerprint(conn, fingerprint(categories))
+
+
+def rename_category(conn: sqlite3.Connection, name: str, new_name: str, categories: List[dict]):
+    """
+    Give a category a new name; call inside a write transaction.
+
+    Mapping rows, closure and counts refer to the category by category_int,
+    so only its category_ids row changes. Mappings left behind under the
+    new name by a deleted category are adopted, as add_category does.
+    categories is the taxonomy after the rename.
+    """
+    name_int = database.category_int(conn, name)
+    stale_int = database.category_int(conn, new_name)
+    if stale_int is not None:
+        conn.execute('''
+            INSERT OR IGNORE INTO product_category_links (product_int, category_int)
+            SELECT product_int, ? FROM product_category_links WHERE category_int = ?
+        ''', (name_int, stale_int))
+        conn.execute('DELETE FROM product_category_links WHERE category_int = ?', (stale_int,))
+        conn.execute('DELETE FROM category_closure WHERE descendant = ?1 OR ancestor = ?1', (stale_int,))
+        conn.execute('DELETE FROM category_counts WHERE category_int = ?', (stale_int,))
+        conn.execute('DELETE FROM category_ids WHERE category_int = ?', (stale_int,))
+    conn.execute('UPDATE category_ids SET name = ? WHERE category_int = ?', (new_name, name_int))
+    _store_fingerprint(conn, fingerprint(categories))
+
+
+def move_category(conn: sqlite3.Connection, name: str, parent: Optional[str], categories: List[dict]):
+    """
+    Move a category and everything below it under another parent, or to the
+    top level without one; call inside a write transaction.
+
+    Only the closure changes. The counts of the old and new ancestors are
+    left to the caller, which rewrites their mappings and then recounts them
+    (see services.update_category). categories is the taxonomy after the move.
+    """
+    name_int = database.category_int(conn, name)
+    conn.execute('''
+        DELETE FROM category_closure
+        WHERE descendant IN (SELECT descendant FROM category_closure WHERE ancestor = ?1)
+          AND ancestor NOT IN (SELECT descendant FROM category_closure WHERE ancestor = ?1)
+    ''', (name_int,))
+    conn.execute('''
+        INSERT INTO category_closure (ancestor, descendant, depth)
+        SELECT above.ancestor, below.descendant, above.depth + below.depth + 1
+        FROM category_closure above, category_closure below
+        WHERE above.descendant = ? AND below.ancestor = ?
+    ''', (database.category_int(conn, parent), name_int))
+    _store_fingerprint(conn, fingerprint(categories))
+
+
+@contextmanager
+def suspended(conn: sqlite3.Connection):
+    """
+    Pause the count triggers for a set-based rewrite in the current write
+    transaction; the caller recounts whatever it touched afterwards.
+    """
+    conn.execute('INSERT OR IGNORE INTO category_rollup_pause (id) VALUES (1)')
+    try:
+        yield
+    finally:
+        conn.execute('DELETE FROM category_rollup_pause')
+
+
+_fingerprinted: Tuple[Optional[CategoryIndex], str] = (None, '')
+
+
+def _index_fingerprint(index: CategoryIndex) -> str:
+    global _fingerprinted
+    # An index never changes once built, so its fingerprint is computed once
+    if _fingerprinted[0] is not index:
+        _fingerprinted = (index, fingerprint(index.categories))
+    return _fingerprinted[1]
+
+
+def ensure_current(conn: sqlite3.Connection, index: Optional[CategoryIndex] = None) -> bool:
+    """
+    Rebuild closure and counts if category.json changed behind our back.
+
+    Checked with a read first; the write lock is only taken on a mismatch.
+    A mismatch may just mean this process has not yet seen another worker's
+    category edit, so it looks for changes and reads again before locking.
+    The rebuild itself uses category.json as read under the lock, never a
+    cached index, so a stale worker cannot roll the counts back.
+    """
+    if stored_fingerprint(conn) == _index_fingerprint(index or get_category_index()):
+        return False
+    invalidation.notify()
+    if stored_fingerprint(conn) == _index_fingerprint(get_category_index()):
+        return False
+
+    import services
+
+    def write() -> bool:
+        current = load_category_index()
+        # Another worker may have rebuilt while this one waited for the lock
+        if stored_fingerprint(conn) == fingerprint(current.categories):
+            return False
+        rebuild(conn, current)
+        return True
+
+    return services.write_transaction(conn, write, 'rebuild_category_counts')
+
+
+def get_counts(conn: sqlite3.Connection) -> Dict[str, Tuple[int, int]]:
+    """(direct_count, subtree_count) for every category, as last committed; never rebuilds"""
+    return {row[0]: (row[1], row[2]) for row in conn.execute('''
+        SELECT ci.name, cc.direct_count, cc.subtree_count
+        FROM category_counts cc JOIN category_ids ci ON ci.category_int = cc.category_int
+    ''')}
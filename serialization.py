@@ -0,0 +1,166 @@
+"""
+Fast JSON serialization helpers for Tag Manager V2 list endpoints
+"""
+
+import json
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from metrics import current_request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson installed
+    orjson = None
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize an object to compact JSON bytes, using orjson when available"""
+    request_metrics = current_request.get()
+    if request_metrics is None:
+        return _dumps(obj)
+    started = time.perf_counter()
+    try:
+        return _dumps(obj)
+    finally:
+        request_metrics.serialize_seconds += time.perf_counter() - started
+
+
+def format_timestamp(value: Optional[str]) -> Optional[str]:
+    """Convert a SQLite CURRENT_TIMESTAMP string to the ISO format Pydantic emits"""
+    if not value:
+        return None
+    return value.replace(" ", "T", 1)
+
+
+def product_summary_rows(rows: Iterable) -> List[Dict[str, Any]]:
+    """
+    Build ProductSummary-shaped dicts straight from database rows.
+
+    Rows come from our own tables, so the ProductSummary validators are skipped;
+    only the whitespace normalisation they apply is kept.
+    """
+    return [
+        {
+            "product_id": row["product_id"],
+            "product_name": row["product_name"].strip(),
+            "has_allocations": row["category_count"] > 0,
+            "category_count": row["category_count"],
+            "last_modified": format_timestamp(row["last_modified"]),
+        }
+        for row in rows
+    ]
+
+
+def api_response_bytes(data: Any, metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """Encode a payload with the same envelope as models.APIResponse"""
+    return dumps({
+        "success": True,
+        "data": data,
+        "metadata": metadata,
+        "timestamp": datetime.utcnow().isoformat(),
+    })
+
+
+def _media_range_match(offer: str, media_range: str) -> int:
+    """How specifically media_range matches offer: 2 exact, 1 type/*, 0 */*, -1 not at all"""
+    if media_range == offer:
+        return 2
+    if media_range == "*/*":
+        return 0
+    if media_range.endswith("/*") and offer.startswith(media_range[:-1]):
+        return 1
+    return -1
+
+
+def prefers_ndjson(accept: Optional[str]) -> bool:
+    """
+    Whether an Accept header asks for NDJSON over plain JSON.
+
+    Follows werkzeug's best_match(["application/json", NDJSON_MIMETYPE]) so
+    both apps agree: each offer takes the q of its most specific matching
+    media range, q=0 refuses it, and JSON wins ties. Ranges with an invalid
+    q are ignored, as are ranges with parameters, which neither offer has.
+    """
+    ranges = []
+    for item in (accept or "").split(","):
+        media_range, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() != "q":
+                break
+            try:
+                quality = float(value)
+            except ValueError:
+                break
+            if not 0 <= quality <= 1:
+                break
+        else:
+            if media_range:
+                ranges.append((media_range.lower(), quality))
+
+    def rank(offer: str):
+        matches = [(_media_range_match(offer, media_range), quality) for media_range, quality in ranges]
+        specificity, quality = max((match for match in matches if match[0] >= 0), default=(-1, 0.0))
+        return (quality, specificity) if quality > 0 else None
+
+    ndjson, json_rank = rank(NDJSON_MIMETYPE), rank("application/json")
+    return ndjson is not None and (json_rank is None or ndjson > json_rank)
+
+
+def iter_ndjson(cursor, row_to_dict: Callable[[Any], Dict[str, Any]],
+                batch_size: int = 500) -> Iterator[bytes]:
+    """
+    Stream an executed cursor as newline-delimited JSON.
+
+    Rows are pulled with fetchmany so only one batch is held in memory at a time.
+    """
+    request_metrics = current_request.get()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        started = time.perf_counter()
+        batch = b"".join(_dumps(row_to_dict(row)) + b"\n" for row in rows)
+        if request_metrics is not None:
+            request_metrics.serialize_seconds += time.perf_counter() - started
+        yield batch
+
+
+_fast_json_response = None
+
+
+def _fast_json_response_class():
+    global _fast_json_response
+    if _fast_json_response is None:
+        from starlette.responses import Response
+
+        class FastJSONResponse(Response):
+            """JSON response for trusted payloads that bypasses response_model validation"""
+            media_type = "application/json"
+
+            def render(self, content: Any) -> bytes:
+                if isinstance(content, bytes):
+                    return content
+                return dumps(content)
+
+        _fast_json_response = FastJSONResponse
+    return _fast_json_response
+
+
+def __getattr__(name: str):
+    # The Flask app shares this module; only the FastAPI app pays for Starlette
+    if name == "FastJSONResponse":
+        return _fast_json_response_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
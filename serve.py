@@ -0,0 +1,174 @@
+"""
+Production server entry point for Tag Manager V2
+
+Runs the Flask or FastAPI app under gunicorn with N preloaded workers:
+
+    python serve.py fastapi --workers 4 --bind 0.0.0.0:8000
+    python serve.py flask --workers 4 --bind 0.0.0.0:5000
+
+The app is imported once in the master. Schema checks, the taxonomy index
+and cached category payloads are built there before any worker is forked, so
+new workers start warm and only prime their own database connections. Each
+worker answers /api/ready with 200 once that is done. The master runs no
+import or bulk jobs: each worker starts its own job runner and product CSV
+import after fork. The workers take turns on a lock file, so
+one imports and the rest find the file done; by default this runs in the
+background and does not hold up readiness (see IMPORT_ON_STARTUP in
+warmup.py).
+
+The master follows the taxonomy through the invalidation channel (see
+invalidation.py), which also notices direct edits to data/category.json.
+When the taxonomy changes it rebuilds the shared caches and sends itself
+SIGHUP, so gunicorn starts fresh workers and gracefully retires the old ones.
+
+gunicorn is not available on Windows; there the app runs in a single process
+after the same warm-up.
+"""
+
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import signal
+import threading
+
+import invalidation
+import metrics
+
+logger = logging.getLogger('tag_manager.serve')
+
+APPS = {
+    'fastapi': ('app_fastapi', 'uvicorn.workers.UvicornWorker'),
+    'flask': ('app', 'gthread'),
+}
+
+
+class TaxonomyWatcher(threading.Thread):
+    """Rewarms the master and rolls the workers when the taxonomy changes"""
+
+    def __init__(self, rewarm, interval: float):
+        super().__init__(name='taxonomy-watcher', daemon=True)
+        self.rewarm = rewarm
+        self.interval = interval
+        self.version = invalidation.version('taxonomy')
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            version = invalidation.version('taxonomy')
+            if version == self.version:
+                continue
+            # Let a burst of edits settle before rolling every worker
+            self._stop_event.wait(self.interval)
+            if invalidation.version('taxonomy') != version:
+                continue
+            try:
+                self.rewarm()
+            except Exception:
+                logger.exception('Failed to rewarm caches after taxonomy change')
+                continue
+            self.version = version
+            logger.info('Taxonomy changed; reloading workers')
+            os.kill(os.getpid(), signal.SIGHUP)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def load_app(name: str):
+    """
+    Import an app module and build its shared caches.
+
+    Only warm-up that starts no threads happens here (the cached payloads,
+    and the category counts if category.json changed): under gunicorn this
+    runs in the master, and threads it started (the import, the job runner)
+    would be forked mid-flight. Workers start those in post_fork or FastAPI's startup
+    event.
+    """
+    module = importlib.import_module(APPS[name][0])
+    if name == 'fastapi':
+        rewarm = lambda: asyncio.run(module.warm_caches())
+    else:
+        rewarm = module.warm_caches
+    rewarm()
+    return module, rewarm
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    module, rewarm = load_app(args.app)
+    watcher = TaxonomyWatcher(rewarm, args.watch_interval)
+
+    def when_ready(server):
+        if args.watch_interval > 0:
+            watcher.start()
+
+    def post_fork(server, worker):
+        # Import, job runner and readiness belong to each worker; FastAPI
+        # workers start them in the startup event
+        if args.app == 'flask':
+            module.warm_worker()
+
+    def on_exit(server):
+        watcher.stop()
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': args.bind,
+                'workers': args.workers,
+                'worker_class': APPS[args.app][1],
+                'threads': args.threads,
+                'preload_app': True,
+                'timeout': args.timeout,
+                'graceful_timeout': args.graceful_timeout,
+                'when_ready': when_ready,
+                'post_fork': post_fork,
+                'on_exit': on_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return module.app
+
+    PreloadedApplication().run()
+
+
+def run_single_process(args):
+    module, _ = load_app(args.app)
+    host, _, port = args.bind.rpartition(':')
+    if args.app == 'fastapi':
+        import uvicorn
+        uvicorn.run(module.app, host=host, port=int(port))
+    else:
+        module.warm_worker()
+        module.app.run(host=host, port=int(port), threaded=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Tag Manager V2 with preloaded workers')
+    parser.add_argument('app', choices=sorted(APPS))
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=4, help='Threads per Flask worker')
+    parser.add_argument('--timeout', type=int, default=120)
+    parser.add_argument('--graceful-timeout', type=int, default=30)
+    parser.add_argument('--watch-interval', type=float, default=2.0,
+                        help='Seconds between taxonomy checks (0 disables reload)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=metrics.LOG_FORMAT)
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        logger.warning('gunicorn is not installed; serving from a single process')
+        run_single_process(args)
+    else:
+        run_gunicorn(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1186 @@
+"""
+Shared service layer for Tag Manager V2
+
+Business operations used by both the Flask app (app.py) and the FastAPI app
+(app_fastapi.py). Functions take an open sqlite3 connection, return plain
+Python data and raise ServiceError subclasses; each app turns those into its
+own response format.
+"""
+
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import admission
+import changefeed
+import database
+import invalidation
+import metrics
+import rollups
+from database import id_chunks, iter_rows_for_ids
+from taxonomy import LEVEL_NAMES, CategoryIndex, get_category_index
+
+
+class ServiceError(Exception):
+    """Business rule violation, reported to the client as a 4xx"""
+    status_code = 400
+
+    def __init__(self, message: str, details: Optional[dict] = None):
+        super().__init__(message)
+        self.message = message
+        self.details = details or {}
+
+
+class NotFoundError(ServiceError):
+    """Requested product or category does not exist"""
+    status_code = 404
+
+
+class DatabaseBusyError(ServiceError):
+    """The database stayed locked through every retry; reported as 503"""
+    status_code = 503
+    retry_after = 1
+
+
+# Write transactions
+
+# Seconds one attempt waits for the write lock
+WRITE_BUSY_TIMEOUT = float(os.environ.get('DB_WRITE_BUSY_TIMEOUT', str(database.BUSY_TIMEOUT)))
+
+# Extra attempts after the lock could not be taken, with jittered exponential backoff
+WRITE_RETRIES = int(os.environ.get('DB_WRITE_RETRIES', '3'))
+WRITE_RETRY_DELAY = float(os.environ.get('DB_WRITE_RETRY_DELAY', '0.05'))
+WRITE_RETRY_MAX_DELAY = 1.0
+
+# Endpoint label for write metrics; set by each app per request
+write_endpoint: contextvars.ContextVar = contextvars.ContextVar('write_endpoint', default=None)
+
+
+def is_busy_error(error: sqlite3.Error) -> bool:
+    """Whether an sqlite3 error means another connection holds the lock"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'database is locked' in str(error) or 'database is busy' in str(error)
+
+
+class WriteMetrics:
+    """Per-endpoint lock wait and retry counters for write transactions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, Dict[str, float]] = {}
+
+    def record(self, endpoint: str, lock_wait: float, retries: int, failed: bool):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'transactions': 0, 'retries': 0, 'busy_failures': 0,
+                'lock_wait_seconds': 0.0, 'max_lock_wait_seconds': 0.0,
+            })
+            stats['transactions'] += 1
+            stats['retries'] += retries
+            stats['busy_failures'] += int(failed)
+            stats['lock_wait_seconds'] += lock_wait
+            stats['max_lock_wait_seconds'] = max(stats['max_lock_wait_seconds'], lock_wait)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                endpoint: {key: round(value, 4) if isinstance(value, float) else value
+                           for key, value in stats.items()}
+                for endpoint, stats in self._endpoints.items()
+            }
+
+
+write_metrics = WriteMetrics()
+
+metrics.register_collector(lambda: metrics.families_from_stats(
+    'write', 'Write transactions by endpoint', 'endpoint', write_metrics.stats(),
+    counters=('transactions', 'retries', 'busy_failures', 'lock_wait_seconds')
+))
+
+
+def write_transaction(conn: sqlite3.Connection, fn: Callable[[], Any], operation: str) -> Any:
+    """
+    Run fn() in a BEGIN IMMEDIATE transaction, commit, and return its result.
+
+    Taking the write lock up front means a transaction never fails half way
+    through when another connection wrote first; all waiting happens at
+    BEGIN, bounded by WRITE_BUSY_TIMEOUT, and is recorded per endpoint.
+    While the database stays locked the attempt is rolled back and retried
+    with jittered backoff, then DatabaseBusyError is raised. fn may run more
+    than once and must not commit.
+    """
+    endpoint = write_endpoint.get() or operation
+    lock_wait = 0.0
+    for attempt in range(WRITE_RETRIES + 1):
+        conn.execute(f'PRAGMA busy_timeout = {int(WRITE_BUSY_TIMEOUT * 1000)}')
+        started = time.perf_counter()
+        locked = False
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            locked = True
+            lock_wait += time.perf_counter() - started
+            result = fn()
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            if not locked:
+                lock_wait += time.perf_counter() - started
+            if conn.in_transaction:
+                conn.rollback()
+            if not is_busy_error(e):
+                raise
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            write_metrics.record(endpoint, lock_wait, attempt, failed=False)
+            return result
+        if attempt < WRITE_RETRIES:
+            time.sleep(random.uniform(0, min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_DELAY * 2 ** attempt)))
+
+    write_metrics.record(endpoint, lock_wait, WRITE_RETRIES, failed=True)
+    raise DatabaseBusyError('Database is busy, please retry', {
+        'operation': operation,
+        'attempts': WRITE_RETRIES + 1,
+        'lock_wait_seconds': round(lock_wait, 3),
+    })
+
+
+# Products
+
+CATEGORIZATION_STATUS_QUERY = '''
+    SELECT
+        pc.product_id,
+        pc.product_name,
+        (SELECT COUNT(*)
+         FROM product_category_links l
+         WHERE l.product_int = pc.product_int) as category_count
+    FROM product_categories pc
+    ORDER BY pc.product_name
+'''
+
+
+def categorization_status_row(row) -> dict:
+    """Convert a CATEGORIZATION_STATUS_QUERY row to its response shape"""
+    return {
+        'product_id': row[0],
+        'product_name': row[1],
+        'category_count': row[2],
+        'has_categories': row[2] > 0
+    }
+
+
+def get_categorization_status(conn: sqlite3.Connection) -> List[dict]:
+    """All products with their category counts, ordered by name"""
+    return [categorization_status_row(row) for row in conn.execute(CATEGORIZATION_STATUS_QUERY)]
+
+
+def get_product_statistics(conn: sqlite3.Connection) -> dict:
+    """Categorized/uncategorized product counts and the number of categories"""
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT COUNT(*) FROM product_categories')
+    total_products = cursor.fetchone()[0]
+
+    # Products with at least one category; the subquery reads product_int runs in key order
+    cursor.execute('SELECT COUNT(*) FROM (SELECT DISTINCT product_int FROM product_category_links)')
+    categorized_products = cursor.fetchone()[0]
+
+    return {
+        'total_products': total_products,
+        'categorized_products': categorized_products,
+        'uncategorized_products': total_products - categorized_products,
+        'total_categories': len(get_category_index())
+    }
+
+
+def get_product_last_modified(conn: sqlite3.Connection, product_id: str) -> Optional[str]:
+    """Last modified timestamp for a product"""
+    row = conn.execute(
+        'SELECT last_modified FROM product_categories WHERE product_id = ?', (product_id,)
+    ).fetchone()
+    if row is None:
+        raise NotFoundError('Product not found', {'product_id': product_id})
+    return row['last_modified']
+
+
+def get_product_category_ids(conn: sqlite3.Connection, product_id: str) -> List[str]:
+    """Category ids currently mapped to a product"""
+    return [
+        row[0] for row in conn.execute('''
+            SELECT ci.name
+            FROM product_categories pc
+            JOIN product_category_links l ON l.product_int = pc.product_int
+            JOIN category_ids ci ON ci.category_int = l.category_int
+            WHERE pc.product_id = ?
+            ORDER BY ci.name
+        ''', (product_id,))
+    ]
+
+
+def get_product_categories(conn: sqlite3.Connection, product_id: str) -> List[dict]:
+    """Category details for every known category mapped to a product"""
+    index = get_category_index()
+    return [
+        index.details(category_id)
+        for category_id in get_product_category_ids(conn, product_id)
+        if category_id in index
+    ]
+
+
+def get_bulk_product_categories(conn: sqlite3.Connection, product_ids: List[str]) -> Dict[str, List[dict]]:
+    """Category details for many products, keyed by product id"""
+    rows = iter_rows_for_ids(conn, '''
+        SELECT pc.product_id, ci.name
+        FROM product_categories pc
+        JOIN product_category_links l ON l.product_int = pc.product_int
+        JOIN category_ids ci ON ci.category_int = l.category_int
+        WHERE pc.product_id IN (SELECT value FROM json_each(?))
+        ORDER BY pc.product_id, ci.name
+    ''', product_ids)
+
+    index = get_category_index()
+    categories_map: Dict[str, List[dict]] = {}
+    for product_id, category_id in rows:
+        categories = categories_map.setdefault(product_id, [])
+        category = index.details(category_id)
+        if category:
+            categories.append(category)
+    return categories_map
+
+
+def get_bulk_categories_summary(conn: sqlite3.Connection, product_ids: List[str]) -> Dict[str, int]:
+    """Category counts for many products; unknown or uncategorized ids count 0"""
+    rows = iter_rows_for_ids(conn, '''
+        SELECT pc.product_id, COUNT(*) as category_count
+        FROM product_categories pc
+        JOIN product_category_links l ON l.product_int = pc.product_int
+        WHERE pc.product_id IN (SELECT value FROM json_each(?))
+        GROUP BY pc.product_id
+    ''', product_ids)
+
+    category_counts = {row[0]: row[1] for row in rows}
+    for product_id in product_ids:
+        category_counts.setdefault(product_id, 0)
+    return category_counts
+
+
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# One pass for a page: the page of products in /api/products order, joined
+# to its mappings; the total is counted once, and also returned for an
+# empty page through the outer LEFT JOIN. The count walks products in
+# product_int order, the order mapping rows are stored in, rather than
+# through a name index that would probe them at random.
+PRODUCT_PAGE_QUERY = '''
+    WITH page AS (
+        SELECT pc.product_int, pc.product_id, pc.product_name, pc.last_modified
+        FROM product_categories pc
+        {where}
+        ORDER BY LOWER(pc.product_name), pc.product_int
+        LIMIT ? OFFSET ?
+    )
+    SELECT totals.total, page.product_id, page.product_name, page.last_modified, ci.name
+    FROM (SELECT COUNT(*) AS total FROM product_categories pc NOT INDEXED {where}) AS totals
+    LEFT JOIN page ON 1
+    LEFT JOIN product_category_links l ON l.product_int = page.product_int
+    LEFT JOIN category_ids ci ON ci.category_int = l.category_int
+    ORDER BY LOWER(page.product_name), page.product_int, ci.name
+'''
+
+UNALLOCATED_FILTER = '''
+    WHERE NOT EXISTS (SELECT 1 FROM product_category_links l WHERE l.product_int = pc.product_int)
+'''
+
+
+def get_product_page(conn: sqlite3.Connection, limit: int = PAGE_LIMIT, offset: int = 0,
+                     hide_allocated: bool = False) -> dict:
+    """
+    A page of products with their categories resolved, for rendering a list.
+
+    Products come in /api/products order. Each carries its category count
+    and category objects (id, name, numeric level, parent and path from the
+    root) resolved from the taxonomy index, replacing separate bulk-categories,
+    bulk-categories-summary and per-product calls. Mapped ids missing from
+    the taxonomy are counted but not listed.
+    """
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ServiceError(f'limit must be between 1 and {MAX_PAGE_LIMIT}', {'limit': limit})
+    if offset < 0:
+        raise ServiceError('offset must not be negative', {'offset': offset})
+
+    where = UNALLOCATED_FILTER if hide_allocated else ''
+    rows = conn.execute(PRODUCT_PAGE_QUERY.format(where=where), (limit, offset))
+
+    index = get_category_index()
+    total = 0
+    products: Dict[str, dict] = {}
+    for total, product_id, product_name, last_modified, category_id in rows:
+        if product_id is None:
+            continue
+        product = products.get(product_id)
+        if product is None:
+            product = products[product_id] = {
+                'product_id': product_id,
+                'product_name': product_name,
+                'last_modified': last_modified,
+                'category_count': 0,
+                'has_allocations': False,
+                'categories': [],
+            }
+        if category_id is None:
+            continue
+        product['category_count'] += 1
+        product['has_allocations'] = True
+        category = index.resolve(category_id)
+        if category is not None:
+            product['categories'].append(category)
+
+    return {
+        'products': list(products.values()),
+        'total_products': total,
+        'limit': limit,
+        'offset': offset,
+        'hide_allocated': hide_allocated,
+    }
+
+
+def get_products_by_category(conn: sqlite3.Connection, category_id: str) -> List[dict]:
+    """Products assigned to a category, ordered by name"""
+    rows = conn.execute('''
+        SELECT pc.product_id, pc.product_name
+        FROM category_ids ci
+        JOIN product_category_links l ON l.category_int = ci.category_int
+        JOIN product_categories pc ON pc.product_int = l.product_int
+        WHERE ci.name = ?
+        ORDER BY pc.product_name
+    ''', (category_id,))
+    return [{'product_id': row[0], 'product_name': row[1]} for row in rows]
+
+
+# Bounds on a query expression, so one request cannot tie up a lane
+QUERY_MAX_DEPTH = 16
+QUERY_MAX_TERMS = 256
+
+
+def _evaluate_query(expression: Any, snapshot, index: CategoryIndex, budget: List[int], depth: int = 0):
+    """Evaluate one expression node against a bitmaps.Snapshot"""
+    budget[0] -= 1
+    if depth > QUERY_MAX_DEPTH or budget[0] < 0:
+        raise ServiceError('Query expression is too large', {
+            'max_depth': QUERY_MAX_DEPTH, 'max_terms': QUERY_MAX_TERMS
+        })
+    if isinstance(expression, str):
+        expression = {'category': expression}
+    if not isinstance(expression, dict) or len(expression.keys() - {'subtree'}) != 1:
+        raise ServiceError('Each query term needs exactly one of category, and, or, not',
+                           {'term': expression})
+
+    if 'category' in expression:
+        name = expression['category']
+        if not isinstance(name, str) or name not in index:
+            raise NotFoundError('Category not found', {'category': name})
+        if expression.get('subtree'):
+            return snapshot.union(snapshot.category(n) for n in [name] + index.descendants(name))
+        return snapshot.category(name)
+    if 'subtree' in expression:
+        raise ServiceError('subtree only applies to a category term', {'term': expression})
+
+    if 'not' in expression:
+        return snapshot.difference(snapshot.universe, [
+            _evaluate_query(expression['not'], snapshot, index, budget, depth + 1)
+        ])
+
+    operator, terms = next(iter(expression.items()))
+    if operator not in ('and', 'or'):
+        raise ServiceError('Each query term needs exactly one of category, and, or, not',
+                           {'term': expression})
+    if not isinstance(terms, list) or not terms:
+        raise ServiceError(f'{operator} needs a non-empty list of terms', {'term': expression})
+    if operator == 'or':
+        return snapshot.union(_evaluate_query(t, snapshot, index, budget, depth + 1) for t in terms)
+
+    # "A and not B" subtracts B rather than intersecting with its complement
+    included, excluded = [], []
+    for term in terms:
+        if isinstance(term, dict) and len(term) == 1 and 'not' in term:
+            excluded.append(_evaluate_query(term['not'], snapshot, index, budget, depth + 2))
+        else:
+            included.append(_evaluate_query(term, snapshot, index, budget, depth + 1))
+    return snapshot.difference(snapshot.intersection(included), excluded)
+
+
+def query_products(conn: sqlite3.Connection, expression: Any, limit: int = PAGE_LIMIT, offset: int = 0,
+                   count_only: bool = False) -> dict:
+    """
+    Products matching a boolean expression over categories.
+
+    A term is a category name, {"category": name} (with "subtree": true to
+    include every category below it), {"and": [terms]}, {"or": [terms]} or
+    {"not": term}. For example, products in Tile Adhesives and
+    Waterproofing but not Primers:
+
+        {"and": ["Tile Adhesives", "Waterproofing", {"not": "Primers"}]}
+
+    Evaluated over in-memory category bitmaps (see bitmaps.py). Returns the
+    match count and, unless count_only, one page of matching products in
+    ordinal (insertion) order.
+    """
+    import bitmaps
+
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ServiceError(f'limit must be between 1 and {MAX_PAGE_LIMIT}', {'limit': limit})
+    if offset < 0:
+        raise ServiceError('offset must not be negative', {'offset': offset})
+
+    snapshot = bitmaps.index.snapshot(conn)
+    matches = _evaluate_query(expression, snapshot, get_category_index(), [QUERY_MAX_TERMS])
+    result = {'count': bitmaps.count(matches), 'limit': limit, 'offset': offset}
+    if count_only:
+        return result
+
+    page = bitmaps.ordinals(matches, offset, limit)
+    rows = conn.execute('''
+        SELECT product_id, product_name FROM product_categories
+        WHERE product_int IN (SELECT value FROM json_each(?))
+        ORDER BY product_int
+    ''', (json.dumps(page),))
+    result['products'] = [{'product_id': row[0], 'product_name': row[1]} for row in rows]
+    return result
+
+
+# Assignments
+
+def expand_with_ancestors(category_ids: Iterable[str], index: CategoryIndex) -> Tuple[Set[str], Set[str]]:
+    """Return (all categories to add, inherited parent categories) for a selection"""
+    parent_categories: Set[str] = set()
+    for category_id in category_ids:
+        parent_categories.update(index.ancestors(category_id))
+    return set(category_ids) | parent_categories, parent_categories
+
+
+@admission.interactive
+def assign_categories(conn: sqlite3.Connection, product_id: str, category_ids: List[str]) -> dict:
+    """Assign categories, plus all their ancestors, to a single product"""
+    if not category_ids:
+        raise ServiceError('No categories provided')
+
+    categories_to_add, parent_categories = expand_with_ancestors(category_ids, get_category_index())
+
+    def write() -> List[str]:
+        current_categories = set(get_product_category_ids(conn, product_id))
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_id = ?
+        ''', (product_id,))
+
+        added_categories = []
+        new_categories = [cid for cid in categories_to_add if cid not in current_categories]
+        database.intern_categories(conn, new_categories)
+        for category_id in new_categories:
+            cursor.execute('''
+                INSERT OR IGNORE INTO product_category_links (product_int, category_int)
+                SELECT pc.product_int, ci.category_int
+                FROM product_categories pc, category_ids ci
+                WHERE pc.product_id = ? AND ci.name = ?
+            ''', (product_id, category_id))
+            if cursor.rowcount:
+                added_categories.append(category_id)
+
+        if added_categories:
+            changefeed.record(conn, changefeed.mapping_event(conn, [product_id], added=added_categories))
+        invalidation.bump(conn, 'products')
+        return added_categories
+
+    added_categories = write_transaction(conn, write, 'assign_categories')
+    invalidation.notify()
+
+    return {
+        'added_categories': added_categories,
+        'parent_categories_added': len(parent_categories - set(category_ids)),
+        'total_categories': len(categories_to_add),
+        'categories': get_product_category_ids(conn, product_id)
+    }
+
+
+@admission.interactive
+def remove_category(conn: sqlite3.Connection, product_id: str, category_id: str) -> int:
+    """Remove one category from a product; returns the number of mappings removed"""
+    def write() -> int:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_id = ?
+        ''', (product_id,))
+        cursor.execute('''
+            DELETE FROM product_category_links
+            WHERE product_int = (SELECT product_int FROM product_categories WHERE product_id = ?)
+              AND category_int = (SELECT category_int FROM category_ids WHERE name = ?)
+        ''', (product_id, category_id))
+        removed = cursor.rowcount
+        if removed:
+            changefeed.record(conn, changefeed.mapping_event(conn, [product_id], removed=[category_id]))
+        invalidation.bump(conn, 'products')
+        return removed
+
+    removed = write_transaction(conn, write, 'remove_category')
+    invalidation.notify()
+    return removed
+
+
+def _write_chunks(conn: sqlite3.Connection, product_ids: List[str], apply: Callable[[list], Dict[str, int]],
+                  operation: str, pacer: Optional[admission.Ticket]) -> Dict[str, int]:
+    """
+    Run apply(chunk) over product_ids and sum the counts it returns.
+
+    Without a pacer every chunk goes into one transaction; with one, each
+    chunk is its own transaction followed by pacer.step(rows written).
+    """
+    totals: Dict[str, int] = {}
+
+    def add(counts: Dict[str, int]):
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+    if pacer is None:
+        def write_all() -> List[Dict[str, int]]:
+            return [apply(chunk) for chunk in id_chunks(product_ids)]
+
+        for counts in write_transaction(conn, write_all, operation):
+            add(counts)
+        return totals
+
+    for chunk in id_chunks(product_ids, pacer.chunk_size):
+        counts = write_transaction(conn, lambda: apply(chunk), operation)
+        add(counts)
+        pacer.step(sum(counts.values()))
+    return totals
+
+
+def bulk_assign_categories(conn: sqlite3.Connection, product_ids: List[str], category_ids: List[str],
+                           require_known: bool = False, pacer: Optional[admission.Ticket] = None) -> dict:
+    """
+    Assign categories, plus their ancestors, to many products at once.
+
+    Mappings are written with set-based INSERT ... SELECT statements over the
+    JSON-encoded id lists. With require_known, unknown categories are an
+    error rather than being skipped for ancestor expansion.
+
+    Without a pacer the whole operation is one transaction. With one (an
+    admission ticket), every pacer.chunk_size products are committed
+    separately and paced, so other writers get the lock in between; a failed
+    run keeps the chunks already committed and can simply be retried.
+    """
+    if not product_ids:
+        raise ServiceError('No products provided')
+    if not category_ids:
+        raise ServiceError('No categories provided')
+
+    index = get_category_index()
+    if require_known:
+        for category_id in category_ids:
+            if category_id not in index:
+                raise NotFoundError(f"Category {category_id} not found", {'category_id': category_id})
+
+    all_categories, parent_categories = expand_with_ancestors(category_ids, index)
+    selected_only = [cid for cid in dict.fromkeys(category_ids) if cid not in parent_categories]
+
+    # RETURNING yields only the rows actually inserted, for the change feed
+    insert_sql = '''
+        INSERT OR IGNORE INTO product_category_links (product_int, category_int)
+        SELECT pc.product_int, ci.category_int
+        FROM product_categories pc, category_ids ci
+        WHERE ci.name IN (SELECT value FROM json_each(?))
+          AND pc.product_id IN (SELECT value FROM json_each(?))
+        RETURNING product_int, category_int
+    '''
+
+    def apply(chunk: list) -> Dict[str, int]:
+        cursor = conn.cursor()
+        chunk_json = json.dumps(chunk)
+        counts = {'categories_added': 0, 'parent_categories_added': 0, 'products_updated': 0}
+        database.intern_categories(conn, all_categories)
+        added = []
+        if parent_categories:
+            rows = cursor.execute(insert_sql, (json.dumps(sorted(parent_categories)), chunk_json)).fetchall()
+            counts['parent_categories_added'] = len(rows)
+            added.extend(rows)
+        if selected_only:
+            rows = cursor.execute(insert_sql, (json.dumps(selected_only), chunk_json)).fetchall()
+            counts['categories_added'] = len(rows)
+            added.extend(rows)
+        for event in changefeed.link_events(conn, added, 'added'):
+            changefeed.record(conn, event)
+
+        cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_id IN (SELECT value FROM json_each(?))
+        ''', (chunk_json,))
+        counts['products_updated'] = cursor.rowcount
+        invalidation.bump(conn, 'products')
+        return counts
+
+    totals = _write_chunks(conn, product_ids, apply, 'bulk_assign_categories', pacer)
+    invalidation.notify()
+
+    return {
+        'total_products': len(product_ids),
+        'total_categories': len(category_ids),
+        'categories_added': totals.get('categories_added', 0) + totals.get('parent_categories_added', 0),
+        'parent_categories_added': totals.get('parent_categories_added', 0),
+        'products_updated': totals.get('products_updated', 0)
+    }
+
+
+def bulk_remove_categories(conn: sqlite3.Connection, product_ids: List[str], category_ids: List[str],
+                           pacer: Optional[admission.Ticket] = None) -> dict:
+    """Remove categories from many products at once; pacer as for bulk_assign_categories"""
+    if not product_ids:
+        raise ServiceError('No products provided')
+    if not category_ids:
+        raise ServiceError('No categories provided')
+
+    categories_json = json.dumps(list(dict.fromkeys(category_ids)))
+
+    def apply(chunk: list) -> Dict[str, int]:
+        cursor = conn.cursor()
+        chunk_json = json.dumps(chunk)
+
+        # Touch only products that actually lose a category
+        affected = [row[0] for row in cursor.execute('''
+            SELECT pc.product_id FROM product_categories pc
+            WHERE pc.product_id IN (SELECT value FROM json_each(?))
+              AND EXISTS (
+                  SELECT 1 FROM product_category_links l
+                  WHERE l.product_int = pc.product_int AND l.category_int IN (
+                      SELECT category_int FROM category_ids WHERE name IN (SELECT value FROM json_each(?))
+                  )
+              )
+        ''', (chunk_json, categories_json))]
+        if not affected:
+            return {}
+
+        cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(affected),))
+        products_updated = cursor.rowcount
+
+        removed = cursor.execute('''
+            DELETE FROM product_category_links
+            WHERE product_int IN (
+                SELECT product_int FROM product_categories WHERE product_id IN (SELECT value FROM json_each(?))
+            ) AND category_int IN (
+                SELECT category_int FROM category_ids WHERE name IN (SELECT value FROM json_each(?))
+            )
+            RETURNING product_int, category_int
+        ''', (chunk_json, categories_json)).fetchall()
+        categories_removed = len(removed)
+        for event in changefeed.link_events(conn, removed, 'removed'):
+            changefeed.record(conn, event)
+        invalidation.bump(conn, 'products')
+        return {'categories_removed': categories_removed, 'products_updated': products_updated}
+
+    totals = _write_chunks(conn, product_ids, apply, 'bulk_remove_categories', pacer)
+    invalidation.notify()
+
+    return {
+        'total_products': len(product_ids),
+        'total_categories': len(category_ids),
+        'categories_removed': totals.get('categories_removed', 0),
+        'products_updated': totals.get('products_updated', 0)
+    }
+
+
+# Export
+
+EXPORT_QUERY = '''
+    SELECT pc.product_id, pc.product_name,
+           COALESCE(GROUP_CONCAT(ci.name, ','), '') AS category_ids
+    FROM product_categories pc
+    LEFT JOIN product_category_links l ON l.product_int = pc.product_int
+    LEFT JOIN category_ids ci ON ci.category_int = l.category_int
+    GROUP BY pc.product_id
+    ORDER BY LOWER(pc.product_name)
+'''
+
+
+def export_csv_bytes(conn: sqlite3.Connection) -> bytes:
+    """Build the complete CSV export, recording how long it took"""
+    with metrics.EXPORT_DURATION.time():
+        return ''.join(iter_export_csv(conn)).encode('utf-8')
+
+
+def iter_export_csv(conn: sqlite3.Connection) -> Iterator[str]:
+    """Yield the product categories CSV export line by line"""
+    yield 'product_id,product_name,categories\n'
+
+    valid_categories = get_category_index().by_name
+    for row in conn.execute(EXPORT_QUERY):
+        category_ids = row['category_ids'].split(',') if row['category_ids'] else []
+
+        # Only categories that still exist in the taxonomy, in name order
+        formatted_categories = sorted(cat_id for cat_id in category_ids if cat_id in valid_categories)
+
+        # Proper CSV escaping, all categories in a single cell
+        product_id = row["product_id"].replace('"', '""')
+        product_name = row["product_name"].replace('"', '""')
+        cats = ", ".join(c.replace('"', '""') for c in formatted_categories) if formatted_categories else "No Categories"
+
+        yield f'"{product_id}","{product_name}","{cats}"\n'
+
+
+# Categories
+
+def _write_category_file(categories: List[dict]):
+    """
+    Atomically replace category.json so readers never see a partial file.
+
+    Category writers call this as the last step of their write transaction:
+    if anything before it fails, neither the file nor the database has
+    changed, and other writers, holding off on the write lock, never see the
+    file ahead of the database.
+    """
+    directory = os.path.dirname(os.path.abspath(database.CATEGORY_FILE))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.category-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(categories, f, indent=2)
+        os.replace(tmp_path, database.CATEGORY_FILE)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _category_parent_column(conn: sqlite3.Connection) -> Optional[str]:
+    """The categories table's parent column, whichever schema it has, or None"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(categories)")}
+    if {'name', 'level', 'parent_id'} <= columns:
+        return 'parent_id'
+    if {'category_level', 'connected_to'} <= columns:
+        return 'connected_to'
+    return None
+
+
+def _sync_category_rows(conn: sqlite3.Connection, categories: List[dict], names: Iterable[str]):
+    """
+    Mirror some categories into the categories table. Ancestors are written
+    first, so a parent_id always names an existing row, and rows are
+    upserted rather than replaced, so rows pointing at them stay valid.
+    """
+    parent_column = _category_parent_column(conn)
+    if parent_column is None:
+        return
+    by_name = {cat['category_name']: cat for cat in categories}
+    ordered: List[dict] = []
+    seen: Set[str] = set()
+
+    def visit(name: Optional[str]):
+        if name in seen or name not in by_name:
+            return
+        seen.add(name)
+        visit(by_name[name].get('connected_to'))
+        ordered.append(by_name[name])
+
+    for name in names:
+        visit(name)
+
+    for category in ordered:
+        if parent_column == 'parent_id':
+            conn.execute('''
+                INSERT INTO categories (id, name, level, parent_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = excluded.name, level = excluded.level,
+                    parent_id = excluded.parent_id, updated_at = CURRENT_TIMESTAMP
+            ''', (category['category_name'], category['category_name'],
+                  int(category['category_level'].split()[1]), category.get('connected_to')))
+        else:
+            conn.execute('''
+                INSERT INTO categories (id, category_level, connected_to)
+                VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    category_level = excluded.category_level, connected_to = excluded.connected_to
+            ''', (category['category_name'], category['category_level'], category.get('connected_to')))
+
+
+def _drop_renamed_category_row(conn: sqlite3.Connection, name: str, new_name: str):
+    """Point rows still naming a renamed category at its new row, then drop the old one"""
+    parent_column = _category_parent_column(conn)
+    if parent_column is None:
+        return
+    conn.execute(f'UPDATE categories SET {parent_column} = ? WHERE {parent_column} = ?', (new_name, name))
+    conn.execute('DELETE FROM categories WHERE id = ?', (name,))
+
+
+@admission.interactive
+def create_category(conn: sqlite3.Connection, name: str, level: int, parent_id: Optional[str] = None) -> dict:
+    """Add a category to category.json and mirror it into the database"""
+    if level not in [1, 2, 3]:
+        raise ServiceError('Invalid category level')
+    if level > 1 and not parent_id:
+        raise ServiceError('Parent category required for level 2 and 3 categories')
+
+    index = get_category_index()
+    existing_category = index.get(name)
+    if existing_category:
+        raise ServiceError('Category name already exists', {
+            'existing_category': {
+                'name': existing_category['category_name'],
+                'level': existing_category['category_level'],
+                'parent': existing_category['connected_to']
+            },
+            'attempted_category': {
+                'name': name,
+                'level': f'Level {level} Category',
+                'parent': parent_id
+            }
+        })
+
+    new_category = {
+        'category_name': name,
+        'category_level': f'Level {level} Category',
+        'connected_to': parent_id if level > 1 else None
+    }
+    # Incremental closure updates assume it matches the taxonomy they start from
+    rollups.ensure_current(conn, index)
+    categories = index.categories + [new_category]
+
+    def write():
+        _sync_category_rows(conn, categories, [name])
+        rollups.add_category(conn, name, new_category['connected_to'], categories)
+        changefeed.record(conn, {'type': 'taxonomy', 'created': name})
+        invalidation.bump(conn, 'taxonomy', 'products')
+        _write_category_file(categories)
+
+    write_transaction(conn, write, 'create_category')
+    invalidation.notify()
+
+    return new_category
+
+
+@admission.interactive
+def delete_category(conn: sqlite3.Connection, category_name: str) -> dict:
+    """Delete a leaf category and remove it from every product"""
+    index = get_category_index()
+    category_to_delete = index.get(category_name)
+    if not category_to_delete:
+        raise NotFoundError('Category not found', {'category': category_name})
+
+    child_names = index.child_names(category_name)
+    if child_names:
+        raise ServiceError('Cannot delete category with child categories', {
+            'category': category_name,
+            'child_categories': child_names,
+            'message': 'Please delete all child categories first'
+        })
+
+    rollups.ensure_current(conn, index)
+    remaining = [cat for cat in index.categories if cat['category_name'] != category_name]
+
+    def write() -> Tuple[int, int]:
+        cursor = conn.cursor()
+        category_int = database.category_int(conn, category_name)
+        affected = [row[0] for row in cursor.execute('''
+            SELECT pc.product_id
+            FROM product_category_links l JOIN product_categories pc ON pc.product_int = l.product_int
+            WHERE l.category_int = ?
+        ''', (category_int,))]
+
+        # Touch affected products before their mappings disappear
+        cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(affected),))
+
+        cursor.execute('DELETE FROM product_category_links WHERE category_int = ?', (category_int,))
+        removed_from_products = cursor.rowcount
+        if affected:
+            changefeed.record(conn, changefeed.mapping_event(conn, affected, removed=[category_name]))
+
+        cursor.execute('DELETE FROM categories WHERE id = ?', (category_name,))
+        removed_from_categories = cursor.rowcount
+
+        rollups.remove_category(conn, category_name, remaining)
+        changefeed.record(conn, {'type': 'taxonomy', 'deleted': category_name})
+        invalidation.bump(conn, 'taxonomy', 'products')
+        _write_category_file(remaining)
+        return removed_from_products, removed_from_categories
+
+    removed_from_products, removed_from_categories = write_transaction(conn, write, 'delete_category')
+    invalidation.notify()
+
+    return {
+        'category': category_to_delete,
+        'removed_from_products': removed_from_products,
+        'removed_from_categories_table': removed_from_categories
+    }
+
+
+def _updated_taxonomy(index: CategoryIndex, category_name: str, new_name: str,
+                      new_parent: Optional[str], level_shift: int) -> List[dict]:
+    """category.json entries after a rename and/or move, other keys kept as they are"""
+    subtree = {category_name, *index.descendants(category_name)}
+    categories = []
+    for cat in index.categories:
+        cat = dict(cat)
+        name = cat['category_name']
+        if name == category_name:
+            cat['category_name'] = new_name
+            cat['connected_to'] = new_parent
+        elif cat.get('connected_to') == category_name:
+            cat['connected_to'] = new_name
+        if level_shift and name in subtree:
+            cat['category_level'] = f'Level {index.level(name) + level_shift} Category'
+        categories.append(cat)
+    return categories
+
+
+@admission.interactive
+def update_category(conn: sqlite3.Connection, category_name: str, changes: dict) -> dict:
+    """
+    Rename a category and/or move it, with everything below it, under
+    another parent.
+
+    changes holds the CategoryUpdateRequest fields that were sent: name,
+    parent_id (None moves the category to the top level) and level, which
+    only has to agree with where the category ends up. A rename rewrites no
+    mapping rows, as they refer to the category by category_int. A move
+    takes the old ancestors off every product mapped anywhere in the
+    subtree, unless another of its categories still lies below them, and
+    adds the new ancestors. Everything, category.json included, is done in
+    one transaction of set-based statements, with counts of the work done
+    returned.
+    """
+    index = get_category_index()
+    category = index.get(category_name)
+    if not category:
+        raise NotFoundError('Category not found', {'category': category_name})
+    if not changes:
+        raise ServiceError('Nothing to update', {'category': category_name})
+
+    new_name = (changes.get('name') or category_name).strip()
+    if new_name != category_name and new_name in index:
+        raise ServiceError('Category name already exists', {'category': category_name, 'name': new_name})
+
+    old_parent = category.get('connected_to') or None
+    new_parent = (changes['parent_id'] or None) if 'parent_id' in changes else old_parent
+    if 'parent_id' not in changes and changes.get('level') == 1:
+        new_parent = None
+    subtree = [category_name] + index.descendants(category_name)
+    if new_parent is not None:
+        if new_parent not in index:
+            raise NotFoundError('Parent category not found', {'parent_id': new_parent})
+        if new_parent in subtree:
+            raise ServiceError('Cannot move a category below itself', {
+                'category': category_name, 'parent_id': new_parent
+            })
+
+    old_level = index.level(category_name)
+    new_level = index.level(new_parent) + 1 if new_parent is not None else 1
+    if changes.get('level') is not None and changes['level'] != new_level:
+        raise ServiceError(f'A category under this parent is at level {new_level}', {
+            'level': changes['level'], 'parent_id': new_parent
+        })
+    level_shift = new_level - old_level
+    deepest = max(index.level(name) for name in subtree) + level_shift
+    if deepest > len(LEVEL_NAMES):
+        raise ServiceError(f'Moving this category would put categories below level {len(LEVEL_NAMES)}', {
+            'category': category_name, 'parent_id': new_parent
+        })
+
+    renamed = new_name != category_name
+    moved = new_parent != old_parent
+    stats = {
+        'subtree_categories': len(subtree),
+        'products_affected': 0,
+        'inherited_mappings_removed': 0,
+        'inherited_mappings_added': 0,
+    }
+    if not (renamed or moved):
+        return {'category': category, 'previous': category, **stats}
+
+    categories = _updated_taxonomy(index, category_name, new_name, new_parent, level_shift)
+    old_ancestors = index.ancestors(category_name)
+    new_ancestors = [new_parent] + index.ancestors(new_parent) if new_parent is not None else []
+
+    rollups.ensure_current(conn, index)
+
+    def write():
+        cursor = conn.cursor()
+        database.intern_categories(conn, subtree + old_ancestors + new_ancestors)
+        category_int = database.category_int(conn, category_name)
+        if renamed:
+            rollups.rename_category(conn, category_name, new_name, categories)
+
+        if moved:
+            # Every product mapped anywhere in the subtree inherits from its ancestors
+            affected = [row[0] for row in cursor.execute('''
+                SELECT DISTINCT l.product_int
+                FROM category_closure cl JOIN product_category_links l ON l.category_int = cl.descendant
+                WHERE cl.ancestor = ?
+            ''', (category_int,))]
+            affected_json = json.dumps(affected)
+            old_ints = [database.category_int(conn, name) for name in old_ancestors]
+            new_ints = [database.category_int(conn, name) for name in new_ancestors]
+
+            with rollups.suspended(conn):
+                rollups.move_category(conn, new_name, new_parent, categories)
+                # With the closure already moved, an old ancestor stays only
+                # where another mapping of the product still lies below it.
+                # Old ancestors don't count: they are deleted by this same
+                # statement, and one that stays is kept by a mapping below it.
+                cursor.execute('''
+                    DELETE FROM product_category_links
+                    WHERE category_int IN (SELECT value FROM json_each(?1))
+                      AND product_int IN (SELECT value FROM json_each(?2))
+                      AND NOT EXISTS (
+                          SELECT 1 FROM product_category_links other
+                          CROSS JOIN category_closure cl ON cl.descendant = other.category_int
+                          WHERE other.product_int = product_category_links.product_int
+                            AND cl.ancestor = product_category_links.category_int AND cl.depth > 0
+                            AND other.category_int NOT IN (SELECT value FROM json_each(?1))
+                      )
+                ''', (json.dumps(old_ints), affected_json))
+                stats['inherited_mappings_removed'] = cursor.rowcount
+                cursor.execute('''
+                    INSERT OR IGNORE INTO product_category_links (product_int, category_int)
+                    SELECT p.value, c.value FROM json_each(?1) p, json_each(?2) c
+                ''', (affected_json, json.dumps(new_ints)))
+                stats['inherited_mappings_added'] = cursor.rowcount
+            # Only the ancestors' mappings changed; the subtree keeps its counts
+            rollups.recount(conn, old_ints + new_ints, mappings_changed=True)
+        else:
+            affected = [row[0] for row in cursor.execute(
+                'SELECT product_int FROM product_category_links WHERE category_int = ?', (category_int,)
+            )]
+            affected_json = json.dumps(affected)
+
+        stats['products_affected'] = len(affected)
+        product_ids = [row[0] for row in cursor.execute('''
+            UPDATE product_categories
+            SET last_modified = CURRENT_TIMESTAMP
+            WHERE product_int IN (SELECT value FROM json_each(?))
+            RETURNING product_id
+        ''', (affected_json,))]
+        added = ([new_name] if renamed else []) + [name for name in new_ancestors if name not in old_ancestors]
+        removed = ([category_name] if renamed else []) + [name for name in old_ancestors if name not in new_ancestors]
+        if product_ids and (added or removed):
+            changefeed.record(conn, changefeed.mapping_event(conn, product_ids, added=added, removed=removed))
+
+        _sync_category_rows(conn, categories, [
+            cat['category_name'] for cat in categories
+            if cat['category_name'] == new_name or cat.get('connected_to') == new_name
+            or (level_shift and cat['category_name'] in subtree)
+        ])
+        if renamed:
+            _drop_renamed_category_row(conn, category_name, new_name)
+
+        changefeed.record(conn, {'type': 'taxonomy', 'updated': new_name, 'previous': category_name})
+        invalidation.bump(conn, 'taxonomy', 'products')
+        _write_category_file(categories)
+
+    write_transaction(conn, write, 'update_category')
+    invalidation.notify()
+
+    return {
+        'category': next(cat for cat in categories if cat['category_name'] == new_name),
+        'previous': category,
+        **stats
+    }
+
+
+def get_category_info(conn: sqlite3.Connection, category_name: str) -> dict:
+    """Category details with its product counts and direct children"""
+    index = get_category_index()
+    category = index.get(category_name)
+    if not category:
+        raise NotFoundError('Category not found', {'category': category_name})
+
+    rollups.ensure_current(conn, index)
+    row = conn.execute(
+        'SELECT direct_count, subtree_count FROM category_counts WHERE category_int = ?',
+        (database.category_int(conn, category_name),)
+    ).fetchone()
+    product_count, subtree_product_count = row or (0, 0)
+    child_categories = index.child_names(category_name)
+
+    return {
+        'name': category['category_name'],
+        'level': category['category_level'],
+        'parent': category.get('connected_to', 'None'),
+        'product_count': product_count,
+        'subtree_product_count': subtree_product_count,
+        'child_count': len(child_categories),
+        'child_categories': child_categories
+    }
+
+
+def get_category_tree(conn: sqlite3.Connection, root: Optional[str] = None,
+                      depth: Optional[int] = None) -> dict:
+    """
+    The category hierarchy as nested nodes, for loading a selector in one call.
+
+    Each node has its id, numeric level, direct and subtree product counts
+    (see rollups.py), child count and children. Without a root the top
+    level is every level 1 category; with one it is that category alone.
+    depth limits how many levels are returned, counting the top level as 1;
+    nodes at the limit keep their child_count but list no children.
+    """
+    index = get_category_index()
+    if depth is not None and depth < 1:
+        raise ServiceError('depth must be at least 1', {'depth': depth})
+    if root is not None:
+        if root not in index:
+            raise NotFoundError('Category not found', {'category': root})
+        top = [root]
+    else:
+        top = [cat['category_name'] for cat in index.categories
+               if LEVEL_NAMES.get(cat['category_level']) == 1]
+
+    product_counts = rollups.get_counts(conn)
+
+    node_count = 0
+    seen: Set[str] = set()
+
+    def node(name: str, remaining: Optional[int]) -> dict:
+        nonlocal node_count
+        node_count += 1
+        seen.add(name)
+        children = index.child_names(name)
+        counts = product_counts.get(name, (0, 0))
+        expand = remaining is None or remaining > 1
+        return {
+            'id': name,
+            'level': index.level(name),
+            'product_count': counts[0],
+            'subtree_product_count': counts[1],
+            'child_count': len(children),
+            'children': [
+                node(child, None if remaining is None else remaining - 1)
+                for child in children if child not in seen
+            ] if expand else [],
+        }
+
+    return {
+        'tree': [node(name, depth) for name in top if name not in seen],
+        'total_categories': node_count,
+        'root': root,
+        'depth': depth,
+    }
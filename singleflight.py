@@ -0,0 +1,126 @@
+"""
+Single-flight request coalescing for Tag Manager V2
+
+When many clients ask for the same expensive result at once (every open tab
+refreshing statistics after a bulk operation, say), only the first request
+computes it; the others wait for that computation and share its result or
+its exception. Results are not kept after the flight lands; the response
+caches take it from there.
+
+Routes opt in by name through SINGLE_FLIGHT_ROUTES (comma separated);
+calls for other routes run directly.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import metrics
+
+
+DEFAULT_ROUTES = 'products:statistics,products:categorization-status,export:csv'
+
+ROUTES = frozenset(
+    route.strip()
+    for route in os.environ.get('SINGLE_FLIGHT_ROUTES', DEFAULT_ROUTES).split(',')
+    if route.strip()
+)
+
+
+class _Call:
+    """A computation in progress and the requests waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares one in-flight computation among concurrent identical calls"""
+
+    def __init__(self, routes=ROUTES):
+        self.routes = set(routes)
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def enabled(self, route: str) -> bool:
+        return route in self.routes
+
+    def _count(self, route: str, leader: bool):
+        stats = self._stats.setdefault(route, {'requests': 0, 'executions': 0, 'coalesced': 0})
+        stats['requests'] += 1
+        stats['executions' if leader else 'coalesced'] += 1
+
+    def do(self, route: str, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn() once for all threads calling with the same route and key"""
+        if not self.enabled(route):
+            return fn()
+
+        flight_key = (route, key)
+        with self._lock:
+            call = self._calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._calls[flight_key] = _Call()
+            self._count(route, leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+
+    async def do_async(self, route: str, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() once for all tasks calling with the same route and key"""
+        if not self.enabled(route):
+            return await fn()
+
+        flight_key = (route, key)
+        with self._lock:
+            task = self._tasks.get(flight_key)
+            leader = task is None
+            if leader:
+                task = self._tasks[flight_key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._land(flight_key, task))
+            self._count(route, leader)
+
+        # A client disconnecting must not cancel the work the others wait for
+        return await asyncio.shield(task)
+
+    def _land(self, flight_key: Hashable, task: asyncio.Future):
+        with self._lock:
+            if self._tasks.get(flight_key) is task:
+                del self._tasks[flight_key]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            stats = {route: dict(values) for route, values in self._stats.items()}
+            for route, _ in list(self._calls) + list(self._tasks):
+                stats.setdefault(route, {'requests': 0, 'executions': 0, 'coalesced': 0})
+                stats[route]['in_flight'] = stats[route].get('in_flight', 0) + 1
+        for values in stats.values():
+            values.setdefault('in_flight', 0)
+        return stats
+
+
+flights = SingleFlight()
+
+metrics.register_collector(lambda: metrics.families_from_stats(
+    'single_flight', 'Request coalescing', 'route', flights.stats(),
+    counters=('requests', 'executions', 'coalesced')
+))
@@ -0,0 +1,234 @@
+"""
+Statement accounting for SQLite connections in Tag Manager V2
+
+database.connect() opens connections with TracedConnection, whose cursors
+add statement time and returned rows to the current request's metrics (see
+metrics.py). Outside a request they behave exactly like plain cursors.
+
+Time covers execute() (SQLite runs up to the first row there, which for
+sorted or aggregated queries is most of the work) and explicit fetch calls.
+Rows are counted without a Python call per row: iteration fetches
+ITER_BATCH rows at a time and adds each batch to the counts as a whole, so
+a loop that stops early counts the rest of its last batch.
+
+Each statement is also recorded with its duration and rows. When the request
+(or queued job) ends, statements that took SLOW_QUERY_MS or longer are
+logged to the `tag_manager.slow_query` logger with the request id, and every
+statement is added to per-statement totals keyed by its normalized text
+(literals replaced by ?, IN lists collapsed), reported by /api/stats.
+"""
+
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import metrics
+from metrics import current_request
+
+logger = logging.getLogger('tag_manager.slow_query')
+
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_MS', '200')) / 1000
+
+# Statements recorded per request; later ones still count towards the totals
+MAX_TRACES = 1000
+
+# Distinct normalized statements kept in the totals
+MAX_STATEMENTS = 500
+
+# Rows fetched at a time while a cursor is iterated inside a request
+ITER_BATCH = 256
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Statement text with literals as ? and whitespace collapsed, for grouping"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('?, ...', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class Trace:
+    """One executed statement: its text, time spent and rows returned"""
+
+    __slots__ = ('sql', 'seconds', 'rows')
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class TracedCursor(sqlite3.Cursor):
+    _trace = None
+
+    def _begin(self, request_metrics, sql: str):
+        if len(request_metrics.traces) < MAX_TRACES:
+            self._trace = Trace(sql)
+            request_metrics.traces.append(self._trace)
+        else:
+            self._trace = None
+
+    def _end(self, request_metrics, started: float):
+        elapsed = time.perf_counter() - started
+        request_metrics.db_seconds += elapsed
+        request_metrics.statements += 1
+        if self._trace is not None:
+            self._trace.seconds += elapsed
+
+    def execute(self, sql, parameters=()):
+        request_metrics = current_request.get()
+        if request_metrics is None:
+            return super().execute(sql, parameters)
+        self._begin(request_metrics, sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._end(request_metrics, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        request_metrics = current_request.get()
+        if request_metrics is None:
+            return super().executemany(sql, seq_of_parameters)
+        self._begin(request_metrics, sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._end(request_metrics, started)
+
+    def _fetch(self, fetch, *args):
+        request_metrics = current_request.get()
+        if request_metrics is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        rows = fetch(*args)
+        elapsed = time.perf_counter() - started
+        request_metrics.db_seconds += elapsed
+        if self._trace is not None:
+            self._trace.seconds += elapsed
+        return rows
+
+    def _count(self, rows: int):
+        request_metrics = current_request.get()
+        if request_metrics is not None:
+            request_metrics.rows += rows
+            if self._trace is not None:
+                self._trace.rows += rows
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        self._count(len(rows))
+        return rows
+
+    def __iter__(self):
+        request_metrics = current_request.get()
+        if request_metrics is None:
+            return self
+        # Bound now, as a streamed response may be iterated outside the request's context
+        return self._iterate(request_metrics, self._trace)
+
+    def _iterate(self, request_metrics, trace: Trace):
+        fetchmany = super().fetchmany
+        while True:
+            rows = fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            request_metrics.rows += len(rows)
+            if trace is not None:
+                trace.rows += len(rows)
+            yield from rows
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose cursors report to the current request"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute would create a plain cursor, bypassing cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class StatementStats:
+    """Calls, time and rows per normalized statement in this process"""
+
+    def __init__(self, max_statements: int = MAX_STATEMENTS):
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}
+        self.slow = 0
+
+    def record(self, traces: List[Trace], label: str, request_id: str):
+        entries = []
+        for trace in traces:
+            rows = trace.rows
+            if trace.seconds >= SLOW_QUERY_SECONDS:
+                logger.warning('Slow query (%.1f ms, %d rows) in %s [%s]: %s',
+                               trace.seconds * 1000, rows, label, request_id, normalize(trace.sql))
+            entries.append((normalize(trace.sql), trace.seconds, rows))
+        with self._lock:
+            for sql, seconds, rows in entries:
+                stats = self._stats.get(sql)
+                if stats is None:
+                    if len(self._stats) >= self.max_statements:
+                        continue
+                    # calls, seconds, max seconds, rows, slow calls
+                    stats = self._stats[sql] = [0, 0.0, 0.0, 0, 0]
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+                stats[3] += rows
+                if seconds >= SLOW_QUERY_SECONDS:
+                    stats[4] += 1
+                    self.slow += 1
+
+    def stats(self, limit: int = 20) -> List[dict]:
+        """The statements with the most total time"""
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [
+            {
+                'statement': sql,
+                'calls': calls,
+                'total_ms': round(seconds * 1000, 3),
+                'mean_ms': round(seconds * 1000 / calls, 3),
+                'max_ms': round(max_seconds * 1000, 3),
+                'rows': rows,
+                'slow': slow,
+            }
+            for sql, (calls, seconds, max_seconds, rows, slow) in items
+        ]
+
+
+statement_stats = StatementStats()
+
+metrics.on_request_end(
+    lambda request_metrics, label: statement_stats.record(request_metrics.traces, label, request_metrics.request_id)
+)
@@ -1,6 +1,10 @@
 // Enhanced bulk assignment with persistent state management
 import { appState } from './appState.js';
-import { updateCategorySelectionSummary } from './modules/categoryTree.js';
+import {
+    updateCategorySelectionSummary, updateCurrentCategoriesDisplayForProducts,
+    updateCurrentCategoriesDisplayForAllVisibleProducts
+} from './modules/categoryTree.js';
+import { loadProductCatalog, getCategoryCount, watchProductCatalog } from './modules/productCatalog.js';
 
 // Add event listener for refreshing category display
 document.addEventListener('refreshCategoryDisplay', async () => {
@@ -74,9 +78,36 @@ document.addEventListener('DOMContentLoaded', async () => {
     await loadAllCategories();
     await loadProducts();
     setupEventListeners();
+    watchProductChanges();
     restorePageState(); // Restore previous state
 });
 
+// Changes pushed by the server update the list in place; nothing is refetched on a timer
+function watchProductChanges() {
+    return watchProductCatalog({
+        onProductsChanged: async (productIds) => {
+            if (categoryFilter.value !== 'all') {
+                // A change can move products in or out of the current filter
+                await applyProductFilters();
+            } else {
+                await updateCurrentCategoriesDisplayForProducts(productIds);
+            }
+        },
+        onTaxonomyChanged: async (change) => {
+            await loadAllCategories();
+            // A rename or move changes category names and levels on every product
+            if (change.updated) {
+                await loadProducts();
+                await applyProductFilters();
+            }
+        },
+        onReset: async () => {
+            await loadProducts();
+            await applyProductFilters();
+        }
+    });
+}
+
 // Restore previous page state from appState
 function restorePageState() {
     try {
@@ -113,43 +144,15 @@ function restorePageState() {
     }
 }
 
-// New function to get category counts efficiently
-async function getCategoryCounts(productIds) {
-    if (productIds.length === 0) return {};
-    
-    try {
-        const response = await fetch('/api/products/bulk-categories-summary', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ product_ids: productIds })
-        });
-        
-        if (!response.ok) {
-            throw new Error('Failed to fetch category counts');
-        }
-        
-        return await response.json();
-    } catch (error) {
-        console.error('Error fetching category counts:', error);
-        showError('Failed to load category counts');
-        return {};
-    }
-}
-
 // --- Product Loading and Rendering ---
 async function loadProducts() {
     showLoadingOverlay(true, 'Loading products...');
     try {
-        const response = await fetch('/api/products');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        products = await response.json();
+        // Products arrive with their categories, so rendering them needs no further requests
+        products = await loadProductCatalog();
         filteredProducts = [...products]; // Initialize filteredProducts
         renderProducts(filteredProducts);
-        await updateCurrentCategoriesDisplayForAllVisibleProducts(); // Fetch categories for initially loaded products
+        await updateCurrentCategoriesDisplayForAllVisibleProducts();
     } catch (error) {
         console.error('Failed to load products:', error);
         showError('Failed to load products. Please try again.');
@@ -361,40 +364,22 @@ async function applyProductFilters() {
         );
     }
     
-    // Apply category filter
+    // Apply category filter, using the category counts loaded with the product pages
     if (categoryFilterValue !== 'all') {
-        try {
-            // Get category data for all products that passed search filter
-            const productIds = filtered.map(p => p.product_id);
-            const response = await fetch('/api/products/bulk-categories', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ product_ids: productIds })
-            });
+        filtered = filtered.filter(product => {
+            const categoryCount = getCategoryCount(product.product_id);
             
-            if (response.ok) {
-                const categoryData = await response.json();
-                
-                filtered = filtered.filter(product => {
-                    const productCategories = categoryData[product.product_id] || [];
-                    const categoryCount = productCategories.length;
-                    
-                    switch (categoryFilterValue) {
-                        case 'uncategorized':
-                            return categoryCount === 0;
-                        case 'categorized':
-                            return categoryCount > 0;
-                        case 'multi-category':
-                            return categoryCount > 1;
-                        default:
-                            return true;
-                    }
-                });
+            switch (categoryFilterValue) {
+                case 'uncategorized':
+                    return categoryCount === 0;
+                case 'categorized':
+                    return categoryCount > 0;
+                case 'multi-category':
+                    return categoryCount > 1;
+                default:
+                    return true;
             }
-        } catch (error) {
-            console.error('Error applying category filter:', error);
-            showError('Failed to apply category filter');
-        }
+        });
     }
     
     filteredProducts = filtered;
@@ -464,8 +449,8 @@ async function handleAssignCategory() {
         const result = await response.json();
         showSuccess(result.message || 'Categories assigned successfully!');
         
-        // Update category display for the affected products
-        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts));
+        // Refetch the affected products' categories and redisplay them
+        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts), { refresh: true });
 
         // Clear selections
         clearAllSelections();
@@ -513,8 +498,8 @@ async function handleRemoveCategory() {
         const result = await response.json();
         showSuccess(result.message || 'Categories removed successfully!');
         
-        // Update category display for the affected products
-        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts));
+        // Refetch the affected products' categories and redisplay them
+        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts), { refresh: true });
 
         // Clear selections
         clearAllSelections();
@@ -868,62 +853,6 @@ window.removeCategoryFromSelection = function(categoryId) {
     updateSelectionDisplay();
 };
 
-// Function to update current categories display for specific products
-async function updateCurrentCategoriesDisplayForProducts(productIdsToUpdate) {
-    if (!productIdsToUpdate || productIdsToUpdate.length === 0) return;
-
-    // Use the /api/products/bulk-categories endpoint
-    try {
-        const response = await fetch('/api/products/bulk-categories', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ product_ids: productIdsToUpdate })
-        });
-        if (!response.ok) {
-            throw new Error('Failed to fetch bulk category details');
-        }
-        const productsCategoriesMap = await response.json(); // Expects { product_id: [{id, name, level, parent}, ...], ... }
-
-        productIdsToUpdate.forEach(productId => {
-            const cellId = `product-cats-${productId}`;
-            const cell = document.getElementById(cellId);
-            if (cell) {
-                const categoriesForProduct = productsCategoriesMap[productId] || [];
-                if (categoriesForProduct.length > 0) {
-                    // Display as small chips
-                    cell.innerHTML = categoriesForProduct.map(cat => {
-                        let bgColor = 'bg-brand-grey-medium'; // Default
-                        if (cat.level === 1) bgColor = 'bg-blue-500';
-                        else if (cat.level === 2) bgColor = 'bg-red-500';
-                        else if (cat.level === 3) bgColor = 'bg-green-500';
-                        return `<span class="inline-block ${bgColor} text-brand-white text-xs font-semibold px-2 py-2 rounded-full mb-1 mr-1 mt-1 ml-1">${cat.name}</span>`;
-                    }).join('');
-                } else {
-                    cell.textContent = 'No categories assigned.';
-                }
-            }
-        });
-    } catch (error) {
-        console.error('Error updating current categories display:', error);
-        showError('Could not update product categories.');
-        // Optionally set cell text to an error message for affected products
-        productIdsToUpdate.forEach(productId => {
-            const cell = document.getElementById(`product-cats-${productId}`);
-            if (cell) cell.textContent = 'Error loading categories.';
-        });
-    }
-}
-
-// Helper to update categories for all currently visible products in the table
-async function updateCurrentCategoriesDisplayForAllVisibleProducts() {
-    const visibleProductIds = Array.from(productList.querySelectorAll('tr[data-product-id]'))
-                                   .map(tr => tr.dataset.productId)
-                                   .filter(id => id); // Filter out any undefined/null IDs
-    if (visibleProductIds.length > 0) {
-        await updateCurrentCategoriesDisplayForProducts(visibleProductIds);
-    }
-}
-
 // --- End Category Display & API Calls ---
 
 // --- UI Utility Functions ---
@@ -15,7 +15,7 @@ import {
     showSuccessMessage, showErrorMessage
 } from '../uiHandlers.js';
 import { updateCategorySelectionSummary, updateCurrentCategoriesDisplayForProducts, expandAllCategories, collapseAllCategories, loadAllCategories, loadCategoryChildren, toggleCategoryNode } from '../modules/categoryTree.js';
-import { applyProductFilters } from '../modules/productFilter.js';
+import { applyProductFilters, watchProductChanges } from '../modules/productFilter.js';
 import { showLoadingOverlay, showError, showSuccess } from '../utils/ui.js';
 import { debouncedRefreshAllStatistics } from '../utils/statisticsManager.js';
 
@@ -127,6 +127,9 @@ export function setupBulkPageEventListeners() {
 
     // Subscribe to appState changes
     appState.subscribe(handleStateChange);
+
+    // Follow other editors' changes over the server's change feed
+    watchProductChanges();
 }
 
 async function handleAssignCategory() {
@@ -155,8 +158,8 @@ async function handleAssignCategory() {
         const result = await response.json();
         showSuccess(result.message || 'Categories assigned successfully!'); // Use imported showSuccess
         
-        // Update category display for the affected products
-        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts));
+        // Refetch the affected products' categories and redisplay them
+        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts), { refresh: true });
 
         // Clear selections
         clearAllSelections();
@@ -207,8 +210,8 @@ async function handleRemoveCategory() {
         const result = await response.json();
         showSuccess(result.message || 'Categories removed successfully!'); // Use imported showSuccess
         
-        // Update category display for the affected products
-        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts));
+        // Refetch the affected products' categories and redisplay them
+        await updateCurrentCategoriesDisplayForProducts(Array.from(selectedProducts), { refresh: true });
 
         // Clear selections
         clearAllSelections();
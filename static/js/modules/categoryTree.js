@@ -2,6 +2,7 @@ import { showLoadingOverlay, showError, showSuccess } from '../utils/ui.js';
 import { categoryTree, selectedCategoriesList, categorySelectionSummary, productList } from '../domElements.js';
 import { allCategories, selectedCategories, updateBulkCategoryState, handleCategorySelection } from '../core/stateManager.js';
 import { updateAssignButtonState, updateSelectionDisplay, updateSelectedCategoriesDisplay } from '../uiHandlers.js';
+import { getProductCategories, refreshProductCategories } from './productCatalog.js';
 
 // Add event listener for refreshing category display
 document.addEventListener('refreshCategoryDisplay', async () => {
@@ -271,26 +272,21 @@ export function updateCategorySelectionSummary() {
     });
 }
 
-export async function updateCurrentCategoriesDisplayForProducts(productIdsToUpdate) {
+export async function updateCurrentCategoriesDisplayForProducts(productIdsToUpdate, { refresh = false } = {}) {
     if (!productIdsToUpdate || productIdsToUpdate.length === 0) return;
 
-    // Use the /api/products/bulk-categories endpoint
+    // Categories come with the product pages; only fetch products changed since or not loaded
     try {
-        const response = await fetch('/api/products/bulk-categories', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ product_ids: productIdsToUpdate })
-        });
-        if (!response.ok) {
-            throw new Error('Failed to fetch bulk category details');
-        }
-        const productsCategoriesMap = await response.json(); // Expects { product_id: [{id, name, level, parent}, ...], ... }
+        const toFetch = refresh
+            ? productIdsToUpdate
+            : productIdsToUpdate.filter(productId => getProductCategories(productId) === undefined);
+        await refreshProductCategories(toFetch);
 
         productIdsToUpdate.forEach(productId => {
             const cellId = `product-cats-${productId}`;
             const cell = document.getElementById(cellId);
             if (cell) {
-                const categoriesForProduct = productsCategoriesMap[productId] || [];
+                const categoriesForProduct = getProductCategories(productId) || [];
                 if (categoriesForProduct.length > 0) {
                     // Display as small chips
                     cell.innerHTML = categoriesForProduct.map(cat => {
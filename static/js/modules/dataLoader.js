@@ -3,6 +3,8 @@ import { appState } from '../appState.js';
 import { getProducts, setProducts, getFilteredProducts, setFilteredProducts, selectedProducts } from '../core/stateManager.js'; // Import state variables and setters
 import { productList, visibleCount, totalCount, selectionSummary } from '../domElements.js'; // Import DOM elements
 import { updateCurrentCategoriesDisplayForAllVisibleProducts } from './categoryTree.js';
+import { loadProductCatalog } from './productCatalog.js';
+import { fetchProducts } from '../services/ApiService.js';
 import { updateProductCounts, updateSelectionSummary } from '../uiHandlers.js';
 import { debouncedRefreshAllStatistics } from '../utils/statisticsManager.js';
 
@@ -10,19 +12,18 @@ import { debouncedRefreshAllStatistics } from '../utils/statisticsManager.js';
 export async function loadProducts() {
     showLoadingOverlay(true, 'Loading products...');
     try {
-        const response = await fetch('/api/products');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        setProducts(await response.json());
-        setFilteredProducts([...getProducts()]); // Initialize filteredProducts
-        
         // Check if we're on the main page (index.html) or bulk assignment page
         if (appState.getCurrentPage() === 'main') {
+            // The dropdown only needs names
+            setProducts(await fetchProducts());
+            setFilteredProducts([...getProducts()]); // Initialize filteredProducts
             await populateProductDropdown(getProducts());
         } else {
+            // Products arrive with their categories, so rendering them needs no further requests
+            setProducts(await loadProductCatalog());
+            setFilteredProducts([...getProducts()]); // Initialize filteredProducts
             renderProducts(getFilteredProducts());
-            await updateCurrentCategoriesDisplayForAllVisibleProducts(); // Fetch categories for initially loaded products
+            await updateCurrentCategoriesDisplayForAllVisibleProducts();
         }
     } catch (error) {
         console.error('Failed to load products:', error);
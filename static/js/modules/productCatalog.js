@@ -0,0 +1,113 @@
+// productCatalog.js: the product list with each product's categories, loaded
+// page by page from /api/products/page instead of /api/products followed by
+// bulk-categories and bulk-categories-summary calls, then kept current by the
+// server's change feed rather than by refetching
+
+import { fetchProductPage, fetchBulkProductCategories, subscribeToChanges } from '../services/ApiService.js';
+
+// Largest page the server accepts (services.MAX_PAGE_LIMIT)
+const PAGE_SIZE = 1000;
+
+// Milliseconds to gather change events before refetching, so a burst costs one request
+const CHANGE_BATCH_DELAY = 100;
+
+// product_id -> { categories: [{id, name, level, parent}], categoryCount }
+const productCategories = new Map();
+
+/**
+ * Loads every product with its categories, one page request per PAGE_SIZE products
+ * @param {Object} [options]
+ * @param {boolean} [options.hideAllocated=false] - Only load products without categories
+ * @returns {Promise<Array>} Products in /api/products order (without their categories)
+ */
+export async function loadProductCatalog({ hideAllocated = false } = {}) {
+    productCategories.clear();
+    const products = [];
+    let total = Infinity;
+    while (products.length < total) {
+        const page = await fetchProductPage({ limit: PAGE_SIZE, offset: products.length, hideAllocated });
+        total = page.total_products;
+        if (page.products.length === 0) break;
+        page.products.forEach(({ categories, ...product }) => {
+            productCategories.set(product.product_id, { categories, categoryCount: product.category_count });
+            products.push(product);
+        });
+    }
+    return products;
+}
+
+/**
+ * Categories of a loaded product
+ * @param {string} productId - ID of the product
+ * @returns {Array|undefined} Category objects, or undefined if the product is not loaded
+ */
+export function getProductCategories(productId) {
+    return productCategories.get(productId)?.categories;
+}
+
+/**
+ * Number of categories mapped to a loaded product, including any no longer in the taxonomy
+ * @param {string} productId - ID of the product
+ * @returns {number} Category count (0 for products not loaded)
+ */
+export function getCategoryCount(productId) {
+    return productCategories.get(productId)?.categoryCount ?? 0;
+}
+
+/**
+ * Refetches the categories of some products, e.g. after they were changed
+ * @param {Array<string>} productIds - IDs of the products to refresh
+ * @returns {Promise<void>}
+ */
+export async function refreshProductCategories(productIds) {
+    if (productIds.length === 0) return;
+    const categoriesMap = await fetchBulkProductCategories(productIds);
+    productIds.forEach(productId => {
+        // bulk-categories reports levels as "Level 2 Category"; the page endpoint as numbers
+        const categories = (categoriesMap[productId] || []).map(cat => ({
+            ...cat,
+            level: typeof cat.level === 'string' ? parseInt(cat.level.match(/\d+/)?.[0] || '1') : cat.level
+        }));
+        productCategories.set(productId, { categories, categoryCount: categories.length });
+    });
+}
+
+/**
+ * Keeps the loaded categories current from the server's change feed
+ * @param {Object} handlers
+ * @param {Function} handlers.onProductsChanged - Called with IDs of loaded products whose categories changed
+ * @param {Function} handlers.onTaxonomyChanged - Called with each taxonomy event (created, deleted or updated)
+ * @param {Function} handlers.onReset - Called when events were missed and the catalog must be reloaded
+ * @returns {EventSource} The event source; call close() to stop watching
+ */
+export function watchProductCatalog({ onProductsChanged, onTaxonomyChanged, onReset }) {
+    const pending = new Set();
+    let timer = null;
+
+    async function flush() {
+        timer = null;
+        const productIds = Array.from(pending);
+        pending.clear();
+        try {
+            await refreshProductCategories(productIds);
+        } catch (error) {
+            console.warn('Could not refresh changed products:', error);
+            return;
+        }
+        await onProductsChanged(productIds);
+    }
+
+    return subscribeToChanges((change) => {
+        if (change.type === 'taxonomy') {
+            onTaxonomyChanged(change);
+            return;
+        }
+        change.products
+            .map(product => product.product_id)
+            .filter(productId => productCategories.has(productId))
+            .forEach(productId => pending.add(productId));
+        if (pending.size > 0 && timer === null) {
+            timer = setTimeout(flush, CHANGE_BATCH_DELAY);
+        }
+    }, onReset);
+}
@@ -1,8 +1,10 @@
 import { productSearch, categoryFilter, productList } from '../domElements.js';
 import { getProducts, getFilteredProducts, setFilteredProducts } from '../core/stateManager.js';
-import { showError } from '../utils/ui.js';
-import { renderProducts } from './dataLoader.js';
-import { updateCurrentCategoriesDisplayForAllVisibleProducts } from './categoryTree.js';
+import { loadProducts, renderProducts } from './dataLoader.js';
+import {
+    updateCurrentCategoriesDisplayForAllVisibleProducts, updateCurrentCategoriesDisplayForProducts
+} from './categoryTree.js';
+import { getCategoryCount, watchProductCatalog } from './productCatalog.js';
 
 export async function applyProductFilters() {
     const searchTerm = productSearch.value.toLowerCase();
@@ -18,40 +20,22 @@ export async function applyProductFilters() {
         );
     }
     
-    // Apply category filter
+    // Apply category filter, using the category counts loaded with the product pages
     if (categoryFilterValue !== 'all') {
-        try {
-            // Get category data for all products that passed search filter
-            const productIds = filtered.map(p => p.product_id);
-            const response = await fetch('/api/products/bulk-categories', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' }, // Changed to application/json
-                body: JSON.stringify({ product_ids: productIds })
-            });
+        filtered = filtered.filter(product => {
+            const categoryCount = getCategoryCount(product.product_id);
             
-            if (response.ok) {
-                const categoryData = await response.json();
-                
-                filtered = filtered.filter(product => {
-                    const productCategories = categoryData[product.product_id] || [];
-                    const categoryCount = productCategories.length;
-                    
-                    switch (categoryFilterValue) {
-                        case 'uncategorized':
-                            return categoryCount === 0;
-                        case 'categorized':
-                            return categoryCount > 0;
-                        case 'multi-category':
-                            return categoryCount > 1;
-                        default:
-                            return true;
-                    }
-                });
+            switch (categoryFilterValue) {
+                case 'uncategorized':
+                    return categoryCount === 0;
+                case 'categorized':
+                    return categoryCount > 0;
+                case 'multi-category':
+                    return categoryCount > 1;
+                default:
+                    return true;
             }
-        } catch (error) {
-            console.error('Error applying category filter:', error);
-            showError('Failed to apply category filter');
-        }
+        });
     }
     
     setFilteredProducts(filtered);
@@ -59,3 +43,29 @@ export async function applyProductFilters() {
     renderProducts(getFilteredProducts());
     await updateCurrentCategoriesDisplayForAllVisibleProducts();
 }
+
+// Changes pushed by the server update the list in place; nothing is refetched on a timer
+export function watchProductChanges() {
+    return watchProductCatalog({
+        onProductsChanged: async (productIds) => {
+            if (categoryFilter.value !== 'all') {
+                // A change can move products in or out of the current filter
+                await applyProductFilters();
+            } else {
+                await updateCurrentCategoriesDisplayForProducts(productIds);
+            }
+        },
+        onTaxonomyChanged: async (change) => {
+            document.dispatchEvent(new Event('refreshCategoryDisplay'));
+            // A rename or move changes category names and levels on every product
+            if (change.updated) {
+                await loadProducts();
+                await applyProductFilters();
+            }
+        },
+        onReset: async () => {
+            await loadProducts();
+            await applyProductFilters();
+        }
+    });
+}
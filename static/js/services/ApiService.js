@@ -86,6 +86,46 @@ export async function fetchProducts(hideAllocated = false) {
     }
 }
 
+/**
+ * Fetches a page of products with their categories and category counts in one request
+ * @param {Object} options - Paging options
+ * @param {number} options.limit - Products per page (1-1000)
+ * @param {number} options.offset - Number of products to skip
+ * @param {boolean} options.hideAllocated - Whether to hide allocated products
+ * @returns {Promise<Object>} Page response; each product has category_count and categories
+ */
+export async function fetchProductPage({ limit = 100, offset = 0, hideAllocated = false } = {}) {
+    try {
+        const params = new URLSearchParams({ limit, offset, hide_allocated: hideAllocated });
+        return await fetchWithErrorHandling(`${API_BASE_URL}/products/page?${params}`);
+    } catch (error) {
+        console.error('Error fetching product page:', error);
+        throw new Error('Failed to load products. Please try again.');
+    }
+}
+
+/**
+ * Queries products by a boolean expression over categories
+ * @param {string|Object} expression - e.g. {and: ['Tile Adhesives', {not: 'Primers'}]}
+ * @param {Object} [options]
+ * @param {number} [options.limit=100] - Products per page
+ * @param {number} [options.offset=0] - Number of matching products to skip
+ * @param {boolean} [options.countOnly=false] - Only count the matching products
+ * @returns {Promise<Object>} The match count and a page of products
+ */
+export async function queryProducts(expression, { limit = 100, offset = 0, countOnly = false } = {}) {
+    try {
+        return await fetchWithErrorHandling(`${API_BASE_URL}/products/query`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ expression, limit, offset, count_only: countOnly })
+        });
+    } catch (error) {
+        console.error('Error querying products:', error);
+        throw error;
+    }
+}
+
 /**
  * Fetches detailed information for a specific product
  * @param {string|number} productId - ID of the product
@@ -136,6 +176,29 @@ export async function fetchLastModifiedTimestamp(productId) {
     }
 }
 
+/**
+ * Subscribes to mapping and taxonomy changes pushed by the server, replacing
+ * per-product last-modified polling. EventSource reconnects on its own and
+ * resumes from the last event it received.
+ * @param {Function} onChange - Called with each change event
+ *   ({type: 'mapping', products: [{product_id, category_count}], added, removed}
+ *    or {type: 'taxonomy', created|deleted|updated, previous})
+ * @param {Function} onReset - Called when events were missed and state must be refetched
+ * @returns {EventSource} The event source; call close() to unsubscribe
+ */
+export function subscribeToChanges(onChange, onReset = () => {}) {
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    source.onmessage = (event) => {
+        try {
+            onChange(JSON.parse(event.data));
+        } catch (error) {
+            console.warn('Ignoring malformed change event:', error);
+        }
+    };
+    source.addEventListener('reset', onReset);
+    return source;
+}
+
 // === CATEGORY RELATED API CALLS ===
 
 /**
@@ -152,6 +215,26 @@ export async function fetchLevel1Categories() {
     }
 }
 
+/**
+ * Fetches the category hierarchy as nested nodes with child and product counts
+ * @param {Object} [options]
+ * @param {string} [options.root] - Only return the subtree under this category
+ * @param {number} [options.depth] - Number of levels to return
+ * @returns {Promise<Object>} Response with the top-level nodes
+ */
+export async function fetchCategoryTree({ root, depth } = {}) {
+    try {
+        const params = new URLSearchParams();
+        if (root) params.set('root', root);
+        if (depth) params.set('depth', depth);
+        const query = params.toString();
+        return await fetchWithErrorHandling(`${API_BASE_URL}/categories/tree${query ? `?${query}` : ''}`);
+    } catch (error) {
+        console.error('Error fetching category tree:', error);
+        throw new Error('Failed to load categories. Please try again.');
+    }
+}
+
 /**
  * Fetches categories by level and parent ID
  * @param {number} level - Category level (2 or 3)
@@ -256,6 +339,33 @@ export async function deleteCategory(categoryName) {
     }
 }
 
+/**
+ * Renames a category and/or moves it under another parent
+ * @param {string} categoryName - Current name of the category
+ * @param {Object} changes - Any of {name, parent_id, level}; parent_id null moves it to the top level
+ * @returns {Promise<Object>} Update result with the affected product and mapping counts
+ */
+export async function updateCategory(categoryName, changes) {
+    try {
+        const url = `${API_BASE_URL}/categories/${encodeURIComponent(categoryName)}`;
+        const options = {
+            method: 'PUT',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(changes)
+        };
+        
+        return await fetchWithErrorHandling(url, options);
+    } catch (error) {
+        console.error('Error updating category:', error);
+        if (error.message.includes('already exists')) {
+            throw new Error(`Category "${changes.name}" already exists. Please choose a different name.`);
+        }
+        throw new Error(error.message || 'Failed to update category. Please try again.');
+    }
+}
+
 /**
  * Gets detailed information about a category
  * @param {string} categoryName - Name of the category
@@ -404,27 +514,3 @@ export function getErrorMessage(error) {
     if (error?.error) return error.error;
     return 'An unexpected error occurred. Please try again.';
 }
-
-/**
- * New function to get category counts efficiently for bulk operations.
- * @param {Array<string|number>} productIds - Array of product IDs.
- * @returns {Promise<Object>} Map of product ID to category counts.
- */
-export async function getCategoryCounts(productIds) {
-    if (productIds.length === 0) return {};
-    
-    try {
-        const response = await fetchWithErrorHandling('/api/products/bulk-categories-summary', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ product_ids: productIds })
-        });
-        
-        return response;
-    } catch (error) {
-        console.error('Error fetching category counts:', error);
-        throw new Error('Failed to load category counts');
-    }
-}
@@ -8,7 +8,7 @@
 
 import { 
     fetchLevel1Categories,
-    fetchCategoriesByLevelAndParent,
+    fetchCategoryTree,
     createCategory as apiCreateCategory,
     deleteCategory as apiDeleteCategory,
     fetchWithErrorHandling,
@@ -148,22 +148,10 @@ export class CategoryService {
                 // For level 2 categories, get all level 1 categories as potential parents
                 result = await fetchLevel1Categories();
             } else if (level === 3) {
-                // For level 3 categories, get all level 2 categories as potential parents
-                // This requires getting all level 1 categories first, then their children
-                const level1Categories = await fetchLevel1Categories();
-                const level2Categories = [];
-                
-                for (const level1Cat of level1Categories) {
-                    try {
-                        const children = await fetchCategoriesByLevelAndParent(2, level1Cat.id || level1Cat.name);
-                        level2Categories.push(...children);
-                    } catch (error) {
-                        // Continue if some level 1 categories don't have children
-                        console.warn(`No level 2 categories found for ${level1Cat.name}`);
-                    }
-                }
-                
-                result = level2Categories;
+                // For level 3 categories, all level 2 categories are potential parents
+                result = (await this.getCategoryTreeList(2))
+                    .filter(category => category.level === 2)
+                    .map(({ id, name, level, hasChildren }) => ({ id, name, level, hasChildren }));
             }
             
             // Cache the result
@@ -195,58 +183,7 @@ export class CategoryService {
         }
         
         try {
-            const allCategories = [];
-            
-            // Get level 1 categories
-            const level1Categories = await fetchLevel1Categories();
-            
-            for (const level1Cat of level1Categories) {
-                // Add level 1 category
-                allCategories.push({
-                    ...level1Cat,
-                    level: 1,
-                    displayName: level1Cat.name,
-                    fullPath: level1Cat.name
-                });
-                
-                try {
-                    // Get level 2 categories for this level 1 category
-                    const level2Categories = await fetchCategoriesByLevelAndParent(2, level1Cat.id || level1Cat.name);
-                    
-                    for (const level2Cat of level2Categories) {
-                        // Add level 2 category
-                        allCategories.push({
-                            ...level2Cat,
-                            level: 2,
-                            displayName: `  └─ ${level2Cat.name}`,
-                            fullPath: `${level1Cat.name} > ${level2Cat.name}`,
-                            parentName: level1Cat.name
-                        });
-                        
-                        try {
-                            // Get level 3 categories for this level 2 category
-                            const level3Categories = await fetchCategoriesByLevelAndParent(3, level2Cat.id || level2Cat.name);
-                            
-                            for (const level3Cat of level3Categories) {
-                                // Add level 3 category
-                                allCategories.push({
-                                    ...level3Cat,
-                                    level: 3,
-                                    displayName: `    └─ ${level3Cat.name}`,
-                                    fullPath: `${level1Cat.name} > ${level2Cat.name} > ${level3Cat.name}`,
-                                    parentName: level2Cat.name
-                                });
-                            }
-                        } catch (error) {
-                            // Continue if level 2 category has no children
-                            console.warn(`No level 3 categories found for ${level2Cat.name}`);
-                        }
-                    }
-                } catch (error) {
-                    // Continue if level 1 category has no children
-                    console.warn(`No level 2 categories found for ${level1Cat.name}`);
-                }
-            }
+            const allCategories = await this.getCategoryTreeList();
             
             // Cache the result
             this.cache.set(cacheKey, {
@@ -261,6 +198,36 @@ export class CategoryService {
         }
     }
     
+    /**
+     * Load the category tree in one request and flatten it depth-first
+     * @param {number} [depth] - Number of levels to load
+     * @returns {Promise<Array>} Categories in display order with hierarchical information
+     */
+    async getCategoryTreeList(depth) {
+        const response = await fetchCategoryTree({ depth });
+        // Flask returns the tree directly, FastAPI wraps it in the standard envelope
+        const tree = response.tree || response.data || [];
+        const categories = [];
+        
+        const visit = (node, parents) => {
+            const indent = '  '.repeat(parents.length - 1);
+            categories.push({
+                id: node.id,
+                name: node.id,
+                level: node.level,
+                hasChildren: node.child_count > 0,
+                productCount: node.product_count,
+                displayName: parents.length ? `${indent}  └─ ${node.id}` : node.id,
+                fullPath: [...parents, node.id].join(' > '),
+                ...(parents.length ? { parentName: parents[parents.length - 1] } : {})
+            });
+            node.children.forEach(child => visit(child, [...parents, node.id]));
+        };
+        tree.forEach(node => visit(node, []));
+        
+        return categories;
+    }
+    
     /**
      * Check if a category name already exists
      * @param {string} name - Category name to check
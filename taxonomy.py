@@ -0,0 +1,156 @@
+"""
+In-memory category taxonomy index for Tag Manager V2
+
+data/category.json is the source of truth for the category hierarchy. The
+index is parsed once per file version and shared, so lookups by name, parent
+chains and child lists no longer rescan the JSON list.
+"""
+
+import json
+import threading
+from typing import Dict, List, Optional
+
+import database
+import invalidation
+import metrics
+
+
+LEVEL_NAMES = {
+    'Level 1 Category': 1,
+    'Level 2 Category': 2,
+    'Level 3 Category': 3,
+}
+
+
+class CategoryIndex:
+    """Lookup structures built from the raw category.json entries"""
+
+    def __init__(self, categories: List[dict]):
+        self.categories = categories
+        self.by_name: Dict[str, dict] = {}
+        self.children: Dict[Optional[str], List[dict]] = {}
+        self._resolved: Dict[str, dict] = {}
+        for cat in categories:
+            self.by_name.setdefault(cat['category_name'], cat)
+            self.children.setdefault(cat.get('connected_to'), []).append(cat)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def get(self, name: str) -> Optional[dict]:
+        """Return the raw category entry for a name, if any"""
+        return self.by_name.get(name)
+
+    def level(self, name: str) -> Optional[int]:
+        """Return the numeric level (1-3) of a category"""
+        cat = self.by_name.get(name)
+        return LEVEL_NAMES.get(cat['category_level']) if cat else None
+
+    def ancestors(self, name: str) -> List[str]:
+        """Return parent names from the immediate parent up to the root"""
+        result = []
+        seen = {name}
+        cat = self.by_name.get(name)
+        while cat and cat.get('connected_to'):
+            parent_name = cat['connected_to']
+            if parent_name in seen:
+                break
+            seen.add(parent_name)
+            result.append(parent_name)
+            cat = self.by_name.get(parent_name)
+        return result
+
+    def path(self, name: str) -> List[str]:
+        """Return names from the root down to the category itself"""
+        return list(reversed(self.ancestors(name))) + [name]
+
+    def resolve(self, name: str) -> Optional[dict]:
+        """
+        Return the category with its numeric level and path from the root.
+
+        The index is rebuilt rather than changed when the taxonomy changes,
+        so each resolved entry is built once and shared; callers must not
+        modify it.
+        """
+        resolved = self._resolved.get(name)
+        if resolved is None:
+            cat = self.by_name.get(name)
+            if cat is None:
+                return None
+            resolved = self._resolved[name] = {
+                'id': name,
+                'name': name,
+                'level': LEVEL_NAMES.get(cat['category_level']),
+                'parent': cat.get('connected_to'),
+                'path': self.path(name),
+            }
+        return resolved
+
+    def descendants(self, name: str) -> List[str]:
+        """Return every category below a category, parents before children"""
+        result = []
+        seen = {name}
+        pending = [name]
+        while pending:
+            for child in self.child_names(pending.pop(0)):
+                if child not in seen:
+                    seen.add(child)
+                    result.append(child)
+                    pending.append(child)
+        return result
+
+    def child_names(self, name: str) -> List[str]:
+        """Return the names of direct child categories"""
+        return [cat['category_name'] for cat in self.children.get(name, [])]
+
+    def has_children(self, name: str) -> bool:
+        return bool(self.children.get(name))
+
+    def details(self, name: str) -> Optional[dict]:
+        """Return the category in the shape used by the Flask product endpoints"""
+        cat = self.by_name.get(name)
+        if cat is None:
+            return None
+        return {
+            'id': cat['category_name'],
+            'name': cat['category_name'],
+            'level': cat['category_level'],
+            'parent': cat.get('connected_to')
+        }
+
+
+_index: Optional[CategoryIndex] = None
+_index_version = None
+_index_lock = threading.Lock()
+_index_hits = 0
+_index_misses = 0
+
+
+def load_category_index() -> CategoryIndex:
+    """Build a new index from category.json as it is on disk now"""
+    try:
+        with open(database.CATEGORY_FILE) as f:
+            categories = json.load(f)
+    except FileNotFoundError:
+        categories = []
+    return CategoryIndex(categories)
+
+
+def get_category_index() -> CategoryIndex:
+    """Return the shared index, reloading it when the taxonomy has changed"""
+    global _index, _index_version, _index_hits, _index_misses
+    version = invalidation.version('taxonomy')
+    with _index_lock:
+        if _index is not None and _index_version == version:
+            _index_hits += 1
+        else:
+            _index_misses += 1
+            _index = load_category_index()
+            _index_version = version
+        return _index
+
+
+metrics.register_cache('taxonomy_index', lambda: (_index_hits, _index_misses))
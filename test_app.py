@@ -0,0 +1,71 @@
+"""
+Tests for the Flask app's own response handling (see conftest.py for the
+catalog)
+"""
+
+import gzip
+import json
+
+from flask import jsonify
+
+import app
+import compression
+import services
+from conftest import PRODUCTS
+
+
+def test_cached_bodies_match_jsonify(flask_client):
+    data = {'depth': 1, 'categories': [{'id': 'Sealants', 'level': 2}]}
+    with app.app.app_context():
+        assert app.json_bytes(data) == jsonify(data).get_data()
+
+    cached = flask_client.get('/api/categories/level1')
+    assert cached.status_code == 200
+    assert b'", "' not in cached.data and b'": ' not in cached.data
+    assert cached.get_json()[0]['id'] == 'Adhesives & Sealants'
+
+
+def test_products_stream_as_ndjson_only_when_preferred(flask_client):
+    streamed = flask_client.get('/api/products', headers={'Accept': 'application/x-ndjson'})
+    assert streamed.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in streamed.data.splitlines()]
+    assert [line['product_id'] for line in lines] == [product_id for product_id, _ in PRODUCTS]
+
+    refused = flask_client.get('/api/products', headers={'Accept': 'application/x-ndjson;q=0, */*'})
+    assert refused.mimetype == 'application/json'
+    assert len(refused.get_json()) == len(PRODUCTS)
+
+
+def test_query_rejects_malformed_bodies_with_400(flask_client):
+    for body in ([], {'expression': 'Sealants', 'limit': 'ten'}, {'limit': 5}, 'Sealants'):
+        response = flask_client.post('/api/products/query', json=body)
+        assert response.status_code == 400, body
+        assert response.get_json()['error'] == 'Validation Error'
+    response = flask_client.post('/api/products/query', data='{not json', content_type='application/json')
+    assert response.status_code == 400
+
+    response = flask_client.post('/api/products/query', json={'expression': 'Sealants', 'limit': '5'})
+    assert response.status_code == 200
+    assert response.get_json()['limit'] == 5
+
+
+def test_cached_payloads_are_precompressed_and_revalidated(flask_client, conn, monkeypatch):
+    monkeypatch.setattr(compression, 'COMPRESSION_MIN_SIZE', 0)
+    plain = flask_client.get('/api/categories')
+    compressed = flask_client.get('/api/categories', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers['ETag'] == plain.headers['ETag']
+
+    etag = plain.headers['ETag']
+    hits = app.response_cache.hits
+    revalidated = flask_client.get('/api/categories', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert app.response_cache.hits == hits + 1
+
+    # A write changes the counts listed, so the old ETag no longer matches
+    services.assign_categories(conn, 'product-1', ['Sealants'])
+    changed = flask_client.get('/api/categories', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
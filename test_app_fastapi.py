@@ -0,0 +1,41 @@
+"""
+Tests for the FastAPI app's response handling (see conftest.py for the
+catalog)
+"""
+
+import json
+
+import pytest
+
+from conftest import PRODUCTS
+
+
+def test_categorization_status_streams_as_ndjson_only_when_preferred(fastapi_client):
+    streamed = fastapi_client.get('/api/products/categorization-status',
+                                  headers={'Accept': 'application/x-ndjson'})
+    assert streamed.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert sorted(line['product_id'] for line in lines) == sorted(product_id for product_id, _ in PRODUCTS)
+
+    refused = fastapi_client.get('/api/products/categorization-status',
+                                 headers={'Accept': 'application/x-ndjson;q=0, */*'})
+    assert refused.headers['content-type'].startswith('application/json')
+    assert refused.json()['metadata']['total_products'] == len(PRODUCTS)
+
+
+@pytest.mark.parametrize('url', [
+    '/',
+    '/docs',
+    '/api/products',
+    '/api/products?hide_allocated=true',
+    '/api/categories',
+    '/api/categories/level1',
+])
+def test_endpoints_respond(fastapi_client, url):
+    assert fastapi_client.get(url).status_code == 200
+
+
+def test_products_listing_matches_catalog(fastapi_client):
+    listed = fastapi_client.get('/api/products').json()
+    assert listed['metadata']['total_products'] == len(PRODUCTS)
+    assert [product['product_id'] for product in listed['data']] == [product_id for product_id, _ in PRODUCTS]
@@ -0,0 +1,151 @@
+"""
+Tests for schema setup and the move from text-keyed to integer mapping rows
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import rollups
+import services
+
+# The schema as it was before mapping rows became integer pairs
+TEXT_KEYED_SCHEMA = '''
+    CREATE TABLE product_categories (
+        product_id TEXT PRIMARY KEY,
+        product_name TEXT NOT NULL,
+        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE product_category_mapping (
+        product_id TEXT,
+        category_id TEXT,
+        PRIMARY KEY (product_id, category_id),
+        FOREIGN KEY (product_id) REFERENCES product_categories(product_id)
+    );
+    CREATE TABLE category_closure (
+        ancestor TEXT NOT NULL,
+        descendant TEXT NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor, descendant)
+    ) WITHOUT ROWID;
+    CREATE TABLE category_counts (
+        category_id TEXT PRIMARY KEY,
+        direct_count INTEGER NOT NULL DEFAULT 0,
+        subtree_count INTEGER NOT NULL DEFAULT 0,
+        changes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE TABLE category_rollup_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        fingerprint TEXT NOT NULL
+    );
+    CREATE TRIGGER category_counts_mapping_insert
+    AFTER INSERT ON product_category_mapping
+    BEGIN
+        INSERT OR IGNORE INTO category_counts (category_id) VALUES (NEW.category_id);
+        UPDATE category_counts SET direct_count = direct_count + 1, changes = changes + 1
+        WHERE category_id = NEW.category_id;
+    END;
+'''
+
+TEXT_KEYED_MAPPINGS = [
+    ('zeta-1', 'Acrylic Adhesives'), ('zeta-1', 'Adhesives'), ('zeta-1', 'Adhesives & Sealants'),
+    ('alpha-2', 'Sealants'), ('alpha-2', 'Adhesives & Sealants'),
+    ('mid-4', 'Retired Category'),
+]
+
+
+@pytest.fixture
+def text_keyed_db(data_dir):
+    conn = sqlite3.connect(database.DATABASE)
+    conn.executescript(TEXT_KEYED_SCHEMA)
+    conn.executemany('INSERT INTO product_categories (product_id, product_name, last_modified) VALUES (?, ?, ?)', [
+        ('zeta-1', 'Zeta', '2024-01-01 10:00:00'),
+        ('alpha-2', 'Alpha', '2024-01-02 10:00:00'),
+        ('gone-3', 'Gone', '2024-01-03 10:00:00'),
+        ('mid-4', 'Mid', '2024-01-04 10:00:00'),
+    ])
+    conn.execute("DELETE FROM product_categories WHERE product_id = 'gone-3'")
+    conn.executemany('INSERT INTO product_category_mapping VALUES (?, ?)', TEXT_KEYED_MAPPINGS)
+    conn.commit()
+    conn.close()
+    return data_dir
+
+
+def rows(conn, sql):
+    return [tuple(row) for row in conn.execute(sql)]
+
+
+def tables(conn):
+    return dict(rows(conn, "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+
+
+def test_text_keyed_database_is_migrated_on_connect(text_keyed_db):
+    conn = database.connect()
+
+    # Products keep their old rowids, so listing order and gaps are unchanged
+    assert rows(conn, 'SELECT product_int, product_id, product_name, last_modified FROM product_categories '
+                      'ORDER BY product_int') == [
+        (1, 'zeta-1', 'Zeta', '2024-01-01 10:00:00'),
+        (2, 'alpha-2', 'Alpha', '2024-01-02 10:00:00'),
+        (4, 'mid-4', 'Mid', '2024-01-04 10:00:00'),
+    ]
+    # Mappings survive as integer pairs, readable through the compatibility view
+    assert sorted(rows(conn, 'SELECT product_id, category_id FROM product_category_mapping')) == sorted(
+        TEXT_KEYED_MAPPINGS)
+    assert conn.execute('SELECT COUNT(*) FROM product_category_links').fetchone()[0] == len(TEXT_KEYED_MAPPINGS)
+    assert tables(conn)['product_category_mapping'] == 'view'
+    assert 'category_int' in database._columns(conn.cursor(), 'category_counts')
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'category_counts_mapping_%'"
+                        ).fetchone()[0] == 0
+    assert rows(conn, 'PRAGMA foreign_key_check') == []
+
+    # Derived data is rebuilt under integer keys at warm-up
+    assert rollups.ensure_current(conn)
+    assert rollups.get_counts(conn)['Adhesives & Sealants'] == (2, 2)
+    # Mapped but gone from category.json: counted directly, with no subtree
+    assert rollups.get_counts(conn)['Retired Category'] == (1, 0)
+    conn.close()
+
+
+def test_migration_runs_once(text_keyed_db):
+    conn = database.connect()
+    services.assign_categories(conn, 'mid-4', ['Epoxy Adhesives'])
+    before = sorted(rows(conn, 'SELECT product_int, category_int FROM product_category_links'))
+
+    database.ensure_table_schema(force=True)
+
+    assert sorted(rows(conn, 'SELECT product_int, category_int FROM product_category_links')) == before
+    conn.close()
+
+
+def test_mapping_view_accepts_writes(conn):
+    conn.execute("INSERT INTO product_category_mapping VALUES ('product-1', 'Sealants')")
+    conn.execute("INSERT INTO product_category_mapping VALUES ('product-2', 'Not In Taxonomy')")
+    conn.execute("UPDATE product_category_mapping SET category_id = 'Adhesives' "
+                 "WHERE product_id = 'product-1' AND category_id = 'Sealants'")
+    conn.execute("DELETE FROM product_category_mapping WHERE product_id = 'product-2'")
+    conn.commit()
+
+    assert services.get_product_category_ids(conn, 'product-1') == ['Adhesives']
+    assert services.get_product_category_ids(conn, 'product-2') == []
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO product_category_mapping VALUES ('no-such-product', 'Sealants')")
+    conn.rollback()
+
+
+def test_id_queries_take_more_ids_than_sqlite_binds(conn):
+    services.assign_categories(conn, 'product-1', ['Sealants'])
+    # Past SQLITE_MAX_VARIABLE_NUMBER (32766), with repeats across chunks
+    ids = ['product-1'] + [f'missing-{n}' for n in range(40000)] + ['product-2', 'product-1']
+
+    rows = database.iter_rows_for_ids(
+        conn, 'SELECT product_id FROM product_categories WHERE product_id IN (SELECT value FROM json_each(?))',
+        ids, chunk_size=1000
+    )
+    assert sorted(row[0] for row in rows) == ['product-1', 'product-2']
+
+    summary = services.get_bulk_categories_summary(conn, ids)
+    assert len(summary) == 40002
+    assert summary['product-1'] == services.get_bulk_categories_summary(conn, ['product-1'])['product-1'] > 0
+    assert summary['product-2'] == 0
@@ -0,0 +1,72 @@
+"""
+Tests for the FastAPI app's database lanes (see conftest.py for the catalog)
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import db_executor
+from db_executor import DatabaseExecutor, Lane, LaneBusyError
+
+
+def test_reads_run_while_the_bulk_lane_is_held(conn):
+    lanes = DatabaseExecutor(read_workers=2, write_workers=1, bulk_workers=1)
+    release = threading.Event()
+
+    def slow_bulk(db):
+        release.wait(timeout=5)
+        return 'bulk'
+
+    def count_products(db):
+        return db.execute('SELECT COUNT(*) FROM product_categories').fetchone()[0]
+
+    async def run():
+        bulk = asyncio.ensure_future(lanes.bulk(slow_bulk))
+        # The read finishes while the bulk job still holds its only thread
+        count = await asyncio.wait_for(lanes.read(count_products), timeout=2)
+        assert not bulk.done()
+        release.set()
+        return count, await bulk
+
+    try:
+        assert asyncio.run(run()) == (6, 'bulk')
+    finally:
+        release.set()
+        lanes.shutdown()
+
+
+def test_full_queue_rejects_new_work(conn):
+    lane = Lane('test', workers=1, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def hold(db):
+        started.set()
+        release.wait(timeout=5)
+
+    async def run():
+        running = asyncio.ensure_future(lane.submit(hold))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        queued = asyncio.ensure_future(lane.submit(lambda db: 'queued'))
+        await asyncio.sleep(0)  # let it take the one queue slot
+        with pytest.raises(LaneBusyError):
+            await lane.submit(lambda db: 'rejected')
+        release.set()
+        await running
+        return await queued
+
+    try:
+        assert asyncio.run(run()) == 'queued'
+        assert lane.stats()['rejected'] == 1
+    finally:
+        release.set()
+        lane.shutdown()
+
+
+def test_busy_lane_answers_503(fastapi_client, monkeypatch):
+    monkeypatch.setattr(db_executor.executor.lanes['read'], 'max_queue', 0)
+    response = fastapi_client.get('/api/categories/level1')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert response.json()['details'] == {'lane': 'read', 'queue_limit': 0}
@@ -0,0 +1,75 @@
+"""
+Tests for the queued bulk job runner (see conftest.py for the catalog)
+"""
+
+import pytest
+
+import invalidation
+import jobs
+import services
+
+
+@pytest.fixture(autouse=True)
+def no_background_runner(monkeypatch):
+    # Tests drive their own runner; the process-wide one would race them
+    monkeypatch.setattr(jobs.runner, 'wake', lambda: None)
+
+
+def claims_taken():
+    return services.write_metrics.stats().get('claim_job', {}).get('transactions', 0)
+
+
+def test_claim_skips_write_lock_when_queue_is_empty(conn):
+    runner = jobs.JobRunner()
+    before = claims_taken()
+
+    assert runner._claim(conn) is None
+    assert claims_taken() == before
+
+
+def test_stale_running_jobs_are_requeued_and_run(conn):
+    job = jobs.submit(conn, 'bulk-assign', {'product_ids': ['product-1'], 'category_ids': ['Sealants']})
+    # As a worker that crashed mid-job leaves it
+    conn.execute('''
+        UPDATE bulk_jobs SET status = 'running', started_at = datetime('now', '-2 hours') WHERE id = ?
+    ''', (job['job_id'],))
+    conn.commit()
+    runner = jobs.JobRunner()
+
+    assert runner._requeue_stale(conn) == 1
+    assert jobs.get_job(conn, job['job_id'])['status'] == 'queued'
+    assert runner._run_next(conn)
+    assert jobs.get_job(conn, job['job_id'])['status'] == 'done'
+    assert services.get_product_category_ids(conn, 'product-1') == ['Adhesives & Sealants', 'Sealants']
+
+
+def test_recently_started_jobs_are_left_running(conn):
+    job = jobs.submit(conn, 'bulk-assign', {'product_ids': ['product-1'], 'category_ids': ['Sealants']})
+    conn.execute("UPDATE bulk_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                 (job['job_id'],))
+    conn.commit()
+
+    assert jobs.JobRunner()._requeue_stale(conn) == 0
+    assert jobs.get_job(conn, job['job_id'])['status'] == 'running'
+
+
+def test_job_bookkeeping_leaves_product_caches_alone(conn):
+    before = invalidation.version('products', 'taxonomy')
+    job = jobs.submit(conn, 'bulk-assign', {'product_ids': ['product-1'], 'category_ids': ['Sealants']})
+    assert invalidation.version('products', 'taxonomy') == before
+
+    assert jobs.JobRunner()._run_next(conn)
+    assert jobs.get_job(conn, job['job_id'])['status'] == 'done'
+    # Only the mapping write itself moves the products scope
+    assert invalidation.version('products') == (before[0] + 1,)
+    assert invalidation.version('taxonomy') == before[1:]
+
+
+def test_submitted_jobs_wake_runners_in_other_workers(conn):
+    runner = jobs.JobRunner()
+    before = invalidation.version('products', 'taxonomy', 'jobs')
+
+    jobs.submit(conn, 'bulk-assign', {'product_ids': ['product-1'], 'category_ids': ['Sealants']})
+
+    assert invalidation.version('products', 'taxonomy', 'jobs') == (before[0], before[1], before[2] + 1)
+    assert runner._wake.is_set()
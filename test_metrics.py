@@ -0,0 +1,64 @@
+"""
+Tests for the /metrics exposition in both apps (see conftest.py for the
+catalog)
+"""
+
+import metrics
+
+
+def samples(text):
+    """Sample lines of a Prometheus text exposition, as {name{labels}: value}"""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            result[name] = float(value)
+    return result
+
+
+def test_histograms_render_cumulative_buckets():
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', ('route',), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, ('/a"b',))
+
+    lines = histogram.render()
+
+    assert lines[:2] == ['# HELP tagmanager_test_seconds Test histogram',
+                         '# TYPE tagmanager_test_seconds histogram']
+    assert samples('\n'.join(lines)) == {
+        'tagmanager_test_seconds_bucket{route="/a\\"b",le="0.1"}': 1,
+        'tagmanager_test_seconds_bucket{route="/a\\"b",le="1"}': 3,
+        'tagmanager_test_seconds_bucket{route="/a\\"b",le="+Inf"}': 4,
+        'tagmanager_test_seconds_count{route="/a\\"b"}': 4,
+        'tagmanager_test_seconds_sum{route="/a\\"b"}': 6.05,
+    }
+
+
+def test_flask_counts_requests_by_route_template(flask_client):
+    sample = 'tagmanager_http_requests_total{route="/api/products/<product_id>/categories",method="GET",status="200"}'
+    before = samples(flask_client.get('/metrics').get_data(as_text=True)).get(sample, 0)
+
+    response = flask_client.get('/api/products/product-1/categories', headers={'X-Request-ID': 'req-42'})
+    assert response.headers['X-Request-ID'] == 'req-42'
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    # Recorded once the body has been sent, which closes the response
+    response.close()
+
+    exposition = flask_client.get('/metrics')
+    assert exposition.content_type == metrics.CONTENT_TYPE
+    text = exposition.get_data(as_text=True)
+    assert samples(text)[sample] == before + 1
+    assert 'product-1' not in text
+
+
+def test_fastapi_counts_requests_by_route_template(fastapi_client):
+    sample = 'tagmanager_http_requests_total{route="/api/products/{product_id}/categories",method="GET",status="200"}'
+    before = samples(fastapi_client.get('/metrics').text).get(sample, 0)
+
+    response = fastapi_client.get('/api/products/product-1/categories')
+    assert len(response.headers['X-Request-ID']) == 32
+
+    text = fastapi_client.get('/metrics').text
+    assert samples(text)[sample] == before + 1
+    assert 'product-1' not in text
+    assert 'tagmanager_db_statements_total{route="/api/products/{product_id}/categories",method="GET"}' in text
@@ -0,0 +1,73 @@
+"""
+Tests for on-demand request profiling (see conftest.py for the catalog)
+"""
+
+import marshal
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Imported while profiling is off, so neither app installs its own middleware
+import app
+import app_fastapi
+import profiling
+
+TOKEN = 'profile-secret'
+
+
+@pytest.fixture
+def profiling_enabled(monkeypatch):
+    """PROFILING_TOKEN set, with an empty ring buffer"""
+    monkeypatch.setattr(profiling, 'TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'ENABLED', True)
+    monkeypatch.setattr(profiling, 'profiles', profiling.ProfileStore(size=2))
+
+
+def profiled_functions(pstats_bytes):
+    """Function names in a downloaded .prof file"""
+    return {name for _, _, name in marshal.loads(pstats_bytes)}
+
+
+def test_flask_profiles_requests_with_the_token(flask_client, profiling_enabled, monkeypatch):
+    monkeypatch.setattr(app.app, 'wsgi_app', profiling.ProfilingWSGIMiddleware(app.app.wsgi_app))
+
+    assert 'X-Profile-ID' not in flask_client.get('/api/products/product-1/categories').headers
+    response = flask_client.get('/api/products/product-1/categories', headers={profiling.HEADER: TOKEN})
+    profile_id = response.headers['X-Profile-ID']
+    # Kept once the body has been sent, which closes the response
+    response.close()
+
+    [info] = flask_client.get('/api/admin/profiles', query_string={profiling.QUERY_PARAM: TOKEN}).get_json()
+    assert info['profile_id'] == profile_id
+    assert info['path'] == '/api/products/product-1/categories'
+    assert info['status'] == 200
+    assert info['request_id'] == response.headers['X-Request-ID']
+
+    url = f'/api/admin/profiles/{profile_id}'
+    summary = flask_client.get(url, headers={profiling.HEADER: TOKEN}).get_data(as_text=True)
+    assert 'cumulative' in summary
+    download = flask_client.get(url, query_string={'format': 'pstats'}, headers={profiling.HEADER: TOKEN})
+    assert 'get_product_categories' in profiled_functions(download.data)
+
+
+def test_fastapi_profile_includes_work_on_the_database_lanes(conn, profiling_enabled):
+    client = TestClient(profiling.ProfilingMiddleware(app_fastapi.app))
+
+    response = client.get('/api/products/product-1/categories', params={profiling.QUERY_PARAM: TOKEN})
+    profile_id = response.headers['X-Profile-ID']
+
+    download = client.get(f'/api/admin/profiles/{profile_id}', params={'format': 'pstats'},
+                          headers={profiling.HEADER: TOKEN})
+    # The endpoint's coroutine and the query it ran on a lane thread, merged
+    functions = profiled_functions(download.content)
+    assert {'get_product_categories', 'get_product_category_ids'} <= functions
+
+
+def test_admin_endpoints_need_the_token(flask_client, monkeypatch):
+    assert flask_client.get('/api/admin/profiles').status_code == 404
+
+    monkeypatch.setattr(profiling, 'TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'ENABLED', True)
+    assert flask_client.get('/api/admin/profiles').status_code == 403
+    assert flask_client.get('/api/admin/profiles', headers={profiling.HEADER: 'wrong'}).status_code == 403
+    assert flask_client.get('/api/admin/profiles', headers={profiling.HEADER: TOKEN}).status_code == 200
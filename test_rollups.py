@@ -0,0 +1,132 @@
+"""
+Tests that the trigger-maintained category counts and the in-memory bitmaps
+follow every kind of write (see conftest.py for the catalog)
+"""
+
+import json
+
+import bitmaps
+import database
+import rollups
+import services
+from conftest import TAXONOMY, assert_counts_match_rebuild
+from taxonomy import CategoryIndex
+
+
+def assert_bitmaps_match_links(conn):
+    snapshot = bitmaps.index.snapshot(conn)
+    for name in services.get_category_index().by_name:
+        linked = {row[0] for row in conn.execute('''
+            SELECT l.product_int FROM product_category_links l
+            JOIN category_ids ci ON ci.category_int = l.category_int
+            WHERE ci.name = ?
+        ''', (name,))}
+        assert set(bitmaps.ordinals(snapshot.category(name))) == linked, name
+
+
+def assert_consistent(conn):
+    assert_counts_match_rebuild(conn)
+    assert_bitmaps_match_links(conn)
+
+
+def test_counts_follow_assign_and_remove(conn):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    services.assign_categories(conn, 'product-2', ['Epoxy Adhesives', 'Sealants'])
+
+    counts = rollups.get_counts(conn)
+    assert counts['Acrylic Adhesives'] == (1, 1)
+    assert counts['Adhesives'] == (2, 2)
+    # product-2 sits under the root twice but counts once in its subtree
+    assert counts['Adhesives & Sealants'] == (2, 2)
+    assert_consistent(conn)
+
+    services.remove_category(conn, 'product-2', 'Epoxy Adhesives')
+
+    counts = rollups.get_counts(conn)
+    assert counts['Epoxy Adhesives'] == (0, 0)
+    assert counts['Adhesives'] == (2, 2)
+    assert_consistent(conn)
+
+
+def test_counts_follow_bulk_writes(conn):
+    product_ids = [f'product-{n}' for n in range(1, 7)]
+    services.bulk_assign_categories(conn, product_ids, ['Liquid Membranes', 'Sealants'])
+    assert rollups.get_counts(conn)['Waterproofing Products'] == (6, 6)
+    assert_consistent(conn)
+
+    services.bulk_remove_categories(conn, product_ids[:4], ['Liquid Membranes'])
+
+    counts = rollups.get_counts(conn)
+    assert counts['Liquid Membranes'] == (2, 2)
+    # Only the leaf was removed; its ancestors stay mapped
+    assert counts['Waterproofing Membranes'] == (6, 6)
+    assert_consistent(conn)
+
+
+def test_counts_follow_category_moves_renames_and_deletes(conn):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    services.assign_categories(conn, 'product-2', ['Acrylic Adhesives', 'Epoxy Adhesives'])
+    services.assign_categories(conn, 'product-3', ['Liquid Membranes'])
+
+    services.update_category(conn, 'Acrylic Adhesives', {'parent_id': 'Waterproofing Membranes'})
+    counts = rollups.get_counts(conn)
+    assert counts['Waterproofing Products'] == (3, 3)
+    assert counts['Adhesives'] == (1, 1)
+    assert_consistent(conn)
+
+    services.update_category(conn, 'Waterproofing Membranes', {'name': 'Membranes'})
+    assert rollups.get_counts(conn)['Membranes'] == (3, 3)
+    assert_consistent(conn)
+
+    services.update_category(conn, 'Membranes', {'parent_id': 'Adhesives & Sealants'})
+    counts = rollups.get_counts(conn)
+    assert counts['Adhesives & Sealants'] == (3, 3)
+    assert counts['Waterproofing Products'] == (0, 0)
+    assert_consistent(conn)
+
+    services.delete_category(conn, 'Liquid Membranes')
+    assert rollups.get_counts(conn)['Membranes'] == (3, 3)
+    assert_consistent(conn)
+
+
+def test_edit_to_category_file_is_rebuilt_by_warm_up_not_reads(conn, data_dir):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    path = data_dir / 'category.json'
+    categories = json.loads(path.read_text())
+    for cat in categories:
+        if cat['category_name'] == 'Acrylic Adhesives':
+            cat['connected_to'] = 'Waterproofing Membranes'
+    # Moved by hand, outside the apps
+    path.write_text(json.dumps(categories, indent=2))
+
+    # Reads keep the last counts, even while another connection holds the write lock
+    writer = database.connect()
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        assert rollups.get_counts(conn)['Waterproofing Membranes'] == (0, 0)
+        assert services.query_products(conn, 'Acrylic Adhesives')['count'] == 1
+    finally:
+        writer.rollback()
+        writer.close()
+
+    assert rollups.ensure_current(conn)
+    assert rollups.get_counts(conn)['Waterproofing Membranes'] == (0, 1)
+    assert_counts_match_rebuild(conn)
+
+
+def test_stale_index_never_rolls_counts_back(conn):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    # As a worker that has not yet seen another worker's move
+    stale = CategoryIndex(TAXONOMY)
+    services.update_category(conn, 'Acrylic Adhesives', {'parent_id': 'Waterproofing Membranes'})
+    counts = rollups.get_counts(conn)
+    assert counts['Adhesives & Sealants'] == (0, 0)
+
+    assert not rollups.ensure_current(conn, stale)
+    assert rollups.get_counts(conn) == counts
+
+    # A rebuild that is due comes from category.json, not the caller's index
+    conn.execute("UPDATE category_rollup_state SET fingerprint = 'outdated'")
+    conn.commit()
+    assert rollups.ensure_current(conn, stale)
+    assert rollups.get_counts(conn) == counts
@@ -0,0 +1,25 @@
+"""
+Tests for the shared JSON and NDJSON encoding helpers
+"""
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from serialization import NDJSON_MIMETYPE, prefers_ndjson
+
+
+@pytest.mark.parametrize('accept', [
+    None, '', '*/*', 'application/json', NDJSON_MIMETYPE, 'APPLICATION/X-NDJSON',
+    'application/json, application/x-ndjson',
+    'application/x-ndjson, application/json;q=0.9',
+    'application/x-ndjson;q=0', 'application/x-ndjson;q=0, */*',
+    'application/json;q=0, */*;q=0.1',
+    'application/json;q=0.1, application/*;q=0.9',
+    'application/x-ndjson;q=0.5, */*;q=0.9',
+    'application/x-ndjson;q=abc', 'application/x-ndjson;q=2, application/json',
+    'application/x-ndjson; charset=utf-8',
+])
+def test_prefers_ndjson_agrees_with_werkzeug(accept):
+    best = parse_accept_header(accept, MIMEAccept).best_match(['application/json', NDJSON_MIMETYPE])
+    assert prefers_ndjson(accept) == (best == NDJSON_MIMETYPE)
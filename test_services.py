@@ -0,0 +1,160 @@
+"""
+Tests for the shared service layer, run against a small throwaway catalog
+(see conftest.py)
+"""
+
+import json
+import sqlite3
+
+import pytest
+
+import rollups
+import services
+from conftest import TAXONOMY, assert_counts_match_rebuild
+
+
+def categories_of(conn, product_id):
+    return services.get_product_category_ids(conn, product_id)
+
+
+def test_move_level3_category_across_roots(conn):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    services.assign_categories(conn, 'product-2', ['Acrylic Adhesives', 'Sealants'])
+    services.assign_categories(conn, 'product-3', ['Acrylic Adhesives', 'Epoxy Adhesives'])
+
+    result = services.update_category(conn, 'Acrylic Adhesives', {'parent_id': 'Waterproofing Membranes'})
+
+    assert result['products_affected'] == 3
+    assert categories_of(conn, 'product-1') == [
+        'Acrylic Adhesives', 'Waterproofing Membranes', 'Waterproofing Products']
+    # Sealants still lies below the old root, Epoxy Adhesives below both old ancestors
+    assert categories_of(conn, 'product-2') == [
+        'Acrylic Adhesives', 'Adhesives & Sealants', 'Sealants',
+        'Waterproofing Membranes', 'Waterproofing Products']
+    assert categories_of(conn, 'product-3') == [
+        'Acrylic Adhesives', 'Adhesives', 'Adhesives & Sealants', 'Epoxy Adhesives',
+        'Waterproofing Membranes', 'Waterproofing Products']
+    assert_counts_match_rebuild(conn)
+
+    services.update_category(conn, 'Acrylic Adhesives', {'parent_id': 'Adhesives'})
+
+    assert categories_of(conn, 'product-1') == ['Acrylic Adhesives', 'Adhesives', 'Adhesives & Sealants']
+    assert categories_of(conn, 'product-2') == [
+        'Acrylic Adhesives', 'Adhesives', 'Adhesives & Sealants', 'Sealants']
+    assert_counts_match_rebuild(conn)
+
+
+def test_rename_and_move_keep_categories_table_in_step(conn):
+    # As migrate_categories.py leaves it: every category mirrored, parents first
+    conn.executemany('INSERT INTO categories (id, name, level, parent_id) VALUES (?, ?, ?, ?)', [
+        (cat['category_name'], cat['category_name'], int(cat['category_level'].split()[1]), cat['connected_to'])
+        for cat in TAXONOMY
+    ])
+    conn.commit()
+
+    services.update_category(conn, 'Adhesives', {'name': 'Glues'})
+    services.update_category(conn, 'Glues', {'parent_id': 'Waterproofing Products'})
+    services.update_category(conn, 'Sealants', {'parent_id': None, 'level': 1})
+
+    rows = {tuple(row) for row in conn.execute('SELECT id, level, parent_id FROM categories')}
+    assert rows == {
+        (cat['category_name'], int(cat['category_level'].split()[1]), cat['connected_to'])
+        for cat in services.get_category_index().categories
+    }
+    assert ('Acrylic Adhesives', 3, 'Glues') in rows
+    assert ('Sealants', 1, None) in rows
+
+
+def test_failed_create_leaves_category_file_unchanged(conn, data_dir, monkeypatch):
+    before = (data_dir / 'category.json').read_text()
+
+    def fail(*args):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(rollups, 'add_category', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        services.create_category(conn, 'Silicone Sealants', 3, 'Sealants')
+
+    assert (data_dir / 'category.json').read_text() == before
+    assert 'Silicone Sealants' not in services.get_category_index()
+
+
+def test_delete_category_updates_file_mappings_and_counts_together(conn, data_dir):
+    services.create_category(conn, 'Silicone Sealants', 3, 'Sealants')
+    services.assign_categories(conn, 'product-1', ['Silicone Sealants'])
+
+    result = services.delete_category(conn, 'Silicone Sealants')
+
+    assert result['removed_from_products'] == 1
+    assert 'Silicone Sealants' not in {cat['category_name'] for cat in json.loads(
+        (data_dir / 'category.json').read_text())}
+    assert 'Silicone Sealants' not in services.get_category_index()
+    assert categories_of(conn, 'product-1') == ['Adhesives & Sealants', 'Sealants']
+    assert_counts_match_rebuild(conn)
+
+
+def test_query_products_combines_terms(conn):
+    services.assign_categories(conn, 'product-1', ['Acrylic Adhesives'])
+    services.assign_categories(conn, 'product-2', ['Epoxy Adhesives', 'Sealants'])
+    services.assign_categories(conn, 'product-3', ['Liquid Membranes'])
+
+    result = services.query_products(conn, {'and': [
+        {'category': 'Adhesives', 'subtree': True}, {'not': 'Sealants'}]})
+    assert result['count'] == 1
+    assert result['products'] == [{'product_id': 'product-1', 'product_name': 'Product 1'}]
+    assert services.query_products(conn, {'or': ['Sealants', 'Liquid Membranes']}, count_only=True) == {
+        'count': 2, 'limit': services.PAGE_LIMIT, 'offset': 0}
+
+
+@pytest.mark.parametrize('expression, message', [
+    ({'category': 'Sealants', 'and': ['Adhesives']}, 'Each query term needs exactly one'),
+    ({'xor': ['Sealants']}, 'Each query term needs exactly one'),
+    (42, 'Each query term needs exactly one'),
+    ({'and': []}, 'and needs a non-empty list of terms'),
+    ({'or': 'Sealants'}, 'or needs a non-empty list of terms'),
+    ({'and': ['Sealants'], 'subtree': True}, 'subtree only applies to a category term'),
+    ({'or': ['Sealants'] * (services.QUERY_MAX_TERMS + 1)}, 'Query expression is too large'),
+])
+def test_query_products_rejects_malformed_expressions(conn, expression, message):
+    with pytest.raises(services.ServiceError, match=message) as excinfo:
+        services.query_products(conn, expression)
+    assert not isinstance(excinfo.value, services.NotFoundError)
+
+
+def test_query_products_rejects_deep_expressions_and_bad_pages(conn):
+    expression = 'Sealants'
+    for _ in range(services.QUERY_MAX_DEPTH + 1):
+        expression = {'not': expression}
+    with pytest.raises(services.ServiceError, match='Query expression is too large'):
+        services.query_products(conn, expression)
+
+    with pytest.raises(services.NotFoundError):
+        services.query_products(conn, {'or': ['Sealants', 'No Such Category']})
+    with pytest.raises(services.ServiceError, match='limit must be between'):
+        services.query_products(conn, 'Sealants', limit=services.MAX_PAGE_LIMIT + 1)
+    with pytest.raises(services.ServiceError, match='offset must not be negative'):
+        services.query_products(conn, 'Sealants', offset=-1)
+
+
+def mapping_events(conn, after_id):
+    return [json.loads(row[0]) for row in conn.execute(
+        "SELECT payload FROM change_events WHERE id > ? ORDER BY id", (after_id,))]
+
+
+def test_bulk_change_events_report_only_rows_written(conn):
+    services.assign_categories(conn, 'product-1', ['Sealants'])
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM change_events').fetchone()[0]
+
+    services.bulk_assign_categories(conn, ['product-1', 'product-2'], ['Sealants', 'Epoxy Adhesives'])
+
+    events = sorted(mapping_events(conn, last_id), key=lambda event: len(event['added']))
+    assert [([p['product_id'] for p in e['products']], e['added']) for e in events] == [
+        (['product-1'], ['Adhesives', 'Epoxy Adhesives']),
+        (['product-2'], ['Adhesives', 'Adhesives & Sealants', 'Epoxy Adhesives', 'Sealants']),
+    ]
+
+    last_id = conn.execute('SELECT MAX(id) FROM change_events').fetchone()[0]
+    services.bulk_remove_categories(conn, ['product-1', 'product-3'], ['Sealants', 'Liquid Membranes'])
+
+    assert [([p['product_id'] for p in e['products']], e['removed']) for e in mapping_events(conn, last_id)] == [
+        (['product-1'], ['Sealants'])]
@@ -0,0 +1,94 @@
+"""
+Tests for single-flight request coalescing
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def wait_for_requests(flights, route, requests):
+    deadline = time.monotonic() + 5
+    while flights.stats().get(route, {}).get('requests', 0) < requests:
+        assert time.monotonic() < deadline, 'callers never arrived'
+        time.sleep(0.001)
+
+
+def run_concurrently(flights, callers, fn):
+    """Call flights.do from several threads while the first call is held; returns each outcome"""
+    release = threading.Event()
+    outcomes = [None] * callers
+
+    def held():
+        release.wait(timeout=5)
+        return fn()
+
+    def call(n):
+        try:
+            outcomes[n] = flights.do('stats', 'v1', held)
+        except Exception as e:
+            outcomes[n] = e
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(callers)]
+    for thread in threads:
+        thread.start()
+    wait_for_requests(flights, 'stats', callers)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight({'stats'})
+    executions = []
+
+    outcomes = run_concurrently(flights, 5, lambda: executions.append(1) or {'total': 6})
+
+    assert executions == [1]
+    assert all(outcome is outcomes[0] for outcome in outcomes)
+    assert flights.stats()['stats'] == {'requests': 5, 'executions': 1, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_waiters_share_the_leaders_exception():
+    flights = SingleFlight({'stats'})
+
+    def fail():
+        raise RuntimeError('database is locked')
+
+    outcomes = run_concurrently(flights, 3, fail)
+
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    # Nothing is kept once the flight lands
+    with pytest.raises(RuntimeError):
+        flights.do('stats', 'v1', fail)
+    assert flights.stats()['stats']['executions'] == 2
+
+
+def test_async_calls_share_one_execution():
+    flights = SingleFlight({'stats'})
+    executions = []
+
+    async def build():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return {'total': 6}
+
+    async def run():
+        return await asyncio.gather(*(flights.do_async('stats', 'v1', build) for _ in range(4)))
+
+    results = asyncio.run(run())
+
+    assert executions == [1]
+    assert results == [{'total': 6}] * 4
+    assert flights.stats()['stats']['coalesced'] == 3
+
+
+def test_other_routes_run_directly():
+    flights = SingleFlight({'stats'})
+    assert flights.do('export', 'v1', lambda: 'csv') == 'csv'
+    assert flights.stats() == {}
@@ -0,0 +1,75 @@
+"""
+Tests for per-request statement accounting (see conftest.py for the catalog)
+"""
+
+import contextvars
+import logging
+
+import metrics
+import sqltrace
+
+# 600 rows without touching the catalog
+NUMBERS = '''
+    WITH RECURSIVE n(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM n WHERE value < 600)
+    SELECT value FROM n
+'''
+
+
+def test_iteration_counts_rows_in_batches(conn, monkeypatch):
+    monkeypatch.setattr(sqltrace, 'ITER_BATCH', 64)
+    with metrics.background_request('test') as request_metrics:
+        assert sum(1 for _ in conn.execute(NUMBERS)) == 600
+        assert (request_metrics.statements, request_metrics.rows) == (1, 600)
+        assert request_metrics.traces[0].rows == 600
+
+        # A loop that stops early counts the rest of its batch
+        for _ in conn.execute(NUMBERS):
+            break
+        assert request_metrics.rows == 600 + 64
+        assert request_metrics.traces[1].rows == 64
+
+
+def test_fetch_calls_count_rows(conn):
+    with metrics.background_request('test') as request_metrics:
+        cursor = conn.execute('SELECT product_id FROM product_categories ORDER BY product_int')
+        assert cursor.fetchone()[0] == 'product-1'
+        assert len(cursor.fetchmany(2)) == 2
+        assert len(cursor.fetchall()) == 3
+        assert request_metrics.rows == 6
+
+
+def test_streamed_rows_count_towards_the_request_that_ran_them(conn):
+    with metrics.background_request('test') as request_metrics:
+        rows = iter(conn.execute('SELECT product_id FROM product_categories'))
+    # As a streamed response body is iterated after the handler returned
+    assert len(list(rows)) == 6
+    assert request_metrics.rows == 6
+
+
+def test_statements_outside_requests_are_not_traced(conn):
+    def run():
+        cursor = conn.execute(NUMBERS)
+        # A plain cursor iterates itself, with no batching generator
+        assert iter(cursor) is cursor
+        return sum(1 for _ in cursor)
+
+    # A fresh context, as the Flask test client leaves its last request set on this thread
+    assert contextvars.Context().run(run) == 600
+
+
+def test_slow_statements_are_logged_and_totalled(conn, monkeypatch, caplog):
+    monkeypatch.setattr(sqltrace, 'SLOW_QUERY_SECONDS', 0)
+    statement = "SELECT product_id FROM product_categories WHERE product_name != 'none' LIMIT 3"
+    normalized = 'SELECT product_id FROM product_categories WHERE product_name != ? LIMIT ?'
+    before = next((s for s in sqltrace.statement_stats.stats(limit=1000) if s['statement'] == normalized),
+                  {'calls': 0, 'rows': 0})
+
+    with caplog.at_level(logging.WARNING, logger='tag_manager.slow_query'):
+        with metrics.background_request('job test', 'req-7'):
+            assert len(conn.execute(statement).fetchall()) == 3
+
+    [message] = [record.getMessage() for record in caplog.records if normalized in record.getMessage()]
+    assert message.startswith('Slow query (')
+    assert message.endswith(f' ms, 3 rows) in job test [req-7]: {normalized}')
+    after = next(s for s in sqltrace.statement_stats.stats(limit=1000) if s['statement'] == normalized)
+    assert (after['calls'], after['rows']) == (before['calls'] + 1, before['rows'] + 3)
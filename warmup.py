@@ -0,0 +1,210 @@
+"""
+Startup warm-up and readiness state for Tag Manager V2
+
+Work that every worker would otherwise repeat on its first requests (parsing
+the taxonomy, building cached category payloads, compiling hot statements) is
+done before traffic is accepted. Under serve.py the shared part runs once in
+the master before workers are forked, so each worker starts with it in memory
+and only opens and primes its own database connections.
+
+A process reports ready through the apps' /api/ready endpoint only after its
+own warm-up has finished.
+
+Loading the product CSV (data/input_file.csv) is not part of readiness.
+IMPORT_ON_STARTUP selects how startup handles it:
+
+- background (default): import on a thread while the app already serves
+- blocking: import before the process reports ready
+- off: leave it to an explicit `python warmup.py import [--force]`
+
+In every mode a file that was already imported unchanged is skipped, so
+restarts do not re-read it. Under serve.py every worker starts the import
+after fork; they take turns on a lock file next to the database, so one of
+them imports and the others find nothing left to do.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, where serve.py runs a single process
+    fcntl = None
+
+import database
+import invalidation
+import metrics
+import services
+from taxonomy import get_category_index
+
+logger = logging.getLogger('tag_manager.warmup')
+
+IMPORT_MODES = ('background', 'blocking', 'off')
+IMPORT_ON_STARTUP = os.environ.get('IMPORT_ON_STARTUP', 'background')
+
+_ready = threading.Event()
+_preloaded_version = None
+
+_import_lock = threading.Lock()
+_import_thread: Optional[threading.Thread] = None
+_import_error: Optional[str] = None
+
+
+def category_urls() -> List[str]:
+    """Category endpoints whose cached payloads are built during warm-up"""
+    index = get_category_index()
+    urls = ['/api/categories', '/api/categories/level1']
+    for cat in index.categories:
+        if not index.has_children(cat['category_name']):
+            continue
+        level = index.level(cat['category_name'])
+        if level in (1, 2):
+            urls.append(f"/api/categories/level{level + 1}/{cat['category_name']}")
+    return urls
+
+
+def warm_encodings() -> List[str]:
+    """Accept-Encoding values to request so each compressed variant is cached"""
+    from compression import brotli
+    return ['gzip', 'br'] if brotli is not None else ['gzip']
+
+
+def prepare_statements(conn: sqlite3.Connection):
+    """
+    Compile the hot read statements into a connection's statement cache.
+
+    sqlite3 caches prepared statements per connection by SQL text, so the
+    statements are run through the same service functions the endpoints use,
+    with ids that match nothing.
+    """
+    services.get_product_category_ids(conn, '')
+    services.get_bulk_product_categories(conn, [''])
+    services.get_bulk_categories_summary(conn, [''])
+    services.get_products_by_category(conn, '')
+    try:
+        services.get_product_last_modified(conn, '')
+    except services.NotFoundError:
+        pass
+
+
+def import_products(mode: str = IMPORT_ON_STARTUP):
+    """Load the product CSV at startup as IMPORT_ON_STARTUP says"""
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"IMPORT_ON_STARTUP must be one of {', '.join(IMPORT_MODES)}, not {mode!r}")
+    if mode == 'blocking':
+        _run_import()
+    elif mode == 'background':
+        start_import()
+
+
+def start_import(force: bool = False) -> bool:
+    """Import the product CSV on a background thread; False if one is running or nothing changed"""
+    global _import_thread
+    with _import_lock:
+        if _import_thread is not None and _import_thread.is_alive():
+            return False
+        if not force and not database.import_pending():
+            return False
+        _import_thread = threading.Thread(target=_run_import, args=(force,), name='product-import', daemon=True)
+        _import_thread.start()
+        return True
+
+
+@contextmanager
+def _import_turn():
+    """
+    Wait for other processes importing into the same database. Every worker
+    starts the import, so they queue here; the first imports the file and
+    the rest find it already imported.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f'{database.DATABASE}.import-lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _run_import(force: bool = False):
+    global _import_error
+    try:
+        with metrics.background_request('import products'), _import_turn():
+            rows = database.init_products(force=force)
+    except Exception as e:
+        logger.exception('Product import failed')
+        _import_error = str(e)
+        return
+    _import_error = None
+    if rows is not None:
+        logger.info('Imported %d products from %s', rows, database.IMPORT_FILE)
+
+
+def import_status() -> dict:
+    """State of the product CSV import in this process"""
+    if _import_thread is not None and _import_thread.is_alive():
+        state = 'running'
+    elif _import_error is not None:
+        state = 'failed'
+    elif database.import_pending():
+        state = 'pending'
+    else:
+        state = 'done'
+    return {'state': state, 'mode': IMPORT_ON_STARTUP, 'error': _import_error}
+
+
+def mark_preloaded():
+    """Record that shared caches are warm for the current taxonomy"""
+    global _preloaded_version
+    _preloaded_version = invalidation.version('taxonomy')
+
+
+def is_preloaded() -> bool:
+    """Whether shared caches were warmed for the taxonomy currently on disk"""
+    return _preloaded_version == invalidation.version('taxonomy')
+
+
+def mark_ready():
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> dict:
+    """Readiness details reported by the /api/ready endpoints"""
+    return {
+        'ready': is_ready(),
+        'pid': os.getpid(),
+        'preloaded': is_preloaded(),
+        'categories': len(get_category_index()),
+        'import': import_status(),
+    }
+
+
+def _reset_after_fork():
+    # Shared caches are inherited, but a forked worker is not ready until it
+    # has opened and primed its own connections
+    global _ready
+    _ready = threading.Event()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=f'Load products from {database.IMPORT_FILE}')
+    parser.add_argument('command', choices=['import'])
+    parser.add_argument('--force', action='store_true', help='Import even if this file was imported before')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=metrics.LOG_FORMAT)
+    with _import_turn():
+        imported = database.init_products(force=args.force)
+    print(f'Imported {imported} products' if imported is not None else 'Already up to date')